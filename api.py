@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+
+from cache import TTLCache
+from engine import (
+    INDEXES, astream_answer, answer_async, corpus_exists, engine_stats, new_memory,
+    readiness, start_background_load,
+)
+from index_registry import list_corpora
+from metrics import METRICS
+
+# --- CONFIGURATION ---
+API_HOST = os.getenv("RAG_API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("RAG_API_PORT", "8000"))
+API_WORKERS = int(os.getenv("RAG_API_WORKERS", "2"))
+# Mémoires de conversation (résumé glissant) gardées par worker : LRU + expiration
+SESSION_MEMORY_MAX = int(os.getenv("RAG_SESSION_MEMORY_MAX", "5000"))
+SESSION_MEMORY_TTL = int(os.getenv("RAG_SESSION_MEMORY_TTL", str(6 * 3600)))
+
+_MEMORIES = TTLCache(max_entries=SESSION_MEMORY_MAX, ttl_seconds=SESSION_MEMORY_TTL)
+
+HTTP_REQUESTS = METRICS.counter("rag_http_requests_total", "Requêtes HTTP par route et code de réponse.")
+# Pour /chat/stream, jusqu'à l'envoi des en-têtes : la durée du tour est dans rag_turn_seconds
+HTTP_SECONDS = METRICS.histogram("rag_http_request_seconds", "Durée de traitement des requêtes HTTP.")
+STREAM_ERRORS = METRICS.counter("rag_stream_errors_total", "Erreurs signalées dans un flux SSE déjà ouvert.")
+METRICS.register_collector(lambda: [
+    ("rag_sessions", "gauge", "Mémoires de conversation gardées par ce worker.", {}, _MEMORIES.stats()["entries"]),
+])
+
+class Message(BaseModel):
+    role: str
+    content: str
+
+class ChatRequest(BaseModel):
+    question: str = Field(min_length=1)
+    history: list[Message] = []
+    # Sans session_id, seule la fenêtre récente de l'historique est envoyée (pas de résumé)
+    session_id: str | None = None
+    # Corpus interrogé (index nommé) ; par défaut RAG_DEFAULT_CORPUS
+    corpus: str | None = None
+
+@asynccontextmanager
+async def lifespan(app):
+    # Chaque worker charge son moteur en arrière-plan : /health répond immédiatement,
+    # /ready passe à 200 une fois le modèle, l'index et la chauffe terminés
+    start_background_load()
+    yield
+
+app = FastAPI(title="Unibot Advisor API", lifespan=lifespan)
+
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Gabarit de la route ("/indexes/{corpus}/reload") : pas une série par corpus ou par chemin inconnu
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        HTTP_REQUESTS.inc(route=route, method=request.method, status=status)
+        HTTP_SECONDS.observe(time.perf_counter() - start, route=route)
+
+def _require_ready():
+    state = readiness()
+    if not state["ready"]:
+        raise HTTPException(status_code=503, detail=f"Moteur en cours de chargement ({state['state']}).")
+
+def _require_corpus(corpus):
+    if corpus is not None and not corpus_exists(corpus):
+        raise HTTPException(status_code=404, detail=f"Corpus inconnu : {corpus}")
+
+def _session_memory(session_id):
+    # Mémoire locale au worker : derrière un répartiteur, prévoir l'affinité de session
+    # (sinon le résumé des anciens tours est reconstruit sur chaque worker)
+    if session_id is None:
+        return None
+    memory = _MEMORIES.get(session_id)
+    if memory is None:
+        memory = new_memory()
+        _MEMORIES.put(session_id, memory)
+    return memory
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    state = readiness()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    """
+    Réponse complète en JSON : {"answer", "sources", "standalone_question", "cached", "ttft", "latency",
+    "timings" (secondes par étape), "tokens" ({"prompt", "completion", "context_before", "context_after"})}.
+    """
+    _require_ready()
+    _require_corpus(request.corpus)
+    history = [m.model_dump() for m in request.history]
+    return await answer_async(request.question, history, _session_memory(request.session_id), request.corpus)
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Réponse en streaming (server-sent events) : "event: token" pour chaque token,
+    puis un "event: done" final (réponse, sources, temps) ou "event: error".
+    """
+    _require_ready()
+    _require_corpus(request.corpus)
+    history = [m.model_dump() for m in request.history]
+    memory = _session_memory(request.session_id)
+
+    async def events():
+        try:
+            async for event in astream_answer(request.question, history, memory, request.corpus):
+                yield _sse(event["type"], {key: value for key, value in event.items() if key != "type"})
+        except Exception as e:
+            # Les en-têtes (200) sont déjà partis : l'erreur est signalée dans le flux
+            print(f"❌ Erreur de génération : {e}")
+            STREAM_ERRORS.inc(error=type(e).__name__)
+            yield _sse("error", {"detail": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/indexes")
+async def indexes():
+    """
+    Corpus publiés et versions chargées dans ce worker (requêtes en cours, taille, évictions).
+    """
+    return dict(INDEXES.stats(), corpora=list_corpora())
+
+@app.post("/indexes/{corpus}/reload")
+async def reload_index(corpus: str):
+    """
+    Active tout de suite la dernière version publiée (sans attendre le prochain contrôle).
+    À appeler sur chaque worker, sinon chacun la détecte au plus tard après RAG_INDEX_POLL_SECONDS.
+    """
+    _require_corpus(corpus)
+    swapped = await asyncio.get_running_loop().run_in_executor(None, INDEXES.refresh, corpus)
+    return {"corpus": corpus, "swapped": swapped, "indexes": INDEXES.stats()}
+
+@app.get("/stats")
+async def stats():
+    return dict(engine_stats(), sessions=_MEMORIES.stats())
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Métriques de ce worker au format d'exposition Prometheus (latences par étape, tokens, caches, index).
+    """
+    return PlainTextResponse(METRICS.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="API HTTP/SSE du moteur RAG (sans interface).")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=API_WORKERS,
+                        help="Processus uvicorn (un moteur chargé par processus, index partagé par mmap).")
+    args = parser.parse_args()
+
+    uvicorn.run("api:app", host=args.host, port=args.port, workers=args.workers)
@@ -0,0 +1,39 @@
+import os
+import json
+
+import httpx
+
+# --- CONFIGURATION ---
+# URL de l'API (api.py). Si vide, l'interface Streamlit appelle le moteur dans son propre processus.
+RAG_API_URL = os.getenv("RAG_API_URL", "").rstrip("/")
+API_TIMEOUT = httpx.Timeout(120.0, connect=5.0)
+
+_CLIENT = httpx.Client(timeout=API_TIMEOUT)
+
+def stream_chat(question, history=None, session_id=None, base_url=RAG_API_URL, corpus=None):
+    """
+    Appelle POST /chat/stream et émet les mêmes événements que engine.stream_answer :
+    {"type": "token", "content"} puis {"type": "done", ...}. Lève RuntimeError sur "event: error".
+    `corpus` : index nommé interrogé (défaut côté API : RAG_DEFAULT_CORPUS).
+    """
+    payload = {"question": question, "history": history or [], "session_id": session_id, "corpus": corpus}
+    with _CLIENT.stream("POST", f"{base_url}/chat/stream", json=payload) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines():
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "error":
+                    raise RuntimeError(data.get("detail", "erreur de l'API"))
+                yield dict(data, type=event)
+
+def fetch_stats(base_url=RAG_API_URL):
+    response = _CLIENT.get(f"{base_url}/stats")
+    response.raise_for_status()
+    return response.json()
+
+def fetch_readiness(base_url=RAG_API_URL):
+    response = _CLIENT.get(f"{base_url}/ready")
+    return response.json()
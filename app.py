@@ -1,10 +1,11 @@
 import streamlit as st
 import os
-import json
 import uuid
 import time
-from langchain_core.messages import HumanMessage, AIMessage
-from engine import load_rag_components, get_contextualize_chain, get_qa_chain
+import itertools
+from chat_store import ChatStore, migrate_json_sessions, HISTORY_DIR
+from engine import get_components, new_memory, stream_answer, engine_stats, start_background_load
+from api_client import RAG_API_URL, stream_chat, fetch_stats
 
 # --- 1. CONFIGURATION DE LA PAGE ---
 st.set_page_config(
@@ -14,10 +15,8 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Création du dossier d'historique s'il n'existe pas
-HISTORY_DIR = "chat_history"
-if not os.path.exists(HISTORY_DIR):
-    os.makedirs(HISTORY_DIR)
+# Historique des conversations (SQLite, voir chat_store.py)
+SESSIONS_PER_PAGE = 20
 
 # --- 2. CSS PERSONNALISÉ (UI/UX) ---
 st.markdown("""
@@ -78,37 +77,27 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- 3. GESTION DE L'HISTORIQUE (JSON) ---
+# --- 3. GESTION DE L'HISTORIQUE (SQLITE) ---
 
-def save_chat_session(session_id, messages):
-    filepath = os.path.join(HISTORY_DIR, f"{session_id}.json")
-    with open(filepath, "w", encoding="utf-8") as f:
-        json.dump(messages, f, ensure_ascii=False, indent=4)
+@st.cache_resource
+def get_chat_store():
+    store = ChatStore()
+    # Première utilisation : import des anciennes sessions JSON
+    if store.count_sessions() == 0:
+        migrate_json_sessions(store, HISTORY_DIR)
+    return store
+
+chat_store = get_chat_store()
+
+def save_chat_messages(session_id, messages):
+    # Ajout des seuls nouveaux messages (la session n'est jamais réécrite)
+    chat_store.append_messages(session_id, messages)
 
 def load_chat_session(session_id):
-    filepath = os.path.join(HISTORY_DIR, f"{session_id}.json")
-    if os.path.exists(filepath):
-        with open(filepath, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return []
-
-def get_all_sessions():
-    files = [f for f in os.listdir(HISTORY_DIR) if f.endswith(".json")]
-    sessions = []
-    for f in files:
-        filepath = os.path.join(HISTORY_DIR, f)
-        mod_time = os.path.getmtime(filepath)
-        session_id = f.replace(".json", "")
-        try:
-            with open(filepath, 'r', encoding='utf-8') as file:
-                data = json.load(file)
-                title = "New Conversation"
-                if len(data) > 0 and data[0]["role"] == "user":
-                    title = data[0]["content"][:35] + "..."
-        except:
-            title = "Conversation"
-        sessions.append({"id": session_id, "title": title, "time": mod_time})
-    return sorted(sessions, key=lambda x: x["time"], reverse=True)
+    return chat_store.load_session(session_id)
+
+def get_sessions_page(page):
+    return chat_store.list_sessions(limit=SESSIONS_PER_PAGE, offset=page * SESSIONS_PER_PAGE)
 
 def create_new_session():
     new_id = str(uuid.uuid4())
@@ -117,9 +106,7 @@ def create_new_session():
     st.rerun()
 
 def delete_session(session_id):
-    filepath = os.path.join(HISTORY_DIR, f"{session_id}.json")
-    if os.path.exists(filepath):
-        os.remove(filepath)
+    chat_store.delete_session(session_id)
     if st.session_state.current_session_id == session_id:
         create_new_session()
     else:
@@ -127,6 +114,12 @@ def delete_session(session_id):
 
 # --- 4. CONFIGURATION SESSION & API ---
 
+# Deux modes : client léger de l'API (RAG_API_URL, voir api.py) ou moteur dans ce processus.
+# En local, chargement du moteur en arrière-plan dès le premier rendu, sans attendre la clé API
+# (déjà lancé au démarrage du conteneur par start.py)
+if not RAG_API_URL:
+    start_background_load()
+
 # Initialisation de la session
 if "current_session_id" not in st.session_state:
     st.session_state.current_session_id = str(uuid.uuid4())
@@ -134,9 +127,9 @@ if "current_session_id" not in st.session_state:
 if "messages" not in st.session_state:
     st.session_state.messages = load_chat_session(st.session_state.current_session_id)
 
-# Gestion de la clé API (Secrets ou Input Utilisateur)
+# Gestion de la clé API (Secrets ou Input Utilisateur) ; en mode API, elle est côté serveur
 api_key = os.getenv("GROQ_API_KEY")
-if not api_key and "GROQ_API_KEY" in st.secrets:
+if not api_key and not RAG_API_URL and "GROQ_API_KEY" in st.secrets:
     api_key = st.secrets["GROQ_API_KEY"]
 
 # --- 5. SIDEBAR ---
@@ -145,7 +138,9 @@ with st.sidebar:
     st.caption("Assistant Académique RAG")
     
     # Input Clé API si manquante
-    if not api_key:
+    if RAG_API_URL:
+        st.success(f"✅ Connecté à l'API ({RAG_API_URL})", icon="🟢")
+    elif not api_key:
         st.warning("⚠️ API Key manquante")
         user_key = st.text_input("Entrez votre clé Groq API :", type="password")
         if user_key:
@@ -161,7 +156,9 @@ with st.sidebar:
         create_new_session()
     
     st.markdown("### 🕒 Historique")
-    sessions = get_all_sessions()
+    if "history_page" not in st.session_state:
+        st.session_state.history_page = 0
+    sessions = get_sessions_page(st.session_state.history_page)
     
     for sess in sessions:
         col1, col2 = st.columns([0.85, 0.15])
@@ -179,26 +176,70 @@ with st.sidebar:
             if st.button("🗑️", key=f"del_{sess['id']}", help="Supprimer"):
                 delete_session(sess['id'])
 
+    # Pagination : une seule page de sessions est lue par rendu
+    n_pages = max(1, -(-chat_store.count_sessions() // SESSIONS_PER_PAGE))
+    if n_pages > 1:
+        col_prev, col_page, col_next = st.columns([0.3, 0.4, 0.3])
+        with col_prev:
+            if st.button("◀", key="history_prev", disabled=st.session_state.history_page == 0):
+                st.session_state.history_page -= 1
+                st.rerun()
+        with col_page:
+            st.caption(f"Page {st.session_state.history_page + 1}/{n_pages}")
+        with col_next:
+            if st.button("▶", key="history_next", disabled=st.session_state.history_page >= n_pages - 1):
+                st.session_state.history_page += 1
+                st.rerun()
+
     st.markdown("---")
+    with st.expander("📈 Performance"):
+        try:
+            all_stats = fetch_stats() if RAG_API_URL else engine_stats()
+        except Exception as e:
+            all_stats = None
+            st.caption(f"Indicateurs indisponibles : {e}")
+        if all_stats:
+            stats = all_stats["caches"]
+            st.caption(f"Embeddings questions : {stats['query_embeddings']['hit_rate']:.0%} de hits "
+                       f"({stats['query_embeddings']['entries']} en cache)")
+            st.caption(f"Réponses sémantiques : {stats['answers']['hit_rate']:.0%} de hits "
+                       f"({stats['answers']['entries']} en cache)")
+            ctx = all_stats["contextualize"]
+            st.caption(f"Reformulations évitées : {ctx['skip_rate']:.0%} des tours ({ctx['skipped']}/{ctx['turns']})")
+            sched = all_stats["scheduler"]
+            st.caption(f"Groq : {sched['requests_in_window']} req. et {sched['tokens_in_window']} tokens sur 60 s, "
+                       f"{sched['rate_limited']} erreur(s) 429 rejouée(s)")
+            ctx_tokens = all_stats["context"]
+            st.caption(f"Contexte compressé : {ctx_tokens['saved_ratio']:.0%} de tokens économisés "
+                       f"({ctx_tokens['saved']} sur {ctx_tokens['requests']} requête(s))")
+            rerank = all_stats["rerank"]
+            if rerank:
+                st.caption(f"Reranking : +{rerank['mean_ms']:.0f} ms en moyenne (p95 {rerank['p95_ms']:.0f} ms), "
+                           f"{rerank['fallbacks']}/{rerank['calls']} repli(s) sur l'ordre vectoriel")
     st.markdown("<div style='text-align: center; color: grey;'>v2.0 - MLOps Project</div>", unsafe_allow_html=True)
 
 # --- 6. CHARGEMENT MOTEUR ---
-# On ne charge que si la clé API est présente
-if not os.environ.get("GROQ_API_KEY"):
-    st.info("👈 Veuillez entrer une clé API Groq dans la barre latérale pour commencer.")
-    st.stop()
-
-@st.cache_resource
-def setup_engine():
-    return load_rag_components()
-
-try:
-    retriever, llm = setup_engine()
-    context_chain = get_contextualize_chain(llm)
-    qa_chain = get_qa_chain(llm)
-except Exception as e:
-    st.error(f"Erreur critique de chargement : {e}")
-    st.stop()
+# En mode API, le moteur (et la mémoire des sessions) vit dans api.py
+memory = None
+if not RAG_API_URL:
+    # On ne charge que si la clé API est présente
+    if not os.environ.get("GROQ_API_KEY"):
+        st.info("👈 Veuillez entrer une clé API Groq dans la barre latérale pour commencer.")
+        st.stop()
+
+    try:
+        with st.spinner("Chargement du moteur..."):
+            get_components()
+    except Exception as e:
+        st.error(f"Erreur critique de chargement : {e}")
+        st.stop()
+
+    # Mémoire bornée par session (derniers tours + résumé glissant des plus anciens)
+    if "memories" not in st.session_state:
+        st.session_state.memories = {}
+    if st.session_state.current_session_id not in st.session_state.memories:
+        st.session_state.memories[st.session_state.current_session_id] = new_memory()
+    memory = st.session_state.memories[st.session_state.current_session_id]
 
 # --- 7. ZONE DE CHAT ---
 
@@ -217,6 +258,24 @@ if not st.session_state.messages:
     <br>
     """, unsafe_allow_html=True)
 
+AI_BUBBLE = """
+<div style="background-color: #ffffff; color: #333; padding: 15px; border-radius: 0 15px 15px 15px; border: 1px solid #e0e0e0; box-shadow: 0 2px 5px rgba(0,0,0,0.05);">
+    {content}
+</div>
+"""
+
+def render_sources(sources):
+    if sources and sources != "None":
+        with st.expander("📚 Sources Vérifiées"):
+            source_list = sources.split(", ")
+            for src in source_list:
+                st.markdown(f"- 📄 `{src}`")
+
+def render_timings(msg):
+    # Temps jusqu'au 1er token (ressenti utilisateur) vs latence totale
+    if msg.get("ttft") is not None:
+        st.caption(f"⚡ 1er token : {msg['ttft']:.2f} s · total : {msg['latency']:.2f} s")
+
 # Affichage des messages
 for msg in st.session_state.messages:
     if msg["role"] == "user":
@@ -230,24 +289,19 @@ for msg in st.session_state.messages:
     else:
         # Style AI : Blanc/Gris avec bordure
         with st.chat_message("assistant", avatar="🤖"):
-            st.markdown(f"""
-            <div style="background-color: #ffffff; color: #333; padding: 15px; border-radius: 0 15px 15px 15px; border: 1px solid #e0e0e0; box-shadow: 0 2px 5px rgba(0,0,0,0.05);">
-                {msg["content"]}
-            </div>
-            """, unsafe_allow_html=True)
+            st.markdown(AI_BUBBLE.format(content=msg["content"]), unsafe_allow_html=True)
             
             # Affichage des sources
-            if msg.get("sources") and msg["sources"] != "None":
-                with st.expander("📚 Sources Vérifiées"):
-                    source_list = msg["sources"].split(", ")
-                    for src in source_list:
-                        st.markdown(f"- 📄 `{src}`")
+            render_sources(msg.get("sources"))
+            render_timings(msg)
 
 # --- 8. LOGIQUE D'INTERACTION ---
 if prompt := st.chat_input("Posez votre question ici..."):
+    turn_start = time.perf_counter()
     
     # 1. Sauvegarde et affichage User
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    user_message = {"role": "user", "content": prompt}
+    st.session_state.messages.append(user_message)
     with st.chat_message("user", avatar="👤"):
          st.markdown(f"""
             <div style="background-color: #007bff; color: white; padding: 10px 15px; border-radius: 15px 15px 0 15px; display: inline-block;">
@@ -259,57 +313,55 @@ if prompt := st.chat_input("Posez votre question ici..."):
     with st.chat_message("assistant", avatar="🤖"):
         message_placeholder = st.empty()
         
-        with st.spinner("Recherche dans les documents..."):
-            try:
-                lc_history = [
-                    HumanMessage(content=m["content"]) if m["role"] == "user" else AIMessage(content=m["content"]) 
-                    for m in st.session_state.messages[:-1]
-                ]
-
-                # Reformulation contextuelle
-                reformulated = prompt
-                if lc_history:
-                    reformulated = context_chain.invoke({"chat_history": lc_history, "question": prompt})
-
-                # Retrieval
-                docs = retriever.invoke(reformulated)
-                
-                if not docs:
-                    response_text = "Je ne trouve pas d'information pertinente dans les documents fournis."
-                    sources_text = "None"
-                else:
-                    context_text = "\n\n".join([d.page_content for d in docs])
-                    # Nettoyage des noms de sources
-                    sources_text = ", ".join(list(set([os.path.basename(d.metadata.get('source', 'Inconnu')) for d in docs])))
-                    
-                    response_text = qa_chain.invoke({
-                        "context": context_text,
-                        "chat_history": lc_history,
-                        "question": reformulated
-                    })
-
-                # Effet de streaming (simulation visuelle)
-                full_html = f"""
-                <div style="background-color: #ffffff; color: #333; padding: 15px; border-radius: 0 15px 15px 15px; border: 1px solid #e0e0e0; box-shadow: 0 2px 5px rgba(0,0,0,0.05);">
-                    {response_text}
-                </div>
-                """
-                message_placeholder.markdown(full_html, unsafe_allow_html=True)
-
-                # Sauvegarde AI
-                st.session_state.messages.append({
-                    "role": "assistant", 
-                    "content": response_text, 
-                    "sources": sources_text
-                })
-                
-                save_chat_session(st.session_state.current_session_id, st.session_state.messages)
-                
-                # Refresh pour mettre à jour le titre sidebar si c'est le 1er message
-                if len(st.session_state.messages) == 2:
-                    st.rerun()
-                # Refresh pour afficher les sources proprement (expander)
-                st.rerun()
-
-            except Exception as e:
-                st.error(f"Une erreur est survenue : {str(e)}")
\ No newline at end of file
+        try:
+            history = st.session_state.messages[:-1]
+            if RAG_API_URL:
+                events = stream_chat(prompt, history, st.session_state.current_session_id)
+            else:
+                events = stream_answer(prompt, history, memory)
+
+            # Reformulation, cache et recherche : jusqu'au premier événement
+            with st.spinner("Recherche dans les documents..."):
+                first_event = next(events)
+
+            # Streaming réel : chaque token est affiché dès sa réception
+            ttft = None
+            response_text = ""
+            done = None
+            for event in itertools.chain([first_event], events):
+                if event["type"] == "token":
+                    if ttft is None:
+                        ttft = time.perf_counter() - turn_start
+                    response_text += event["content"]
+                    message_placeholder.markdown(AI_BUBBLE.format(content=response_text + "▌"), unsafe_allow_html=True)
+                elif event["type"] == "done":
+                    done = event
+            latency = time.perf_counter() - turn_start
+            if ttft is None:
+                ttft = latency
+            response_text = done["answer"] if done else response_text
+            sources_text = done["sources"] if done else "None"
+            message_placeholder.markdown(AI_BUBBLE.format(content=response_text), unsafe_allow_html=True)
+
+            # Sources et temps ajoutés sous la réponse (rerun seulement pour le 1er message d'une session)
+            ai_message = {
+                "role": "assistant", 
+                "content": response_text, 
+                "sources": sources_text,
+                "ttft": ttft,
+                "latency": latency,
+            }
+            render_sources(sources_text)
+            render_timings(ai_message)
+
+            # Sauvegarde AI
+            st.session_state.messages.append(ai_message)
+            save_chat_messages(st.session_state.current_session_id, [user_message, ai_message])
+
+        except Exception as e:
+            st.error(f"Une erreur est survenue : {str(e)}")
+
+    # Premier échange d'une nouvelle session : la barre latérale (rendue avant) ne la liste pas encore.
+    # Le rerun n'intervient qu'une fois le stream terminé et les messages enregistrés.
+    if len(st.session_state.messages) == 2 and st.session_state.messages[-1]["role"] == "assistant":
+        st.rerun()
@@ -0,0 +1,365 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import resource
+import threading
+import subprocess
+
+import numpy as np
+
+import engine
+from chunk_store import process_memory
+from vector_index import read_index_config
+from index_registry import current_index_path
+
+# --- CONFIGURATION ---
+BENCHMARK_OUTPUT = "benchmark_results.json"
+REGRESSION_TOLERANCE = 0.20     # +20 % sur un p95 (ou -20 % de débit) = régression
+NOISE_FLOOR_MS = 2.0            # Écarts absolus plus petits ignorés (bruit de mesure)
+PERCENTILES = (50, 95, 99)
+MEMORY_SAMPLE_INTERVAL = 0.2
+
+# Conversations rejouées : questions autonomes et relances (reformulation) sur les documents du corpus
+BENCHMARK_CONVERSATIONS = [
+    ["What are the tuition fees for international students at Qatar University?",
+     "And what about the application deadline?"],
+    ["Quels sont les frais de scolarité à l'université Hassan II ?",
+     "Et pour les étudiants étrangers ?"],
+    ["What are the admission requirements at Wheeling University?",
+     "Is a TOEFL score required?",
+     "What about housing on campus?"],
+    ["How does the Erasmus+ programme fund student mobility?",
+     "Who can apply for it?"],
+    ["Which master programs does Qatar University offer in engineering?"],
+    ["Quelles sont les conditions d'admission en master à Casablanca ?",
+     "Combien de temps dure la formation ?"],
+    ["What GPA is required to remain in good standing at Wheeling?"],
+    ["Can Erasmus+ grants cover traineeships abroad?",
+     "How long can the mobility last?"],
+]
+
+def percentile_summary(seconds):
+    """
+    {"n", "mean_ms", "p50_ms", "p95_ms", "p99_ms"} d'une liste de durées en secondes.
+    """
+    if not seconds:
+        return {"n": 0}
+    ms = np.asarray(seconds) * 1000
+    summary = {"n": len(ms), "mean_ms": float(ms.mean())}
+    for p in PERCENTILES:
+        summary[f"p{p}_ms"] = float(np.percentile(ms, p))
+    return summary
+
+def load_conversations(path):
+    """
+    Jeu de questions : JSON (liste de conversations, ou liste de questions isolées)
+    ou texte (une question par ligne).
+    """
+    if path is None:
+        return BENCHMARK_CONVERSATIONS
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            items = json.load(f)
+            return [item if isinstance(item, list) else [item] for item in items]
+        return [[line.strip()] for line in f if line.strip()]
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def memory_snapshot():
+    memory = process_memory()
+    # ru_maxrss : pic du processus depuis son démarrage (Ko sous Linux)
+    memory["peak_rss"] = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, memory["VmRSS"])
+    return {key: round(value, 1) for key, value in memory.items()}
+
+class MemorySampler:
+    """
+    RSS maximal observé pendant une phase (échantillonné dans un thread).
+    """
+    def __init__(self, interval=MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.max_rss = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bench-memory", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.max_rss = max(self.max_rss, process_memory()["VmRSS"])
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.max_rss = max(self.max_rss, process_memory()["VmRSS"])
+
+def reset_caches(answer_cache):
+    engine.QUERY_EMBEDDING_CACHE.clear()
+    engine.ANSWER_CACHE.clear()
+    # Sans cache de réponses, chaque tour parcourt tout le pipeline (mesures comparables)
+    engine.ANSWER_CACHE.threshold = engine.ANSWER_CACHE_THRESHOLD if answer_cache else float("inf")
+
+def add_timings(stages, event):
+    for name, seconds in event["timings"].items():
+        stages.setdefault(name, []).append(seconds)
+    stages.setdefault("ttft", []).append(event["ttft"])
+    stages.setdefault("total", []).append(event["latency"])
+
+# --- PHASES ---
+
+def load_phase(llm_backend):
+    """
+    Chargement du moteur réel (embeddings, FAISS, BM25, reranker) avec le LLM choisi.
+    """
+    engine.LLM_BACKEND = llm_backend
+    before = process_memory()["VmRSS"]
+    start = time.perf_counter()
+    components = engine.get_components()
+    engine.warm_up(engine.get_retriever())
+    return components, {
+        "seconds": time.perf_counter() - start,
+        "rss_delta_mb": process_memory()["VmRSS"] - before,
+        "stages": dict(engine.STARTUP_TIMINGS),
+    }
+
+def sequential_phase(components, conversations, rounds=1):
+    """
+    Conversations rejouées une à une : latence par étape du pipeline, plus l'embedding
+    seul (sans cache) et la recherche FAISS seule sur chaque question.
+    """
+    retriever = engine.get_retriever()
+    vectorstore = retriever.vectorstore
+    model = getattr(vectorstore.embeddings, "inner", vectorstore.embeddings)
+    stages = {}
+    for _ in range(rounds):
+        for conversation in conversations:
+            history, memory = [], engine.new_memory()
+            for question in conversation:
+                start = time.perf_counter()
+                vector = np.asarray([model.embed_query(question)], dtype=np.float32)
+                stages.setdefault("embedding", []).append(time.perf_counter() - start)
+                start = time.perf_counter()
+                vectorstore.index.search(vector, retriever.fetch_k)
+                stages.setdefault("faiss", []).append(time.perf_counter() - start)
+
+                done = next(e for e in engine.stream_answer(question, history, memory) if e["type"] == "done")
+                add_timings(stages, done)
+                history = history + [{"role": "user", "content": question},
+                                     {"role": "assistant", "content": done["answer"]}]
+    return {name: percentile_summary(values) for name, values in stages.items()}
+
+async def _session(conversation, turns, stages, errors):
+    history, memory = [], engine.new_memory()
+    for i in range(turns):
+        question = conversation[i % len(conversation)]
+        if i and i % len(conversation) == 0:
+            history, memory = [], engine.new_memory()
+        try:
+            async for event in engine.astream_answer(question, history, memory):
+                if event["type"] == "done":
+                    add_timings(stages, event)
+                    history = history + [{"role": "user", "content": question},
+                                         {"role": "assistant", "content": event["answer"]}]
+        except Exception as e:
+            errors.append(str(e))
+
+async def _load(conversations, sessions, turns, seed):
+    rng = random.Random(seed)
+    stages, errors = {}, []
+    await asyncio.gather(*(_session(rng.choice(conversations), turns, stages, errors) for _ in range(sessions)))
+    return stages, errors
+
+def load_test_phase(conversations, sessions, turns, seed=0):
+    """
+    N sessions simulées en parallèle (chemin asynchrone de l'API) : débit et latences.
+    """
+    with MemorySampler() as sampler:
+        start = time.perf_counter()
+        stages, errors = asyncio.run(_load(conversations, sessions, turns, seed))
+        elapsed = time.perf_counter() - start
+    completed = len(stages.get("total", []))
+    return {
+        "sessions": sessions,
+        "turns_per_session": turns,
+        "completed": completed,
+        "errors": len(errors),
+        "seconds": elapsed,
+        "throughput_rps": completed / elapsed if elapsed else 0.0,
+        "max_rss_mb": round(sampler.max_rss, 1),
+        "stages": {name: percentile_summary(values) for name, values in stages.items()},
+    }
+
+def ingestion_phase(components, n_pages, seed=0):
+    """
+    Ingestion sur un échantillon de pages du corpus (sans toucher à l'index) :
+    latence par page (extraction + nettoyage), découpage et débit d'embedding.
+    """
+    import ingest_advanced as ingest
+    from pypdf import PdfReader
+    from chunking import SentenceChunker
+
+    pdf_files = ingest.list_pdf_files() if os.path.isdir(ingest.DATA_PATH) else {}
+    pages = [(rel, path, i) for rel, path in pdf_files.items() for i in range(len(PdfReader(path).pages))]
+    if not pages:
+        print(f"⚠️  Aucun PDF dans '{ingest.DATA_PATH}' : phase d'ingestion ignorée.")
+        return None
+    sample = random.Random(seed).sample(pages, min(n_pages, len(pages)))
+    splitter = SentenceChunker()
+    parse, split, chunks = [], [], []
+    for rel, path, i in sample:
+        start = time.perf_counter()
+        _, docs, _ = ingest.parse_page_range(rel, path, i, i + 1)
+        parse.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        chunks.extend(splitter.split_documents(docs))
+        split.append(time.perf_counter() - start)
+
+    embeddings = engine.get_retriever().vectorstore.embeddings
+    model = getattr(embeddings, "inner", embeddings)
+    texts = [chunk.page_content for chunk in chunks]
+    start = time.perf_counter()
+    for batch_start in range(0, len(texts), ingest.DEFAULT_BATCH_SIZE):
+        model.embed_documents(texts[batch_start:batch_start + ingest.DEFAULT_BATCH_SIZE])
+    embed_seconds = time.perf_counter() - start
+    return {
+        "pages": len(sample),
+        "chunks": len(chunks),
+        "stages": {"parse_page": percentile_summary(parse), "split_page": percentile_summary(split)},
+        "embedding_chunks_per_s": len(chunks) / embed_seconds if embed_seconds else 0.0,
+    }
+
+# --- RAPPORT ET RÉGRESSIONS ---
+
+def print_stages(title, stages):
+    print(f"📊 {title}")
+    print(f"   {'étape':<14} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, summary in stages.items():
+        if summary["n"]:
+            print(f"   {name:<14} {summary['n']:>5} {summary['p50_ms']:9.1f} "
+                  f"{summary['p95_ms']:9.1f} {summary['p99_ms']:9.1f}")
+
+def find_regressions(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compare aux résultats de référence : p95 par étape, débit, mémoire.
+    Retourne la liste des régressions (texte).
+    """
+    regressions = []
+
+    def check_stages(phase, current, reference):
+        for name, summary in current.items():
+            old = reference.get(name, {})
+            if not summary.get("n") or not old.get("n"):
+                continue
+            new_ms, old_ms = summary["p95_ms"], old["p95_ms"]
+            if new_ms > old_ms * (1 + tolerance) and new_ms - old_ms > NOISE_FLOOR_MS:
+                regressions.append(f"{phase}/{name} : p95 {old_ms:.1f} -> {new_ms:.1f} ms")
+
+    check_stages("sequential", results["sequential"], baseline.get("sequential", {}))
+    if results.get("load") and baseline.get("load"):
+        check_stages("load", results["load"]["stages"], baseline["load"]["stages"])
+        new_rps, old_rps = results["load"]["throughput_rps"], baseline["load"]["throughput_rps"]
+        if new_rps < old_rps * (1 - tolerance):
+            regressions.append(f"load/throughput : {old_rps:.1f} -> {new_rps:.1f} req/s")
+    if results.get("ingestion") and baseline.get("ingestion"):
+        check_stages("ingestion", results["ingestion"]["stages"], baseline["ingestion"]["stages"])
+        new_cps = results["ingestion"]["embedding_chunks_per_s"]
+        old_cps = baseline["ingestion"]["embedding_chunks_per_s"]
+        if new_cps < old_cps * (1 - tolerance):
+            regressions.append(f"ingestion/embedding : {old_cps:.0f} -> {new_cps:.0f} chunks/s")
+    new_rss, old_rss = results["memory"]["peak_rss"], baseline.get("memory", {}).get("peak_rss")
+    if old_rss and new_rss > old_rss * (1 + tolerance):
+        regressions.append(f"memory/peak_rss : {old_rss:.0f} -> {new_rss:.0f} Mo")
+    return regressions
+
+def run_benchmark(args):
+    conversations = load_conversations(args.questions)
+    components, load = load_phase(args.llm)
+    index_config = read_index_config(current_index_path())
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "llm": args.llm,
+            "embedding_backend": engine.EMBEDDING_BACKEND,
+            "index_type": index_config["type"],
+            "vectors": engine.get_retriever().vectorstore.index.ntotal,
+            "retriever_k": engine.get_retriever().k,
+            "reranker": engine.RERANKER is not None,
+            "answer_cache": args.answer_cache,
+            "conversations": len(conversations),
+            "questions": sum(len(c) for c in conversations),
+        },
+        "load_engine": load,
+    }
+
+    reset_caches(args.answer_cache)
+    results["sequential"] = sequential_phase(components, conversations, args.rounds)
+    print_stages(f"Séquentiel ({results['meta']['questions']} questions x {args.rounds})", results["sequential"])
+
+    if args.sessions:
+        reset_caches(args.answer_cache)
+        load_results = load_test_phase(conversations, args.sessions, args.turns, args.seed)
+        results["load"] = load_results
+        print_stages(f"Charge : {args.sessions} sessions x {args.turns} tours", load_results["stages"])
+        print(f"🚦 Débit : {load_results['throughput_rps']:.1f} req/s ({load_results['completed']} tours, "
+              f"{load_results['errors']} erreur(s), RSS max {load_results['max_rss_mb']:.0f} Mo)")
+
+    if args.ingest_pages:
+        results["ingestion"] = ingestion_phase(components, args.ingest_pages, args.seed)
+        if results["ingestion"]:
+            print_stages(f"Ingestion ({results['ingestion']['pages']} pages, {results['ingestion']['chunks']} chunks)",
+                         results["ingestion"]["stages"])
+            print(f"🧠 Embedding : {results['ingestion']['embedding_chunks_per_s']:.0f} chunks/s")
+
+    results["memory"] = memory_snapshot()
+    print(f"🧮 Mémoire : RSS {results['memory']['VmRSS']:.0f} Mo, pic {results['memory']['peak_rss']:.0f} Mo")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark de bout en bout (embedding -> FAISS -> prompt -> LLM stub) et test de charge.")
+    parser.add_argument("--questions", default=None,
+                        help="Jeu de questions (JSON : conversations ou questions ; texte : une par ligne).")
+    parser.add_argument("--llm", choices=["stub", "groq"], default="stub",
+                        help="LLM utilisé (défaut : stub local déterministe, sans réseau).")
+    parser.add_argument("--rounds", type=int, default=3, help="Passes séquentielles sur le jeu de questions.")
+    parser.add_argument("--sessions", type=int, default=8, help="Sessions simultanées (0 = pas de test de charge).")
+    parser.add_argument("--turns", type=int, default=4, help="Tours par session simulée.")
+    parser.add_argument("--ingest-pages", type=int, default=0,
+                        help="Pages du corpus à ingérer (extraction, découpage, embedding ; 0 = ignoré).")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="Active le cache sémantique de réponses (désactivé par défaut).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=BENCHMARK_OUTPUT, help="Résultats JSON.")
+    parser.add_argument("--baseline", default=None, help="Résultats de référence : échec en cas de régression.")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"💾 Résultats écrits dans {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"❌ Régression {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"✅ Aucune régression par rapport à {args.baseline} (tolérance {args.tolerance:.0%})")
@@ -0,0 +1,184 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+def normalize_query(text):
+    """
+    Clé de cache d'une question : minuscules, espaces compactés, ponctuation finale retirée.
+    """
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip(" ?!.")
+
+def index_fingerprint(folder_path):
+    """
+    Empreinte de l'index sur disque : change à chaque reconstruction / ingestion.
+    """
+    parts = []
+    for name in ("index.faiss", "index.pkl", "chunks.jsonl", "index_config.json", "manifest.json", "bm25.npz",
+                 "partitions.json"):
+        path = os.path.join(folder_path, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return "|".join(parts)
+
+class TTLCache:
+    """
+    Cache LRU borné avec expiration (TTL), thread-safe, avec compteurs de hits.
+    """
+    def __init__(self, max_entries=2048, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and time.monotonic() - item[0] <= self.ttl_seconds:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+class CachedEmbeddings(Embeddings):
+    """
+    Enveloppe d'un modèle d'embeddings : les vecteurs de requêtes sont mis en cache
+    (clé = question normalisée) pour ne pas ré-encoder les questions fréquentes.
+    """
+    def __init__(self, inner, query_cache=None):
+        self.inner = inner
+        self.query_cache = query_cache if query_cache is not None else TTLCache(4096, 24 * 3600)
+
+    def embed_documents(self, texts):
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = normalize_query(text)
+        vector = self.query_cache.get(key)
+        if vector is None:
+            vector = self.inner.embed_query(text)
+            self.query_cache.put(key, vector)
+        return vector
+
+class SemanticAnswerCache:
+    """
+    Cache de réponses : renvoie la réponse (et ses sources) d'une question déjà posée
+    dont l'embedding est à une similarité cosinus >= threshold de la nouvelle question
+    et qui vise la même université (`scope`) : deux questions qui ne diffèrent que par le nom
+    de l'établissement restent très proches en cosinus.
+    Vidé automatiquement quand l'empreinte de l'index change.
+    """
+    def __init__(self, threshold=0.95, max_entries=1024, ttl_seconds=24 * 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._entries = []
+        self._last_used = np.zeros(max_entries)
+        self._fingerprint = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def ensure_fingerprint(self, fingerprint):
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                if self._entries:
+                    self.invalidations += 1
+                self._vectors = None
+                self._entries = []
+                self._fingerprint = fingerprint
+
+    @staticmethod
+    def _unit(vector):
+        v = np.asarray(vector, dtype=np.float32)
+        return v / (np.linalg.norm(v) + 1e-12)
+
+    def lookup(self, vector, scope=None):
+        """
+        Retourne (entrée, similarité) de la meilleure correspondance de même portée, ou None.
+        """
+        q = self._unit(vector)
+        now = time.monotonic()
+        with self._lock:
+            n = len(self._entries)
+            same_scope = np.fromiter((entry["scope"] == scope for entry in self._entries), dtype=bool, count=n)
+            if not same_scope.any():
+                self.misses += 1
+                return None
+            sims = np.where(same_scope, self._vectors[:n] @ q, -np.inf)
+            best = int(np.argmax(sims))
+            entry = self._entries[best]
+            if sims[best] >= self.threshold and now - entry["time"] <= self.ttl_seconds:
+                self._last_used[best] = now
+                self.hits += 1
+                return entry, float(sims[best])
+            self.misses += 1
+            return None
+
+    def store(self, vector, question, answer, sources, scope=None):
+        q = self._unit(vector)
+        now = time.monotonic()
+        entry = {"question": question, "answer": answer, "sources": sources, "scope": scope, "time": now}
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, q.shape[0]), dtype=np.float32)
+            if len(self._entries) < self.max_entries:
+                slot = len(self._entries)
+                self._entries.append(entry)
+            else:
+                # Éviction de l'entrée la moins récemment utilisée
+                slot = int(np.argmin(self._last_used))
+                self._entries[slot] = entry
+            self._vectors[slot] = q
+            self._last_used[slot] = now
+
+    def clear(self):
+        with self._lock:
+            self._vectors = None
+            self._entries = []
+            self._last_used[:] = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "invalidations": self.invalidations,
+            }
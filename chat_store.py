@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+
+# --- CONFIGURATION ---
+HISTORY_DIR = "chat_history"
+CHAT_DB_PATH = os.getenv("CHAT_DB_PATH", os.path.join(HISTORY_DIR, "chat.db"))
+TITLE_LENGTH = 35
+DEFAULT_TITLE = "New Conversation"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    created REAL NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_mtime ON sessions (mtime DESC);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    meta TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id);
+"""
+
+def session_title(message):
+    if message and message.get("role") == "user":
+        return message["content"][:TITLE_LENGTH] + "..."
+    return DEFAULT_TITLE
+
+def _insert_messages(conn, session_id, messages, created):
+    # Champs autres que role/content (sources, temps de réponse) conservés en JSON
+    conn.executemany(
+        "INSERT INTO messages (session_id, role, content, meta, created) VALUES (?, ?, ?, ?, ?)",
+        [(session_id, m["role"], m["content"],
+          json.dumps({k: v for k, v in m.items() if k not in ("role", "content")}, ensure_ascii=False),
+          created) for m in messages],
+    )
+
+class ChatStore:
+    """
+    Historique des conversations en SQLite (mode WAL) : table des sessions indexée par date
+    de modification, messages ajoutés un par un (aucune réécriture de la session).
+    Une connexion par thread (Streamlit exécute chaque rerun dans son propre thread).
+    """
+    def __init__(self, db_path=CHAT_DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")   # Sûr en WAL, évite un fsync par message
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def append_messages(self, session_id, messages):
+        """
+        Ajoute des messages ({"role", "content", ...}) à une session, créée si besoin.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO sessions (id, title, created, mtime) VALUES (?, ?, ?, ?)",
+                (session_id, session_title(messages[0] if messages else None), now, now),
+            )
+            _insert_messages(conn, session_id, messages, now)
+            conn.execute("UPDATE sessions SET mtime = ? WHERE id = ?", (now, session_id))
+
+    def load_session(self, session_id):
+        rows = self._connect().execute(
+            "SELECT role, content, meta FROM messages WHERE session_id = ? ORDER BY id", (session_id,)
+        ).fetchall()
+        return [dict(json.loads(row["meta"] or "{}"), role=row["role"], content=row["content"]) for row in rows]
+
+    def list_sessions(self, limit=20, offset=0):
+        """
+        Page de sessions, de la plus récente à la plus ancienne : [{"id", "title", "time"}].
+        """
+        rows = self._connect().execute(
+            "SELECT id, title, mtime FROM sessions ORDER BY mtime DESC LIMIT ? OFFSET ?", (limit, offset)
+        ).fetchall()
+        return [{"id": row["id"], "title": row["title"], "time": row["mtime"]} for row in rows]
+
+    def count_sessions(self):
+        return self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def delete_session(self, session_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def has_session(self, session_id):
+        return self._connect().execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone() is not None
+
+def migrate_json_sessions(store, history_dir=HISTORY_DIR, remove=False):
+    """
+    Importe les anciennes sessions JSON (un fichier par session) ; la date de modification
+    du fichier devient celle de la session. Les sessions déjà importées sont ignorées.
+    """
+    imported = skipped = failed = 0
+    if not os.path.isdir(history_dir):
+        return 0
+    for filename in sorted(os.listdir(history_dir)):
+        if not filename.endswith(".json"):
+            continue
+        path = os.path.join(history_dir, filename)
+        session_id = filename[:-len(".json")]
+        if store.has_session(session_id):
+            skipped += 1
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                messages = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  {filename} illisible ({e}), ignoré.")
+            failed += 1
+            continue
+        mtime = os.path.getmtime(path)
+        with store._connect() as conn:
+            conn.execute("INSERT INTO sessions (id, title, created, mtime) VALUES (?, ?, ?, ?)",
+                         (session_id, session_title(messages[0] if messages else None), mtime, mtime))
+            _insert_messages(conn, session_id, messages, mtime)
+        if remove:
+            os.remove(path)
+        imported += 1
+    print(f"✅ Migration : {imported} session(s) importée(s), {skipped} déjà présente(s), {failed} en erreur.")
+    return imported
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Historique des conversations (SQLite).")
+    parser.add_argument("--migrate", action="store_true", help="Importe les sessions JSON de chat_history/.")
+    parser.add_argument("--history-dir", default=HISTORY_DIR)
+    parser.add_argument("--remove", action="store_true", help="Supprime les fichiers JSON après import.")
+    args = parser.parse_args()
+
+    store = ChatStore()
+    if args.migrate:
+        migrate_json_sessions(store, args.history_dir, remove=args.remove)
+    print(f"🗂️  {store.count_sessions()} session(s) dans {store.db_path}")
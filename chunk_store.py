@@ -0,0 +1,246 @@
+import os
+import json
+import mmap
+import time
+import argparse
+from collections.abc import Mapping
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+
+from index_registry import DEFAULT_CORPUS, current_index_path
+
+# --- CONFIGURATION ---
+CHUNKS_FILE = "chunks.jsonl"                # Un enregistrement JSON par position FAISS
+OFFSETS_FILE = "chunks_offsets.npy"         # Début de chaque enregistrement (n + 1 entrées)
+IDS_FILE = "chunk_ids.npy"                  # Id docstore par position
+IDS_ORDER_FILE = "chunk_ids_order.npy"      # Positions triées par id (recherche dichotomique)
+
+def _write_atomic(path, write):
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def _save_array(path, array):
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+    _write_atomic(path, write)
+
+def save_chunk_store(vectorstore, folder_path, keep_legacy=False):
+    """
+    Écrit textes et métadonnées dans l'ordre des positions FAISS (sans pickle).
+    Chaque fichier est remplacé atomiquement : les processus qui l'ont mappé gardent l'ancienne version.
+    """
+    ids = [vectorstore.index_to_docstore_id[position] for position in range(vectorstore.index.ntotal)]
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+
+    def write_chunks(path):
+        with open(path, "wb") as f:
+            for position, doc_id in enumerate(ids):
+                doc = vectorstore.docstore.search(doc_id)
+                line = json.dumps({"id": doc_id, "page_content": doc.page_content, "metadata": doc.metadata},
+                                  ensure_ascii=False).encode("utf-8") + b"\n"
+                f.write(line)
+                offsets[position + 1] = offsets[position] + len(line)
+
+    id_array = np.array(ids, dtype="S") if ids else np.zeros(0, dtype="S32")
+    _write_atomic(os.path.join(folder_path, CHUNKS_FILE), write_chunks)
+    _save_array(os.path.join(folder_path, OFFSETS_FILE), offsets)
+    _save_array(os.path.join(folder_path, IDS_FILE), id_array)
+    _save_array(os.path.join(folder_path, IDS_ORDER_FILE), np.argsort(id_array, kind="stable").astype(np.int64))
+    # L'ancien format pickle n'est plus la référence
+    legacy_path = os.path.join(folder_path, "index.pkl")
+    if os.path.exists(legacy_path) and not keep_legacy:
+        os.remove(legacy_path)
+
+class ChunkStore:
+    """
+    Lecture à la demande des chunks : fichiers mappés en mémoire (mmap), partagés via le
+    cache de pages entre tous les processus workers. Rien n'est désérialisé au chargement.
+    """
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.offsets = np.load(os.path.join(folder_path, OFFSETS_FILE), mmap_mode="r")
+        self.ids = np.load(os.path.join(folder_path, IDS_FILE), mmap_mode="r")
+        self.order = np.load(os.path.join(folder_path, IDS_ORDER_FILE), mmap_mode="r")
+        with open(os.path.join(folder_path, CHUNKS_FILE), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    @staticmethod
+    def exists(folder_path):
+        return all(os.path.exists(os.path.join(folder_path, name))
+                   for name in (CHUNKS_FILE, OFFSETS_FILE, IDS_FILE, IDS_ORDER_FILE))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def id_at(self, position):
+        return self.ids[position].decode("ascii")
+
+    def position(self, doc_id):
+        """
+        Position FAISS d'un id (recherche dichotomique sur les ids triés), ou None.
+        """
+        key = doc_id.encode("ascii") if isinstance(doc_id, str) else doc_id
+        i = int(np.searchsorted(self.ids, key, sorter=self.order))
+        if i < len(self.order) and self.ids[self.order[i]] == key:
+            return int(self.order[i])
+        return None
+
+    def document(self, position):
+        record = json.loads(self.data[int(self.offsets[position]):int(self.offsets[position + 1])])
+        return Document(id=record["id"], page_content=record["page_content"], metadata=record["metadata"])
+
+class LazyDocstore(Docstore):
+    """
+    Docstore en lecture seule adossé au ChunkStore (même contrat que InMemoryDocstore.search).
+    """
+    def __init__(self, store):
+        self.store = store
+
+    def search(self, search):
+        position = self.store.position(search)
+        if position is None:
+            return f"ID {search} not found."
+        return self.store.document(position)
+
+class LazyIdMap(Mapping):
+    """
+    Position FAISS -> id docstore, lue dans le tableau mappé (aucun dict en mémoire).
+    """
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self.store):
+            raise KeyError(position)
+        return self.store.id_at(position)
+
+    def __iter__(self):
+        return iter(range(len(self.store)))
+
+    def __len__(self):
+        return len(self.store)
+
+def load_lazy_docstore(folder_path):
+    """
+    (docstore, index_to_docstore_id) en lecture seule et à la demande, pour le moteur.
+    """
+    store = ChunkStore(folder_path)
+    return LazyDocstore(store), LazyIdMap(store)
+
+def load_writable_docstore(folder_path):
+    """
+    (InMemoryDocstore, dict) modifiables, pour l'ingestion incrémentale (ajouts et suppressions).
+    """
+    store = ChunkStore(folder_path)
+    docs = {}
+    index_to_docstore_id = {}
+    for position in range(len(store)):
+        doc = store.document(position)
+        docs[doc.id] = doc
+        index_to_docstore_id[position] = doc.id
+    return InMemoryDocstore(docs), index_to_docstore_id
+
+# --- CONVERSION ET RAPPORT MÉMOIRE ---
+
+def convert_legacy(folder_path, keep_legacy=False):
+    """
+    Convertit l'ancien format (index.pkl de FAISS.save_local). Seul endroit où le pickle est encore lu :
+    le moteur et l'ingestion refusent un dossier non converti.
+    """
+    import pickle
+    import faiss
+    from langchain_community.vectorstores import FAISS
+
+    index = faiss.read_index(os.path.join(folder_path, "index.faiss"))
+    with open(os.path.join(folder_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    for doc_id in index_to_docstore_id.values():
+        doc = docstore.search(doc_id)
+        if isinstance(doc, Document) and doc.id is None:
+            doc.id = doc_id
+    save_chunk_store(FAISS(None, index, docstore, index_to_docstore_id), folder_path, keep_legacy)
+    print(f"✅ {index.ntotal} chunks convertis au format mmap dans '{folder_path}'"
+          + (" (index.pkl conservé)." if keep_legacy else " (index.pkl supprimé)."))
+
+def process_memory():
+    """
+    Mémoire du processus (Mo) : RSS, part anonyme (privée), part fichiers (partageable), PSS.
+    """
+    status = dict(line.split(":", 1) for line in open("/proc/self/status"))
+    memory = {key: int(status[key].split()[0]) / 1024 for key in ("VmRSS", "RssAnon", "RssFile")}
+    try:
+        rollup = dict(line.split(":", 1) for line in open("/proc/self/smaps_rollup") if ":" in line)
+        memory["Pss"] = int(rollup["Pss"].split()[0]) / 1024
+    except (OSError, KeyError):
+        pass
+    return memory
+
+def _worker_memory(folder_path, mode, n_queries, barrier, results):
+    import faiss
+    from vector_index import load_vectorstore
+
+    if mode == "heap":
+        # Profil mémoire de l'ancien chargement : index copié dans le tas, docstore entier en mémoire
+        index = faiss.read_index(os.path.join(folder_path, "index.faiss"))
+        docstore, index_to_docstore_id = load_writable_docstore(folder_path)
+    else:
+        vectorstore = load_vectorstore(folder_path, None)
+        index, docstore, index_to_docstore_id = (vectorstore.index, vectorstore.docstore,
+                                                 vectorstore.index_to_docstore_id)
+    rng = np.random.default_rng(os.getpid())
+    _, positions = index.search(rng.standard_normal((n_queries, index.d)).astype(np.float32), 5)
+    for position in positions.ravel():
+        if position >= 0:
+            docstore.search(index_to_docstore_id[int(position)])
+    barrier.wait()          # Tous les workers chargés en même temps : PSS = part réellement partagée
+    results.put(process_memory())
+    barrier.wait()
+
+def memory_report(folder_path, workers, n_queries=200):
+    """
+    RSS par worker avec l'ancien mode de chargement (index et chunks dans le tas) puis le nouveau (mmap).
+    """
+    import multiprocessing
+    ctx = multiprocessing.get_context("spawn")
+    modes = ["heap", "mmap"]
+    for mode in modes:
+        barrier = ctx.Barrier(workers)
+        results = ctx.Queue()
+        processes = [ctx.Process(target=_worker_memory, args=(folder_path, mode, n_queries, barrier, results))
+                     for _ in range(workers)]
+        for p in processes:
+            p.start()
+        memories = [results.get() for _ in processes]
+        for p in processes:
+            p.join()
+        mean = {key: sum(m[key] for m in memories) / len(memories) for key in memories[0]}
+        print(f"🧮 {mode:6s} x{workers} : RSS {mean['VmRSS']:.0f} Mo/worker "
+              f"(privé {mean['RssAnon']:.0f} Mo, fichiers partagés {mean['RssFile']:.0f} Mo"
+              + (f", PSS {mean['Pss']:.0f} Mo" if "Pss" in mean else "") + ")")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stockage des chunks sans pickle, lu par mmap.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--folder", default=None, help="Dossier de l'index (défaut : version active du corpus).")
+    parser.add_argument("--convert", action="store_true", help="Convertit index.pkl au nouveau format.")
+    parser.add_argument("--keep-pickle", action="store_true",
+                        help="Conserve index.pkl après conversion (pour comparer les deux formats).")
+    parser.add_argument("--memory-report", action="store_true",
+                        help="RSS par worker : chargement en mémoire (ancien) puis par mmap.")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    # Version active résolue à l'exécution (une ingestion a pu en publier une nouvelle depuis l'import)
+    folder = args.folder or current_index_path(args.corpus)
+
+    if args.convert:
+        start = time.perf_counter()
+        convert_legacy(folder, keep_legacy=args.keep_pickle)
+        print(f"⏱️  Conversion en {time.perf_counter() - start:.1f} s")
+    if args.memory_report:
+        memory_report(folder, args.workers)
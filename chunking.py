@@ -0,0 +1,283 @@
+import os
+import re
+import time
+import random
+import argparse
+
+from langchain_core.documents import Document
+
+# --- CONFIGURATION ---
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1200"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "300"))
+# "sentences" : phrases entières reprises jusqu'à CHUNK_OVERLAP caractères,
+# "chars" : les CHUNK_OVERLAP derniers caractères (coupés à un espace), "none" : aucun chevauchement
+CHUNK_OVERLAP_POLICY = os.getenv("CHUNK_OVERLAP_POLICY", "sentences")
+OVERLAP_POLICIES = ["none", "sentences", "chars"]
+CHUNKER_VERSION = "sentence-v1"     # Dans la signature du manifeste : changer le découpage réindexe tout
+
+# Nettoyage en une seule passe : bruit de mise en page (numéros de page, pied de page Wheeling,
+# en-tête du catalogue, lignes ne contenant qu'un nombre) avec les sauts de ligne qui l'entourent,
+# césures de mots, lignes vides multiples. L'anticipation initiale sur les premiers caractères
+# possibles permet au moteur de sauter directement aux positions candidates.
+CLEAN_PATTERN = re.compile(
+    r"(?=[\nPUu\d-])(?:"
+    r"(?P<noise>\n*(?:Page\s+\d+"
+    r"|\d+\s+\|\s+P\s+a\s+g\s+e"
+    r"|(?i:Undergraduate\s+Catalog\s+2024-2025)"
+    r"|^\d+[^\S\n]*$)\n*)"
+    r"|(?P<hyphen>(?<=\w)-\s+(?=\w))"
+    r"|(?P<blank>\n{3,}))",
+    re.MULTILINE,
+)
+# Fins de phrase (ponctuation suivie d'un espace ou d'un saut de ligne) et de paragraphe
+SENTENCE_ENDS = (". ", ".\n", "? ", "?\n", "! ", "!\n")
+PARAGRAPH_BREAK = "\n\n"
+
+def _clean_match(match):
+    kind = match.lastgroup
+    if kind == "noise":
+        # Les sauts de ligne autour du bruit retiré sont gardés, au plus 2 (comme \n{3,} -> \n\n)
+        return "\n" * min(match.group().count("\n"), 2)
+    if kind == "hyphen":
+        return ""
+    return "\n\n"
+
+def clean_text(text):
+    """
+    Nettoyage du bruit des PDF en un seul parcours de la page (motifs compilés une fois).
+    """
+    if not text:
+        return ""
+    return CLEAN_PATTERN.sub(_clean_match, text).strip()
+
+def clean_text_multipass(text):
+    """
+    Ancien nettoyage (cinq passes successives), gardé comme référence pour --parity et --benchmark.
+    """
+    if not text: return ""
+    text = re.sub(r'Page\s+\d+|^\d+\s*$', '', text, flags=re.MULTILINE)
+    text = re.sub(r'\d+\s+\|\s+P\s+a\s+g\s+e', '', text)
+    text = re.sub(r'Undergraduate\s+Catalog\s+2024-2025', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'(\w+)-\s+(\w+)', r'\1\2', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip()
+
+class SentenceChunker:
+    """
+    Découpage linéaire en chunks d'au plus `chunk_size` caractères, aux limites de phrases.
+    Chaque chunk s'arrête à la dernière fin de phrase (ou de paragraphe) de sa fenêtre, trouvée
+    par recherche inverse : chaque caractère n'est examiné qu'un nombre borné de fois, sans
+    découpage préalable de toute la page. Une phrase plus longue qu'un chunk (tableaux, listes
+    sans ponctuation) est coupée au dernier saut de ligne ou espace.
+    Même interface que les text splitters LangChain (split_text, split_documents).
+    """
+    def __init__(self, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP, overlap_policy=CHUNK_OVERLAP_POLICY):
+        if overlap_policy not in OVERLAP_POLICIES:
+            raise ValueError(f"CHUNK_OVERLAP_POLICY inconnue : {overlap_policy} (attendu : {OVERLAP_POLICIES})")
+        self.chunk_size = chunk_size
+        self.overlap = 0 if overlap_policy == "none" else min(overlap, chunk_size // 2)
+        self.overlap_policy = overlap_policy
+
+    @staticmethod
+    def _last_sentence_end(text, floor, limit):
+        # Fin de la dernière phrase se terminant dans (floor, limit], ou -1
+        end = text.rfind(PARAGRAPH_BREAK, floor + 1, limit + 1)
+        for separator in SENTENCE_ENDS:
+            position = text.rfind(separator, floor, limit)
+            if position >= 0 and position + 1 > end:
+                end = position + 1
+        return end
+
+    @staticmethod
+    def _first_sentence_start(text, start, end):
+        # Début de la première phrase commençant dans (start, end), ou -1
+        boundary = -1
+        for separator in SENTENCE_ENDS + (PARAGRAPH_BREAK,):
+            position = text.find(separator, start, end)
+            if position >= 0 and (boundary < 0 or position < boundary):
+                boundary = position
+        if boundary < 0:
+            return -1
+        boundary += 1
+        while boundary < end and text[boundary].isspace():
+            boundary += 1
+        return boundary if boundary < end else -1
+
+    @staticmethod
+    def _cut(text, floor, limit):
+        # Pas de fin de phrase assez loin : dernier saut de ligne, sinon dernier espace
+        cut = text.rfind("\n", floor + 1, limit)
+        if cut < 0:
+            cut = text.rfind(" ", floor + 1, limit)
+        return cut if cut > floor else limit
+
+    def _next_start(self, text, start, end):
+        # Début du chunk suivant : après la fin du chunk, ou plus tôt pour le chevauchement
+        if self.overlap:
+            window = max(start + 1, end - self.overlap)
+            if self.overlap_policy == "chars":
+                space = text.find(" ", window, end)
+                if space >= 0:
+                    return space + 1
+            else:
+                sentence = self._first_sentence_start(text, window - 1, end)
+                if sentence > start:
+                    return sentence
+        while end < len(text) and text[end].isspace():
+            end += 1
+        return end
+
+    def split_text(self, text):
+        chunks = []
+        text = text.rstrip()
+        start, n = len(text) - len(text.lstrip()), len(text)
+        previous_end = start
+        while n - start > self.chunk_size:
+            limit = start + self.chunk_size
+            # Un chunk se termine après le précédent et au moins à mi-fenêtre
+            floor = max(previous_end, start + self.chunk_size // 2)
+            end = self._last_sentence_end(text, floor, limit)
+            if end < 0:
+                # Phrase plus longue que la fenêtre : coupe sans chevauchement
+                end = self._cut(text, floor, limit)
+                chunks.append(text[start:end].rstrip())
+                start = previous_end = end
+                while start < n and text[start].isspace():
+                    start += 1
+                continue
+            chunks.append(text[start:end].rstrip())
+            previous_end = end
+            start = self._next_start(text, start, end)
+        if start < n:
+            chunks.append(text[start:])
+        return chunks
+
+    def split_documents(self, docs):
+        return [
+            Document(page_content=chunk, metadata=dict(doc.metadata))
+            for doc in docs
+            for chunk in self.split_text(doc.page_content)
+        ]
+
+# --- CORPUS SYNTHÉTIQUE ET MICRO-BENCHMARK ---
+
+SYNTHETIC_WORDS = (
+    "tuition fee credit hour admission deadline scholarship program master course engineering "
+    "student campus housing application requirement semester international transcript degree "
+    "faculty department research graduate undergraduate curriculum elective prerequisite"
+).split()
+
+def synthetic_page(rng, number):
+    """
+    Page de catalogue simulée : paragraphes, listes sans ponctuation, césures en fin de ligne,
+    en-tête du catalogue, numéro de page seul sur sa ligne, pied de page Wheeling.
+    """
+    lines = ["Undergraduate Catalog 2024-2025", ""]
+    for _ in range(rng.randint(3, 6)):
+        sentences = []
+        for _ in range(rng.randint(3, 8)):
+            words = [rng.choice(SYNTHETIC_WORDS) for _ in range(rng.randint(6, 24))]
+            sentences.append(" ".join(words).capitalize() + rng.choice([".", ".", ".", "?", "!"]))
+        paragraph = " ".join(sentences)
+        # Retours à la ligne du PDF (~90 caractères), parfois au milieu d'un mot coupé
+        while len(paragraph) > 90:
+            cut = paragraph.rfind(" ", 0, 90)
+            if rng.random() < 0.1:
+                word_end = paragraph.find(" ", cut + 1)
+                if word_end - cut > 6:
+                    lines.append(paragraph[:cut + 4] + "-")
+                    paragraph = paragraph[cut + 4:]
+                    continue
+            lines.append(paragraph[:cut])
+            paragraph = paragraph[cut + 1:]
+        lines.append(paragraph)
+        lines.append("" if rng.random() < 0.7 else "\n")
+    if rng.random() < 0.3:
+        lines += [f"COURSE {rng.randint(100, 499)} {rng.choice(SYNTHETIC_WORDS).upper()} {rng.randint(1, 4)} credits"
+                  for _ in range(rng.randint(5, 20))]
+    lines += ["", str(number) if rng.random() < 0.5 else f"{number} | P a g e", f"Page {number}"]
+    return "\n".join(lines)
+
+def synthetic_corpus(n_pages, seed=0):
+    rng = random.Random(seed)
+    return [synthetic_page(rng, i + 1) for i in range(n_pages)]
+
+def parity_report(pages):
+    """
+    Pages nettoyées à l'identique par les deux implémentations (exactement, puis aux espaces près).
+    """
+    exact = normalized = 0
+    for page in pages:
+        old, new = clean_text_multipass(page), clean_text(page)
+        exact += old == new
+        normalized += old.split() == new.split()
+    print(f"🔎 Nettoyage fusionné vs 5 passes : {exact}/{len(pages)} pages identiques, "
+          f"{normalized}/{len(pages)} aux espaces près")
+    return exact, normalized
+
+def _timed(func, items):
+    start = time.perf_counter()
+    results = [func(item) for item in items]
+    return results, time.perf_counter() - start
+
+def micro_benchmark(pages, embed_sample=0):
+    """
+    Nettoyage et découpage de tout le corpus : ancien pipeline (5 passes + RecursiveCharacterTextSplitter)
+    contre nettoyage fusionné + SentenceChunker, pour chaque politique de chevauchement.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    legacy_clean, legacy_clean_s = _timed(clean_text_multipass, pages)
+    fused_clean, fused_clean_s = _timed(clean_text, pages)
+    cleaned_chars = sum(len(page) for page in fused_clean)
+    print(f"🧹 Nettoyage de {len(pages)} pages : 5 passes {legacy_clean_s:.2f} s, "
+          f"une passe {fused_clean_s:.2f} s (x{legacy_clean_s / fused_clean_s:.1f})")
+
+    legacy_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                                                     separators=["\n\n", "(?<=\\. )", "\n", " ", ""])
+    splitters = [(f"recursive (overlap {CHUNK_OVERLAP})", legacy_splitter, legacy_clean)]
+    splitters += [(f"sentence/{policy}", SentenceChunker(overlap_policy=policy), fused_clean)
+                  for policy in OVERLAP_POLICIES]
+
+    embeddings = None
+    if embed_sample:
+        from embedding_backend import load_embeddings
+        embeddings = load_embeddings(device="cpu")
+
+    print(f"{'découpage':<24} {'temps s':>8} {'chunks':>8} {'car./chunk':>10} {'dupliqué':>9} {'embedding s':>12}")
+    for name, splitter, texts in splitters:
+        results, seconds = _timed(splitter.split_text, texts)
+        chunks = [chunk for page_chunks in results for chunk in page_chunks]
+        chunk_chars = sum(len(chunk) for chunk in chunks)
+        duplicated = (chunk_chars - cleaned_chars) / cleaned_chars
+        estimate = "-"
+        if embeddings is not None:
+            # Coût d'embedding ~ proportionnel au nombre de chunks (troncature à 128 tokens)
+            sample = random.Random(0).sample(chunks, min(embed_sample, len(chunks)))
+            start = time.perf_counter()
+            embeddings.embed_documents(sample)
+            estimate = f"{len(chunks) * (time.perf_counter() - start) / len(sample):.0f}"
+        print(f"{name:<24} {seconds:8.2f} {len(chunks):8d} {chunk_chars / len(chunks):10.0f} "
+              f"{duplicated:9.1%} {estimate:>12}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nettoyage et découpage des pages : parité et micro-benchmark.")
+    parser.add_argument("--benchmark", action="store_true", help="Micro-benchmark sur un corpus synthétique.")
+    parser.add_argument("--parity", action="store_true", help="Compare le nettoyage fusionné à l'ancien.")
+    parser.add_argument("--pages", type=int, default=7000, help="Taille du corpus synthétique.")
+    parser.add_argument("--pdf-dir", default=None, help="Utilise les pages de ces PDF au lieu du corpus synthétique.")
+    parser.add_argument("--embed-sample", type=int, default=0,
+                        help="Chunks vectorisés par politique pour estimer le temps d'embedding (0 = ignoré).")
+    args = parser.parse_args()
+
+    if args.pdf_dir:
+        from pathlib import Path
+        from pypdf import PdfReader
+        pages = [page.extract_text() for path in sorted(Path(args.pdf_dir).glob("**/*.pdf"))
+                 for page in PdfReader(str(path)).pages]
+    else:
+        pages = synthetic_corpus(args.pages)
+    if args.parity:
+        parity_report(pages)
+    if args.benchmark:
+        micro_benchmark(pages, args.embed_sample)
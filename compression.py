@@ -0,0 +1,150 @@
+import os
+import re
+import math
+import threading
+from collections import Counter
+
+from tokens import count_tokens
+from sparse_index import tokenize
+from partitions import university_name
+
+# --- CONFIGURATION ---
+# Budget total du prompt envoyé à Groq : prompt système + historique + question + contexte
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2500"))
+MIN_CONTEXT_TOKENS = 300        # Contexte minimal garanti même si l'historique est long
+RANK_PRIOR = 0.5                # Bonus des phrases issues des chunks les mieux classés
+SOURCE_HEADER = re.compile(r"^Document Source: (.+?)\n\n")
+# Les PDF coupent les lignes au milieu des phrases : seules les lignes vides séparent des blocs
+PARAGRAPH_SPLIT = re.compile(r"\n\s*\n")
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+# Mots vides (EN + FR) ignorés dans le score de pertinence
+STOPWORDS = {
+    "the", "a", "an", "of", "to", "in", "for", "on", "and", "or", "is", "are", "what", "which",
+    "how", "do", "does", "can", "i", "my", "me", "it", "at", "be", "with", "about", "there",
+    "le", "la", "les", "de", "des", "du", "un", "une", "et", "ou", "est", "sont", "quel", "quelle",
+    "quels", "quelles", "comment", "pour", "dans", "sur", "je", "il", "elle", "au", "aux", "en",
+}
+
+COMPRESSION_STATS = {"requests": 0, "tokens_before": 0, "tokens_after": 0}
+_STATS_LOCK = threading.Lock()
+
+def split_sentences(text):
+    sentences = []
+    for paragraph in PARAGRAPH_SPLIT.split(text):
+        # Retours à la ligne simples = lignes repliées d'une même phrase
+        paragraph = " ".join(paragraph.split())
+        sentences.extend(s.strip() for s in SENTENCE_SPLIT.split(paragraph) if s.strip())
+    return sentences
+
+def _source_name(doc):
+    # Université posée sur chaque chunk à l'ingestion (l'en-tête "Document Source" n'est que sur le premier)
+    university = doc.metadata.get("university")
+    if university:
+        return university
+    match = SOURCE_HEADER.match(doc.page_content)
+    if match:
+        return match.group(1)
+    return university_name(doc.metadata.get("source")) or "Inconnu"
+
+def collect_sentences(docs):
+    """
+    Phrases uniques des chunks, dans l'ordre de classement.
+    Le chevauchement entre chunks voisins (chunk_overlap) et l'en-tête "Document Source"
+    répété sont supprimés ; les fragments contenus dans une phrase déjà vue aussi.
+    Retourne [(source, rang du chunk, position, phrase)].
+    """
+    sentences = []
+    seen = set()
+    seen_by_source = {}
+    for rank, doc in enumerate(docs):
+        source = _source_name(doc)
+        body = SOURCE_HEADER.sub("", doc.page_content, count=1)
+        for sentence in split_sentences(body):
+            key = " ".join(sentence.lower().split())
+            if key in seen:
+                continue
+            # Début ou fin de chunk coupé au milieu d'une phrase déjà retenue
+            if any(key in other for other in seen_by_source.get(source, ())):
+                continue
+            seen.add(key)
+            seen_by_source.setdefault(source, []).append(key)
+            sentences.append((source, rank, len(sentences), sentence))
+    return sentences
+
+def score_sentences(question, sentences):
+    """
+    Pertinence lexicale de chaque phrase (termes de la question pondérés par idf local,
+    normalisés par la longueur) + léger bonus selon le rang du chunk d'origine.
+    """
+    terms = {t for t in tokenize(question) if t not in STOPWORDS}
+    tokens = [set(tokenize(sentence)) for _, _, _, sentence in sentences]
+    df = Counter(t for sentence_tokens in tokens for t in sentence_tokens & terms)
+    n = max(len(sentences), 1)
+    scores = []
+    for (_, rank, _, _), sentence_tokens in zip(sentences, tokens):
+        matched = sentence_tokens & terms
+        lexical = sum(math.log(1.0 + n / df[t]) for t in matched) / math.sqrt(max(len(sentence_tokens), 1))
+        scores.append(lexical + RANK_PRIOR / (1 + rank))
+    return scores
+
+def prompt_overhead(system_prompt, history, question):
+    """
+    Tokens du prompt hors contexte : prompt système, historique et question.
+    """
+    used = count_tokens(system_prompt) + count_tokens(question)
+    used += sum(count_tokens(getattr(message, "content", str(message))) for message in history or [])
+    return used
+
+def context_budget(system_prompt, history, question, budget=PROMPT_TOKEN_BUDGET, overhead=None):
+    """
+    Tokens disponibles pour le contexte une fois le prompt système, l'historique et la question comptés.
+    """
+    if overhead is None:
+        overhead = prompt_overhead(system_prompt, history, question)
+    return max(MIN_CONTEXT_TOKENS, budget - overhead)
+
+def build_context(question, docs, budget_tokens):
+    """
+    Assemble le contexte compressé : phrases les plus pertinentes jusqu'au budget,
+    remises dans l'ordre de lecture et regroupées par source.
+    Retourne (texte, rapport {"tokens_before", "tokens_after", "sentences", "kept", "docs"}) ;
+    "docs" = rangs des chunks dont au moins une phrase figure dans le contexte.
+    """
+    full_text = "\n\n".join(doc.page_content for doc in docs)
+    tokens_before = count_tokens(full_text)
+    sentences = collect_sentences(docs)
+    scores = score_sentences(question, sentences)
+
+    kept, used, headers = [], 0, set()
+    for i in sorted(range(len(sentences)), key=lambda i: -scores[i]):
+        source = sentences[i][0]
+        cost = count_tokens(sentences[i][3]) + 1
+        if source not in headers:
+            cost += count_tokens(f"Document Source: {source}\n") + 1
+        if used + cost > budget_tokens:
+            continue
+        kept.append(i)
+        headers.add(source)
+        used += cost
+
+    by_source = {}
+    for i in sorted(kept):
+        source, _, _, sentence = sentences[i]
+        by_source.setdefault(source, []).append(sentence)
+    context = "\n\n".join(f"Document Source: {source}\n" + " ".join(parts) for source, parts in by_source.items())
+    tokens_after = count_tokens(context)
+
+    with _STATS_LOCK:
+        COMPRESSION_STATS["requests"] += 1
+        COMPRESSION_STATS["tokens_before"] += tokens_before
+        COMPRESSION_STATS["tokens_after"] += tokens_after
+    report = {"tokens_before": tokens_before, "tokens_after": tokens_after,
+              "sentences": len(sentences), "kept": len(kept),
+              "docs": sorted({sentences[i][1] for i in kept})}
+    return context, report
+
+def compression_stats():
+    with _STATS_LOCK:
+        before = COMPRESSION_STATS["tokens_before"]
+        saved = before - COMPRESSION_STATS["tokens_after"]
+        return dict(COMPRESSION_STATS, saved=saved, saved_ratio=saved / before if before else 0.0)
@@ -0,0 +1,218 @@
+import os
+import re
+import zlib
+import argparse
+
+import numpy as np
+
+from index_registry import DEFAULT_CORPUS, current_index_path
+
+# --- CONFIGURATION ---
+SIGNATURES_FILE = "dedup_signatures.npz"
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+# Similarité de Jaccard (estimée sur les shingles) à partir de laquelle deux chunks sont des doublons.
+# À 0.85 (shingles de 5 mots), deux éditions d'une page qui ne diffèrent que par quelques chiffres
+# (frais, dates limites, crédits) se ressemblent assez pour fusionner : les chunks dont les nombres
+# diffèrent ne sont donc jamais fusionnés (voir numbers_key). Monter le seuil (~0.95) ne suffirait pas
+# pour une longue page avec un seul montant changé, et laisserait passer les reformulations mineures.
+# En contrepartie, un même paragraphe avec un numéro de page différent est gardé en double.
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+DEDUP_VERSION = 2           # 2 : nombres comparés avant fusion (change la signature du pipeline)
+NUM_PERM = 128
+BANDS = 16                  # 16 bandes de 8 lignes : candidats dès ~0.7 de similarité, vérifiés ensuite
+SHINGLE_SIZE = 5            # Shingles de 5 mots
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_DUPLICATE_SOURCES = 50  # Sources fusionnées gardées dans les métadonnées d'un chunk
+
+WORD_PATTERN = re.compile(r"\w+")
+# Nombres isolés ("4,500", "2024", "3.0") ; pas les chiffres collés à un mot ("HASSAN2")
+NUMBER_PATTERN = re.compile(r"\b\d+(?:[.,]\d+)*\b")
+# En-tête ajouté à l'ingestion : l'année d'un nom de fichier ("Wheeling 2023") n'est pas un chiffre du contenu
+SOURCE_HEADER = re.compile(r"^Document Source: .+?\n\n")
+# Permutations fixes : les signatures restent comparables d'un run d'ingestion à l'autre
+_RNG = np.random.default_rng(42)
+_PERM_A = _RNG.integers(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _RNG.integers(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+def shingle_hashes(text):
+    """
+    Hashs 32 bits (crc32, stables entre processus) des shingles de mots du texte.
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in set(shingles)), dtype=np.uint64)
+
+def minhash_signature(text):
+    """
+    Signature MinHash (NUM_PERM minima de permutations (a*x + b) mod p).
+    """
+    hashes = shingle_hashes(text)
+    return ((_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % MERSENNE_PRIME).min(axis=1)
+
+def numbers_key(text):
+    """
+    Empreinte (crc32) de l'ensemble des nombres du texte : deux chunks ne fusionnent que si elle est égale.
+    """
+    body = SOURCE_HEADER.sub("", text, count=1)
+    return zlib.crc32(" ".join(sorted(set(NUMBER_PATTERN.findall(body)))).encode("utf-8"))
+
+def duplicate_location(metadata):
+    """
+    Emplacement (fichier, page, université) d'un chunk, tel que gardé dans duplicate_sources.
+    """
+    entry = {"source": metadata.get("source"), "page": metadata.get("page"), "university": metadata.get("university")}
+    entry.update({field: metadata[field] for field in ("page_label", "total_pages") if field in metadata})
+    return entry
+
+def merge_duplicate_metadata(metadata, duplicate):
+    """
+    Ajoute la source (fichier, page) d'un doublon écarté aux métadonnées du chunk conservé.
+    """
+    entry = duplicate_location(duplicate)
+    if entry["source"] == metadata.get("source") and entry["page"] == metadata.get("page"):
+        return False
+    sources = metadata.setdefault("duplicate_sources", [])
+    if entry in sources or len(sources) >= MAX_DUPLICATE_SOURCES:
+        return False
+    sources.append(entry)
+    return True
+
+def promote_duplicate_source(metadata):
+    """
+    Remplace la source principale du chunk (fichier supprimé, ou qui ne contient plus ce chunk)
+    par la première source fusionnée restante. Retourne False s'il n'y en a aucune.
+    """
+    sources = metadata.get("duplicate_sources")
+    if not sources:
+        return False
+    entry = sources.pop(0)
+    for field in ("page_label", "total_pages"):
+        metadata.pop(field, None)
+    metadata.update(entry)
+    return True
+
+class NearDuplicateIndex:
+    """
+    Index LSH (bandes de signatures MinHash) des chunks conservés. La recherche est globale :
+    une page reprise d'une édition (ou d'un PDF) à l'autre n'est vectorisée qu'une fois.
+    """
+    def __init__(self, threshold=DEDUP_THRESHOLD, bands=BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self.signatures = {}        # id -> signature
+        self.numbers = {}           # id -> numbers_key
+        self.buckets = {}           # (bande, valeurs) -> [ids]
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def _keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def find(self, signature, numbers=None):
+        """
+        Id du chunk conservé le plus proche au-delà du seuil, ou None.
+        Un candidat dont les nombres diffèrent (`numbers`, voir numbers_key) n'est pas un doublon.
+        """
+        best, best_similarity = None, self.threshold
+        seen = set()
+        for key in self._keys(signature):
+            for candidate in self.buckets.get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if numbers is not None and self.numbers.get(candidate, numbers) != numbers:
+                    continue
+                similarity = float(np.mean(self.signatures[candidate] == signature))
+                if similarity >= best_similarity:
+                    best, best_similarity = candidate, similarity
+        return best
+
+    def add(self, chunk_id, signature, numbers=None):
+        if chunk_id in self.signatures:
+            return
+        self.signatures[chunk_id] = signature
+        if numbers is not None:
+            self.numbers[chunk_id] = numbers
+        for key in self._keys(signature):
+            self.buckets.setdefault(key, []).append(chunk_id)
+
+    def remove(self, chunk_ids):
+        for chunk_id in chunk_ids:
+            signature = self.signatures.pop(chunk_id, None)
+            self.numbers.pop(chunk_id, None)
+            if signature is None:
+                continue
+            for key in self._keys(signature):
+                bucket = self.buckets.get(key)
+                if bucket is not None:
+                    bucket.remove(chunk_id)
+                    if not bucket:
+                        del self.buckets[key]
+
+    def save(self, folder_path):
+        ids = list(self.signatures)
+        path = os.path.join(folder_path, SIGNATURES_FILE)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                ids=np.array(ids, dtype="S"),
+                signatures=np.array([self.signatures[i] for i in ids], dtype=np.uint64).reshape(-1, NUM_PERM),
+                numbers=np.array([self.numbers.get(i, 0) for i in ids], dtype=np.uint64),
+            )
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, folder_path, threshold=DEDUP_THRESHOLD):
+        index = cls(threshold)
+        path = os.path.join(folder_path, SIGNATURES_FILE)
+        if os.path.exists(path):
+            data = np.load(path)
+            for chunk_id, signature, numbers in zip(data["ids"], data["signatures"], data["numbers"]):
+                index.add(chunk_id.decode("ascii"), signature, int(numbers))
+        return index
+
+    @staticmethod
+    def exists(folder_path):
+        return os.path.exists(os.path.join(folder_path, SIGNATURES_FILE))
+
+def index_documents(index, docs_by_id):
+    """
+    Ajoute à l'index les chunks déjà vectorisés ({id: Document}), par ex. un index construit
+    avant la déduplication ou les lots repris d'un checkpoint.
+    """
+    for chunk_id, doc in docs_by_id.items():
+        index.add(chunk_id, minhash_signature(doc.page_content), numbers_key(doc.page_content))
+
+def duplicate_report(folder_path, threshold=DEDUP_THRESHOLD):
+    """
+    Quasi-doublons présents dans un index existant (sans le modifier).
+    """
+    from chunk_store import ChunkStore
+
+    store = ChunkStore(folder_path)
+    index = NearDuplicateIndex(threshold)
+    duplicates = 0
+    for position in range(len(store)):
+        doc = store.document(position)
+        signature, numbers = minhash_signature(doc.page_content), numbers_key(doc.page_content)
+        if index.find(signature, numbers) is not None:
+            duplicates += 1
+        else:
+            index.add(doc.id, signature, numbers)
+    print(f"🧬 {duplicates}/{len(store)} chunk(s) quasi-dupliqués (Jaccard >= {threshold}) "
+          f"dans '{folder_path}' : {len(index)} resteraient après déduplication.")
+    return duplicates
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Détection des chunks quasi-dupliqués (MinHash/LSH).")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--folder", default=None, help="Dossier de l'index (défaut : version active du corpus).")
+    parser.add_argument("--threshold", type=float, default=DEDUP_THRESHOLD)
+    args = parser.parse_args()
+    duplicate_report(args.folder or current_index_path(args.corpus), args.threshold)
@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+import time
+import inspect
+import argparse
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# --- CONFIGURATION ---
+MODEL_EMBEDDING = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+# "torch" (HuggingFaceEmbeddings, par défaut) ou "onnx" (ONNX Runtime, int8, CPU)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "models/onnx-paraphrase-multilingual-MiniLM-L12-v2")
+ONNX_FILE = "model.onnx"
+ONNX_INT8_FILE = "model_int8.onnx"
+EXPORT_INFO_FILE = "export_info.json"      # Modèle source de l'export (vérifié au chargement)
+ONNX_QUANTIZED = os.getenv("ONNX_QUANTIZED", "1") == "1"
+ONNX_BATCH_SIZE = 32
+MAX_SEQ_LENGTH = 128        # max_seq_length du modèle sentence-transformers (troncature identique)
+ONNX_OPSET = 14
+
+# Seuils de parité (cosinus avec les vecteurs PyTorch)
+PARITY_MEAN_COSINE = 0.99
+PARITY_MIN_COSINE = 0.95
+
+SAMPLE_SENTENCES = [
+    "What are the tuition fees for international students?",
+    "Quels sont les frais de scolarité pour les étudiants étrangers ?",
+    "The application deadline for the fall semester is March 1.",
+    "Les candidats doivent fournir un score TOEFL d'au moins 80.",
+    "Erasmus+ supports mobility for higher education students and staff.",
+    "Housing is guaranteed on campus for first-year undergraduate students.",
+    "La bourse couvre jusqu'à 50 % des frais de scolarité.",
+    "Qatar University offers programs in engineering, business and law.",
+    "Wheeling University requires two letters of recommendation.",
+    "Hassan II University de Casablanca propose des masters en informatique.",
+    "¿Cuáles son los requisitos de admisión para estudiantes internacionales?",
+    "Students must maintain a minimum GPA of 2.0 to remain in good standing.",
+]
+
+def export_onnx(model_name=MODEL_EMBEDDING, output_dir=ONNX_MODEL_DIR):
+    """
+    Exporte le transformeur en ONNX (axes batch et séquence dynamiques) puis le quantifie
+    en int8 (quantification dynamique des poids). Le tokenizer est sauvegardé à côté.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    sample = tokenizer(SAMPLE_SENTENCES[:2], padding=True, return_tensors="pt")
+
+    fp32_path = os.path.join(output_dir, ONNX_FILE)
+    int8_path = os.path.join(output_dir, ONNX_INT8_FILE)
+    # Exporteur TorchScript : l'exporteur "dynamo" (défaut récent) gère mal les axes dynamiques ici
+    options = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    start = time.perf_counter()
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=ONNX_OPSET,
+            **options,
+        )
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, EXPORT_INFO_FILE), "w", encoding="utf-8") as f:
+        json.dump({"model": model_name, "opset": ONNX_OPSET}, f)
+    print(f"✅ Export ONNX en {time.perf_counter() - start:.1f} s : "
+          f"{os.path.getsize(fp32_path) / 1e6:.0f} Mo (fp32), {os.path.getsize(int8_path) / 1e6:.0f} Mo (int8)")
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Embeddings via ONNX Runtime (CPU), compatibles avec HuggingFaceEmbeddings :
+    même troncature, mean pooling sur le masque d'attention, pas de normalisation.
+    Les textes sont triés par longueur en tokens et chaque lot n'est complété
+    (padding) que jusqu'au plus long de ses textes.
+    """
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=ONNX_QUANTIZED, batch_size=ONNX_BATCH_SIZE, threads=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(MAX_SEQ_LENGTH)
+        self.pad_id = self.tokenizer.token_to_id("<pad>") or 0
+        self.batch_size = batch_size
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        path = os.path.join(model_dir, ONNX_INT8_FILE if quantized else ONNX_FILE)
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _embed(self, texts):
+        # Même prétraitement que HuggingFaceEmbeddings
+        encodings = self.tokenizer.encode_batch([t.replace("\n", " ") for t in texts])
+        order = np.argsort([len(e.ids) for e in encodings], kind="stable")
+        vectors = None
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            length = max(len(encodings[i].ids) for i in batch)
+            input_ids = np.full((len(batch), length), self.pad_id, dtype=np.int64)
+            attention_mask = np.zeros((len(batch), length), dtype=np.int64)
+            for row, i in enumerate(batch):
+                ids = encodings[i].ids
+                input_ids[row, :len(ids)] = ids
+                attention_mask[row, :len(ids)] = 1
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+            hidden = self.session.run(None, feeds)[0]
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if vectors is None:
+                vectors = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            vectors[batch] = pooled
+        return vectors if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+
+    def embed_documents(self, texts):
+        return self._embed(list(texts)).tolist()
+
+    def embed_query(self, text):
+        return self._embed([text])[0].tolist()
+
+def exported_model_name(model_dir=None):
+    """
+    Modèle source de l'export ONNX (MODEL_EMBEDDING pour un export antérieur à export_info.json).
+    """
+    path = os.path.join(model_dir or ONNX_MODEL_DIR, EXPORT_INFO_FILE)
+    if not os.path.exists(path):
+        return MODEL_EMBEDDING
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["model"]
+
+def same_model(a, b):
+    # Identifiant du Hub ou dossier local du même modèle (EMBEDDING_MODEL_DIR)
+    return os.path.basename(a.rstrip("/\\")) == os.path.basename(b.rstrip("/\\"))
+
+def load_embeddings(model_name=MODEL_EMBEDDING, device=None, backend=None, model_dir=None):
+    """
+    Modèle d'embedding selon EMBEDDING_BACKEND, pour l'ingestion comme pour les requêtes.
+    Le backend ONNX n'importe pas torch et charge l'export de `model_dir` (ONNX_MODEL_DIR) : il
+    doit provenir de `model_name`, sinon ValueError. Les vecteurs des deux backends sont proches
+    (voir --parity) mais pas identiques : changer de backend réembarque tout le corpus (le backend
+    fait partie de la signature du pipeline d'ingestion).
+    """
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "onnx":
+        model_dir = model_dir or ONNX_MODEL_DIR
+        exported = exported_model_name(model_dir)
+        if not same_model(exported, model_name):
+            raise ValueError(f"L'export ONNX de '{model_dir}' provient de '{exported}', pas de '{model_name}' : "
+                             f"relancez `python embedding_backend.py --export --model {model_name}`.")
+        return OnnxEmbeddings(model_dir)
+    if backend != "torch":
+        raise ValueError(f"EMBEDDING_BACKEND inconnu : {backend} (attendu : torch ou onnx)")
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    if device is None:
+        import torch
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    return HuggingFaceEmbeddings(model_name=model_name, model_kwargs={'device': device})
+
+# --- PARITÉ ET BENCHMARK ---
+
+def benchmark_texts(n):
+    # Mélange de questions courtes et de textes de la taille d'un chunk (~1200 caractères)
+    texts = []
+    for i in range(n):
+        sentence = SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)]
+        texts.append(sentence if i % 3 else " ".join([sentence] * 20)[:1200])
+    return texts
+
+def cosine_rows(a, b):
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    return (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) + 1e-12)
+
+def parity_cosines(texts, model_name=MODEL_EMBEDDING, model_dir=None):
+    """
+    Cosinus par texte entre les vecteurs PyTorch (référence) et ONNX : {"fp32": ..., "int8": ...}.
+    """
+    model_dir = model_dir or ONNX_MODEL_DIR
+    load_embeddings(model_name, backend="onnx", model_dir=model_dir)     # même modèle que la référence
+    reference = load_embeddings(model_name, device="cpu", backend="torch").embed_documents(texts)
+    return {
+        "int8" if quantized else "fp32":
+            cosine_rows(reference, OnnxEmbeddings(model_dir, quantized=quantized).embed_documents(texts))
+        for quantized in (False, True)
+    }
+
+def parity_ok(cosines):
+    return cosines.mean() >= PARITY_MEAN_COSINE and cosines.min() >= PARITY_MIN_COSINE
+
+def parity(texts, model_name=MODEL_EMBEDDING, model_dir=None):
+    ok = True
+    for name, cosines in parity_cosines(texts, model_name, model_dir).items():
+        passed = parity_ok(cosines)
+        ok = ok and passed
+        print(f"{'✅' if passed else '❌'} Parité ONNX {name} : "
+              f"cosinus moyen {cosines.mean():.4f}, min {cosines.min():.4f} ({len(texts)} textes)")
+    return ok
+
+def throughput(embeddings, texts, repeats=3):
+    embeddings.embed_documents(texts[:8])      # chauffe
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        embeddings.embed_documents(texts)
+        best = min(best, time.perf_counter() - start)
+    return len(texts) / best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backend d'embedding ONNX (int8) : export, parité, benchmark.")
+    parser.add_argument("--export", action="store_true", help="Exporte et quantifie le modèle dans ONNX_MODEL_DIR.")
+    parser.add_argument("--model", default=MODEL_EMBEDDING, help="Modèle exporté (identifiant du Hub ou dossier).")
+    parser.add_argument("--parity", action="store_true", help="Compare les vecteurs ONNX aux vecteurs PyTorch.")
+    parser.add_argument("--benchmark", action="store_true", help="Débit en phrases/s (PyTorch, ONNX fp32, ONNX int8).")
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--threads", type=int, default=None, help="Threads ONNX Runtime (défaut : tous les cœurs).")
+    args = parser.parse_args()
+
+    if args.export:
+        export_onnx(args.model)
+    if args.parity and not parity(benchmark_texts(max(len(SAMPLE_SENTENCES), 64)), args.model):
+        sys.exit(1)
+    if args.benchmark:
+        texts = benchmark_texts(args.texts)
+        backends = [
+            ("PyTorch", lambda: load_embeddings(args.model, backend="torch", device="cpu")),
+            ("ONNX fp32", lambda: OnnxEmbeddings(quantized=False, threads=args.threads)),
+            ("ONNX int8", lambda: OnnxEmbeddings(quantized=True, threads=args.threads)),
+        ]
+        for name, factory in backends:
+            print(f"⏱️  {name} : {throughput(factory(), texts):.0f} phrases/s ({len(texts)} textes, CPU)")
@@ -1,64 +1,339 @@
 import os
-import torch
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_groq import ChatGroq
+import re
+import time
+import asyncio
+import threading
+import difflib
+import json
+import argparse
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import httpx
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.messages import HumanMessage, AIMessage
+
+from cache import TTLCache, CachedEmbeddings, SemanticAnswerCache, normalize_query
+from rate_limiter import RateLimitScheduler, RateLimitedChatModel, PRIORITY_HIGH
+from sparse_index import BM25Index
+from retrieval import HybridRetriever
+from partitions import UniversityPartitions
+from compression import build_context, context_budget, compression_stats, prompt_overhead
+from tokens import count_tokens
+from embedding_backend import load_embeddings, EMBEDDING_BACKEND
+from history import ConversationMemory, get_summary_chain
+from reranker import load_reranker, RERANK_CANDIDATES, RERANK_TOP_N
+from index_registry import IndexRegistry, DEFAULT_CORPUS
+from metrics import METRICS, TRACES, TOKEN_BUCKETS
 
 # --- CONFIGURATION CONSTANTES ---
-DB_FAISS_PATH = "vectorstore/db_faiss"
+# Index nommés et versionnés (un par corpus) : voir index_registry.py
 MODEL_EMBEDDING = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 MODEL_LLM = "llama-3.1-8b-instant"  # Le modèle rapide et stable
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# "groq" (production) ou "stub" (LLM local déterministe de stub_llm.py : benchmarks, tests de charge)
+LLM_BACKEND = os.getenv("RAG_LLM", "groq")
+# Le scheduler Groq absorbe les pics (file d'attente + retry des 429) : k n'a plus à être réduit à 3
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", "5"))
+# Reranker cross-encoder : ~30 candidats réordonnés, seuls les meilleurs vont au LLM
+RERANKER = None
 
-def load_rag_components():
+# --- LIMITES GROQ (par clé API, voir console Groq) ---
+GROQ_RPM = int(os.getenv("GROQ_RPM", "30"))
+GROQ_TPM = int(os.getenv("GROQ_TPM", "6000"))
+GROQ_SCHEDULER = RateLimitScheduler(GROQ_RPM, GROQ_TPM)
+
+# --- CACHES ---
+QUERY_EMBEDDING_CACHE = TTLCache(max_entries=4096, ttl_seconds=24 * 3600)
+# Seuil cosinus au-delà duquel deux questions reformulées partagent la même réponse
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+ANSWER_CACHE = SemanticAnswerCache(threshold=ANSWER_CACHE_THRESHOLD, ttl_seconds=ANSWER_CACHE_TTL)
+# Un cache de réponses par corpus (celui du corpus par défaut est ANSWER_CACHE)
+ANSWER_CACHES = {DEFAULT_CORPUS: ANSWER_CACHE}
+
+# --- REFORMULATION (PRÉ-FILTRE LOCAL) ---
+# Une question longue dont la similarité avec le tour précédent est sous ce seuil = nouveau sujet
+NEW_TOPIC_THRESHOLD = float(os.getenv("NEW_TOPIC_THRESHOLD", "0.2"))
+NEW_TOPIC_MIN_WORDS = 6
+# Au-delà de ce ratio de similarité textuelle, la reformulation "ne change rien"
+SPECULATIVE_KEEP_RATIO = 0.9
+
+GREETING_PATTERN = re.compile(
+    r"^(hi|hello|hey|bonjour|bonsoir|salut|coucou|thanks|thank you|thx|merci|"
+    r"good (morning|afternoon|evening)|ok|okay|bye|au revoir)( \w+)?[\s!.,]*$",
+    re.IGNORECASE,
+)
+# Pronoms / ellipses qui renvoient au tour précédent (EN + FR)
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(it|its|it's|they|them|their|this|that|these|those|there|he|she|his|her|"
+    r"same|also|what about|how about|and for|ce|cet|cette|ces|cela|ça|celle|celui|"
+    r"il|elle|ils|elles|leur|leurs|là-bas|et pour|aussi)\b",
+    re.IGNORECASE,
+)
+# Marqueurs d'un sujet explicite (nom d'établissement, programme, sigle)
+SUBJECT_PATTERN = re.compile(
+    r"\b(universit\w*|univercity|college|institute|school|école|erasmus|[A-Z]{2,})\b|(?<!^)(?<![.?!] )\b[A-Z][a-z]+",
+)
+
+CONTEXTUALIZE_STATS = {"turns": 0, "skipped": 0, "speculative_kept": 0, "reasons": {}}
+_STATS_LOCK = threading.Lock()
+
+# --- MÉTRIQUES (export Prometheus : GET /metrics de l'API, traces : metrics.TRACES) ---
+TURN_STAGE_SECONDS = METRICS.histogram(
+    "rag_turn_stage_seconds", "Durée de chaque étape d'un tour (contextualize, cache_lookup, retrieval, context, "
+    "generation, retrieval_<étape>).")
+TURN_SECONDS = METRICS.histogram("rag_turn_seconds", "Latence totale d'un tour de conversation.")
+TURN_TTFT_SECONDS = METRICS.histogram("rag_turn_ttft_seconds", "Temps jusqu'au premier token de la réponse.")
+PROMPT_TOKENS = METRICS.histogram("rag_prompt_tokens", "Tokens du prompt de réponse (estimation tiktoken).",
+                                  TOKEN_BUCKETS)
+COMPLETION_TOKENS = METRICS.histogram("rag_completion_tokens", "Tokens de la réponse générée (estimation tiktoken).",
+                                      TOKEN_BUCKETS)
+CONTEXT_TOKENS = METRICS.histogram("rag_context_tokens", "Tokens du contexte avant/après compression (stage).",
+                                   TOKEN_BUCKETS)
+ANSWER_CACHE_LOOKUPS = METRICS.counter("rag_answer_cache_lookups_total", "Recherches dans le cache de réponses.")
+CONTEXTUALIZE_DECISIONS = METRICS.counter("rag_contextualize_total", "Décisions de reformulation, par raison.")
+
+# --- CONCURRENCE ---
+# Pool borné pour le travail CPU (embedding de la question, recherche FAISS)
+CPU_THREADS = int(os.getenv("RAG_CPU_THREADS", "4"))
+# Nombre maximal de tours traités simultanément par processus (API async)
+MAX_CONCURRENT_REQUESTS = int(os.getenv("RAG_MAX_CONCURRENT_REQUESTS", "64"))
+# Connexions HTTP partagées vers Groq (keep-alive, réutilisées entre sessions)
+GROQ_POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+GROQ_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=CPU_THREADS, thread_name_prefix="rag")
+_HTTP_CLIENT = httpx.Client(limits=GROQ_POOL_LIMITS, timeout=GROQ_TIMEOUT)
+_HTTP_ASYNC_CLIENT = httpx.AsyncClient(limits=GROQ_POOL_LIMITS, timeout=GROQ_TIMEOUT)
+_COMPONENTS = None
+_COMPONENTS_LOCK = threading.Lock()
+_SEMAPHORES = {}
+
+NO_DOCS_ANSWER = "Je ne trouve pas d'information pertinente dans les documents fournis."
+
+# --- DÉMARRAGE ---
+# Modèle d'embedding intégré à l'image Docker (sinon téléchargé depuis le Hub au premier lancement)
+EMBEDDING_MODEL_DIR = os.getenv("EMBEDDING_MODEL_DIR", "models/paraphrase-multilingual-MiniLM-L12-v2")
+WARMUP_QUERY = "What are the tuition fees for international students?"
+# Fichier témoin de disponibilité (readiness), distinct de la vivacité du serveur (liveness)
+READY_FILE = os.getenv("RAG_READY_FILE", "/tmp/unibot.ready")
+STARTUP_TIMINGS = {}        # étape -> secondes
+_STARTUP = {"state": "idle", "error": None}
+# Reruns Streamlit et requêtes API concurrents : un seul thread de chargement
+_STARTUP_LOCK = threading.Lock()
+_EMBEDDINGS = None
+_MODELS_LOCK = threading.Lock()
+
+@contextmanager
+def startup_stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = time.perf_counter() - start
+
+@contextmanager
+def timed_stage(timings, name):
+    # Temps par étape d'une requête (remonté dans l'événement "done")
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - start
+
+def detect_device():
+    # Import tardif : torch n'est chargé qu'au premier chargement du modèle
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def embedding_model_path():
+    return EMBEDDING_MODEL_DIR if os.path.isdir(EMBEDDING_MODEL_DIR) else MODEL_EMBEDDING
+
+def load_models():
     """
-    Charge les Embeddings, FAISS et le LLM Groq.
-    Retourne (retriever, llm) ou (None, None) en cas d'erreur.
+    Embeddings (avec cache LRU/TTL des vecteurs de questions) et reranker, chargés une fois
+    et partagés par tous les index. Retourne les embeddings ou None en cas d'erreur.
+    """
+    global _EMBEDDINGS, RERANKER
+    with _MODELS_LOCK:
+        if _EMBEDDINGS is not None:
+            return _EMBEDDINGS
+        try:
+            # Le backend ONNX (EMBEDDING_BACKEND=onnx) n'importe pas torch
+            device = "cpu"
+            if EMBEDDING_BACKEND == "torch":
+                with startup_stage("import_torch"):
+                    device = detect_device()
+            print(f"--- ⚙️ Engine: Chargement sur {device.upper()} (backend {EMBEDDING_BACKEND}) ---")
+            with startup_stage("embedding_model"):
+                embeddings = CachedEmbeddings(load_embeddings(embedding_model_path(), device), QUERY_EMBEDDING_CACHE)
+            # Reranker cross-encoder (optionnel) : moins de chunks, mieux classés, dans le prompt
+            with startup_stage("reranker"):
+                RERANKER = load_reranker()
+        except Exception as e:
+            print(f"Erreur Embeddings: {e}")
+            return None
+        _EMBEDDINGS = embeddings
+    return _EMBEDDINGS
+
+def load_retriever(folder_path):
+    """
+    Charge une version d'index (FAISS, BM25, partitions) avec les modèles partagés.
+    Retourne le retriever ou None en cas d'erreur. Chaque étape est chronométrée au démarrage.
     """
-    print(f"--- ⚙️ Engine: Chargement sur {DEVICE.upper()} ---")
+    embeddings = load_models()
+    if embeddings is None:
+        return None
+    # Les rechargements ultérieurs (nouvelle version, autre corpus) ne touchent pas aux temps de démarrage
+    timings = STARTUP_TIMINGS if _STARTUP["state"] != "ready" else {}
 
-    # 1. Embeddings
+    if not os.path.exists(folder_path):
+        print(f"❌ Erreur: Base de données introuvable dans '{folder_path}'")
+        return None
+        
     try:
-        embeddings = HuggingFaceEmbeddings(
-            model_name=MODEL_EMBEDDING,
-            model_kwargs={'device': DEVICE}
-        )
+        with timed_stage(timings, "import_langchain"):
+            from vector_index import load_vectorstore
+        # Charge l'index actif (flat, IVF, HNSW, IVF-PQ ou SQ8) déclaré dans index_config.json
+        with timed_stage(timings, "vectorstore"):
+            vectorstore = load_vectorstore(folder_path, embeddings)
+        # Recherche hybride FAISS + BM25 (fusion RRF) si l'index lexical a été construit
+        with timed_stage(timings, "bm25"):
+            bm25 = BM25Index.load(folder_path) if BM25Index.exists(folder_path) else None
+        # Partitions par université : la recherche se limite à l'université citée
+        with timed_stage(timings, "partitions"):
+            partitions = UniversityPartitions.load(folder_path, vectorstore.index.ntotal)
+        if RERANKER is not None:
+            retriever = HybridRetriever(vectorstore=vectorstore, bm25=bm25, partitions=partitions,
+                                        k=RERANK_TOP_N, fetch_k=RERANK_CANDIDATES,
+                                        reranker=RERANKER, candidates=RERANK_CANDIDATES)
+        else:
+            retriever = HybridRetriever(vectorstore=vectorstore, bm25=bm25, partitions=partitions, k=RETRIEVER_K)
     except Exception as e:
-        print(f"Erreur Embeddings: {e}")
-        return None, None
+        print(f"Erreur FAISS: {e}")
+        return None
+    return retriever
 
-    # 2. VectorStore (FAISS)
-    if not os.path.exists(DB_FAISS_PATH):
-        print(f"❌ Erreur: Base de données introuvable dans '{DB_FAISS_PATH}'")
-        return None, None
-        
+def warm_up_index(retriever):
+    # Chauffe d'une nouvelle version avant qu'elle ne reçoive des requêtes
+    retriever.invoke(WARMUP_QUERY)
+
+# Versions chargées par corpus : swap à chaud après ingestion, éviction LRU sous plafond mémoire
+INDEXES = IndexRegistry(loader=load_retriever, warmer=warm_up_index)
+
+def get_retriever(corpus=None):
+    """
+    Retriever de la version active du corpus (par défaut : DEFAULT_CORPUS), chargé à la première
+    demande (qui attend alors la fin du chargement en cours). Retourne None en cas d'erreur.
+    """
     try:
-        vectorstore = FAISS.load_local(
-            DB_FAISS_PATH, 
-            embeddings, 
-            allow_dangerous_deserialization=True
-        )
-        # k=3 pour économiser les tokens et éviter l'erreur 429
-        retriever = vectorstore.as_retriever(search_kwargs={'k': 3})
+        return INDEXES.get(corpus).retriever
+    except KeyError:
+        print(f"❌ Erreur: corpus '{corpus or DEFAULT_CORPUS}' introuvable (aucune version publiée).")
     except Exception as e:
         print(f"Erreur FAISS: {e}")
-        return None, None
+    return None
 
-    # 3. LLM (Groq)
-    # Note: La clé API doit être définie dans os.environ["GROQ_API_KEY"] avant cet appel
+def corpus_exists(corpus):
+    from index_registry import current_version
+    try:
+        return current_version(corpus or DEFAULT_CORPUS) is not None
+    except ValueError:
+        return False
+
+def load_llm():
+    """
+    LLM (Groq), derrière le scheduler RPM/TPM (les retries 429 sont gérés par lui).
+    Note: La clé API doit être définie dans os.environ["GROQ_API_KEY"] avant cet appel
+    Avec RAG_LLM=stub, LLM local sans réseau ni limite de débit (mesures de latence et de charge).
+    """
+    if LLM_BACKEND == "stub":
+        from stub_llm import StubChatModel
+        return StubChatModel()
     try:
-        llm = ChatGroq(
+        from langchain_groq import ChatGroq
+        return RateLimitedChatModel(ChatGroq(
             temperature=0.0, 
-            model_name=MODEL_LLM
-        )
+            model_name=MODEL_LLM,
+            max_retries=0,
+            http_client=_HTTP_CLIENT,
+            http_async_client=_HTTP_ASYNC_CLIENT
+        ), GROQ_SCHEDULER)
     except Exception as e:
         print(f"Erreur Groq: {e}")
-        return None, None
+        return None
 
+def load_rag_components():
+    """
+    Charge les Embeddings, l'index du corpus par défaut et le LLM Groq.
+    Retourne (retriever, llm) ou (None, None) en cas d'erreur.
+    """
+    retriever = get_retriever()
+    if retriever is None:
+        return None, None
+    llm = load_llm()
+    if llm is None:
+        return None, None
     return retriever, llm
 
+def warm_up(retriever):
+    """
+    Requête de chauffe : premier embedding, première recherche FAISS/BM25, reranker, tiktoken.
+    """
+    with startup_stage("warmup"):
+        retriever.invoke(WARMUP_QUERY)
+        count_tokens(WARMUP_QUERY)
+
+def startup():
+    """
+    Chargement complet + chauffe, puis écriture du témoin de disponibilité.
+    """
+    with _STARTUP_LOCK:
+        _STARTUP["state"] = "loading"
+    start = time.perf_counter()
+    try:
+        retriever = get_retriever()
+        if retriever is None:
+            raise RuntimeError("Moteur RAG indisponible (voir les logs de chargement).")
+        warm_up(retriever)
+    except Exception as e:
+        with _STARTUP_LOCK:
+            _STARTUP.update(state="failed", error=str(e))
+        print(f"❌ Démarrage échoué : {e}")
+        return
+    STARTUP_TIMINGS["total"] = time.perf_counter() - start
+    with _STARTUP_LOCK:
+        _STARTUP["state"] = "ready"
+    with open(READY_FILE, "w", encoding="utf-8") as f:
+        json.dump(STARTUP_TIMINGS, f)
+    print("🚀 Moteur prêt : " + ", ".join(f"{name} {seconds:.2f} s" for name, seconds in STARTUP_TIMINGS.items()))
+
+def start_background_load():
+    """
+    Lance le chargement et la chauffe dans un thread (le serveur répond pendant ce temps).
+    """
+    with _STARTUP_LOCK:
+        if _STARTUP["state"] != "idle":
+            return
+        _STARTUP["state"] = "loading"
+    if os.path.exists(READY_FILE):
+        os.remove(READY_FILE)
+    threading.Thread(target=startup, name="rag-startup", daemon=True).start()
+
+def readiness():
+    """
+    État de disponibilité : {"ready", "state" (idle/loading/ready/failed), "error", "stages"}.
+    """
+    with _STARTUP_LOCK:
+        state, error = _STARTUP["state"], _STARTUP["error"]
+    return {
+        "ready": state == "ready",
+        "state": state,
+        "error": error,
+        "stages": dict(STARTUP_TIMINGS),
+    }
+
 def get_contextualize_chain(llm):
     """
     Crée la chaîne qui reformule les questions (Gestion de l'historique et changement de sujet).
@@ -77,14 +352,15 @@ def get_contextualize_chain(llm):
         MessagesPlaceholder(variable_name="chat_history"),
         ("human", "{question}"),
     ])
+
+    # Reformulation courte et bloquante : servie avant les réponses en file d'attente
+    if isinstance(llm, RateLimitedChatModel):
+        llm = llm.with_priority(PRIORITY_HIGH)
     
     return prompt | llm | StrOutputParser()
 
-def get_qa_chain(llm):
-    """
-    Crée la chaîne de réponse finale (RAG) avec gestion des salutations.
-    """
-    system_prompt = """
+# Prompt système de la réponse finale (ses tokens sont déduits du budget de contexte)
+QA_SYSTEM_PROMPT = """
     You are an expert academic advisor for international students.
 
     INSTRUCTIONS:
@@ -97,11 +373,486 @@ def get_qa_chain(llm):
     CONTEXT:
     {context}
     """
-    
+
+def get_qa_chain(llm):
+    """
+    Crée la chaîne de réponse finale (RAG) avec gestion des salutations.
+    """
     prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
+        ("system", QA_SYSTEM_PROMPT),
         MessagesPlaceholder(variable_name="chat_history"),
         ("human", "{question}"),
     ])
     
-    return prompt | llm | StrOutputParser()
\ No newline at end of file
+    return prompt | llm | StrOutputParser()
+
+def assemble_context(question, docs, lc_history):
+    """
+    Contexte compressé (phrases dédupliquées et pertinentes) tenant dans le budget de tokens
+    restant après le prompt système, l'historique et la question.
+    Retourne (contexte, chunks ayant fourni au moins une phrase,
+    tokens {"prompt" (prompt de réponse complet), "context_before", "context_after"}).
+    """
+    overhead = prompt_overhead(QA_SYSTEM_PROMPT, lc_history, question)
+    budget = context_budget(QA_SYSTEM_PROMPT, lc_history, question, overhead=overhead)
+    context, report = build_context(question, docs, budget)
+    tokens = {"prompt": overhead + report["tokens_after"], "context_before": report["tokens_before"],
+              "context_after": report["tokens_after"]}
+    return context, [docs[rank] for rank in report["docs"]], tokens
+
+def answer_cache(corpus):
+    with _STATS_LOCK:
+        if corpus not in ANSWER_CACHES:
+            ANSWER_CACHES[corpus] = SemanticAnswerCache(threshold=ANSWER_CACHE.threshold, ttl_seconds=ANSWER_CACHE_TTL)
+        return ANSWER_CACHES[corpus]
+
+def lookup_cached_answer(index, question):
+    """
+    Cherche une réponse déjà générée pour une question sémantiquement équivalente visant la même
+    université, dans le cache du corpus (vidé quand une nouvelle version de son index est activée).
+    Retourne {"answer", "sources", "similarity"} ou None.
+    """
+    cache = answer_cache(index.corpus)
+    cache.ensure_fingerprint(index.fingerprint)
+    vector = index.retriever.vectorstore.embeddings.embed_query(question)
+    match = cache.lookup(vector, scope=index.retriever.detect_partition(question))
+    ANSWER_CACHE_LOOKUPS.inc(corpus=index.corpus, result="miss" if match is None else "hit")
+    if match is None:
+        return None
+    entry, similarity = match
+    return {"answer": entry["answer"], "sources": entry["sources"], "similarity": similarity}
+
+def store_cached_answer(index, question, answer, sources):
+    vector = index.retriever.vectorstore.embeddings.embed_query(question)
+    scope = index.retriever.detect_partition(question)
+    answer_cache(index.corpus).store(vector, question, answer, sources, scope=scope)
+
+def cache_stats():
+    """
+    Taux de hits des caches (embeddings de questions et réponses sémantiques, par corpus).
+    """
+    with _STATS_LOCK:
+        caches = dict(ANSWER_CACHES)
+    return {
+        "query_embeddings": QUERY_EMBEDDING_CACHE.stats(),
+        "answers": ANSWER_CACHE.stats(),
+        "answers_by_corpus": {corpus: cache.stats() for corpus, cache in caches.items()},
+    }
+
+def context_stats():
+    """
+    Tokens de contexte économisés par la compression (cumul depuis le démarrage).
+    """
+    return compression_stats()
+
+def scheduler_stats():
+    return GROQ_SCHEDULER.stats()
+
+def rerank_stats():
+    """
+    Latence ajoutée par le reranker (moyenne, p95) et replis sur l'ordre vectoriel ; None si désactivé.
+    """
+    return RERANKER.stats() if RERANKER is not None else None
+
+def contextualize_decision(question, lc_history, embeddings):
+    """
+    Pré-filtre local : décide si la reformulation par le LLM est nécessaire.
+    Retourne (besoin de reformuler, raison).
+    """
+    if not lc_history:
+        return False, "no_history"
+    text = question.strip()
+    if GREETING_PATTERN.match(text):
+        return False, "greeting"
+    if FOLLOW_UP_PATTERN.search(text):
+        return True, "follow_up"
+    if SUBJECT_PATTERN.search(text):
+        return False, "self_contained"
+
+    # Détection de nouveau sujet : similarité avec la dernière question de l'utilisateur
+    previous = next((m.content for m in reversed(lc_history) if m.type == "human"), None)
+    if previous and len(text.split()) >= NEW_TOPIC_MIN_WORDS:
+        a = np.asarray(embeddings.embed_query(text))
+        b = np.asarray(embeddings.embed_query(previous))
+        similarity = float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-12))
+        if similarity < NEW_TOPIC_THRESHOLD:
+            return False, "new_topic"
+    return True, "ambiguous"
+
+def _record_contextualize(skipped, reason, kept=False):
+    CONTEXTUALIZE_DECISIONS.inc(reason=reason, rewritten=not skipped)
+    with _STATS_LOCK:
+        CONTEXTUALIZE_STATS["turns"] += 1
+        CONTEXTUALIZE_STATS["skipped"] += int(skipped)
+        CONTEXTUALIZE_STATS["speculative_kept"] += int(kept)
+        CONTEXTUALIZE_STATS["reasons"][reason] = CONTEXTUALIZE_STATS["reasons"].get(reason, 0) + 1
+
+def _keep_speculative(question, reformulated, reason):
+    """
+    La recherche spéculative sur la question brute reste valable si la réécriture la modifie à peine.
+    """
+    ratio = difflib.SequenceMatcher(None, normalize_query(question), normalize_query(reformulated)).ratio()
+    kept = ratio >= SPECULATIVE_KEEP_RATIO
+    _record_contextualize(False, reason, kept=kept)
+    return kept
+
+def prepare_question(question, lc_history, context_chain, retriever, timings=None):
+    """
+    Produit la question autonome. Si la reformulation est nécessaire, la recherche sur
+    la question brute est lancée en parallèle et conservée si la réécriture la modifie à peine
+    (ses temps par étape sont alors ajoutés à `timings`).
+    Retourne (question autonome, documents déjà récupérés ou None).
+    """
+    embeddings = retriever.vectorstore.embeddings
+    rewrite, reason = contextualize_decision(question, lc_history, embeddings)
+    if not rewrite:
+        _record_contextualize(True, reason)
+        return question, None
+
+    speculative_timings = {}
+    speculative = _EXECUTOR.submit(retriever.retrieve, question, speculative_timings)
+    reformulated = context_chain.invoke({"chat_history": lc_history, "question": question})
+    if _keep_speculative(question, reformulated, reason):
+        docs = speculative.result()
+        if timings is not None:
+            timings.update(speculative_timings)
+        return reformulated, docs
+    speculative.cancel()
+    return reformulated, None
+
+def contextualize_stats():
+    """
+    Part des tours qui évitent l'appel LLM de reformulation.
+    """
+    with _STATS_LOCK:
+        stats = dict(CONTEXTUALIZE_STATS, reasons=dict(CONTEXTUALIZE_STATS["reasons"]))
+    stats["skip_rate"] = stats["skipped"] / stats["turns"] if stats["turns"] else 0.0
+    return stats
+
+# --- API ASYNCHRONE ---
+
+def get_components():
+    """
+    Composants partagés par processus (chargés une seule fois, thread-safe) :
+    {"llm", "context_chain", "qa_chain", "summary_chain"}. Le retriever dépend du corpus
+    et de la version active : voir INDEXES.acquire.
+    """
+    global _COMPONENTS
+    if _COMPONENTS is None:
+        with _COMPONENTS_LOCK:
+            if _COMPONENTS is None:
+                retriever, llm = load_rag_components()
+                if retriever is None:
+                    raise RuntimeError("Moteur RAG indisponible (voir les logs de chargement).")
+                _COMPONENTS = {
+                    "llm": llm,
+                    "context_chain": get_contextualize_chain(llm),
+                    "qa_chain": get_qa_chain(llm),
+                    "summary_chain": get_summary_chain(llm),
+                }
+    return _COMPONENTS
+
+def to_lc_history(messages):
+    """
+    Convertit un historique [{"role", "content"}, ...] en messages LangChain.
+    """
+    return [
+        HumanMessage(content=m["content"]) if m["role"] == "user" else AIMessage(content=m["content"])
+        for m in messages
+    ]
+
+def new_memory():
+    """
+    Mémoire bornée (fenêtre récente + résumé glissant) pour une nouvelle session.
+    """
+    return ConversationMemory(get_components()["summary_chain"])
+
+def format_sources(docs):
+    # Nettoyage des noms de sources (y compris celles des doublons fusionnés à l'ingestion)
+    names = []
+    for d in docs:
+        names.append(os.path.basename(d.metadata.get('source', 'Inconnu')))
+        names.extend(os.path.basename(s['source']) for s in d.metadata.get('duplicate_sources', []))
+    return ", ".join(list(dict.fromkeys(names)))
+
+def engine_stats():
+    """
+    Indicateurs agrégés du moteur (panneau Performance, endpoint /stats de l'API).
+    """
+    return {
+        "caches": cache_stats(),
+        "contextualize": contextualize_stats(),
+        "scheduler": scheduler_stats(),
+        "context": context_stats(),
+        "rerank": rerank_stats(),
+        "indexes": INDEXES.stats(),
+    }
+
+def _collect_metrics():
+    """
+    Valeurs déjà tenues par les caches, le scheduler Groq et le registre d'index, exposées à l'export.
+    """
+    caches = cache_stats()
+    yield ("rag_query_embedding_cache_entries", "gauge", "Embeddings de questions en cache.", {},
+           caches["query_embeddings"]["entries"])
+    for corpus, stats in caches["answers_by_corpus"].items():
+        yield ("rag_answer_cache_entries", "gauge", "Réponses en cache sémantique.", {"corpus": corpus},
+               stats["entries"])
+    scheduler = scheduler_stats()
+    yield ("rag_llm_requests_total", "counter", "Appels LLM accordés par le scheduler.", {}, scheduler["granted"])
+    yield ("rag_llm_rate_limited_total", "counter", "Réponses 429 reçues du LLM.", {}, scheduler["rate_limited"])
+    yield ("rag_llm_wait_seconds_total", "counter", "Attente cumulée imposée par le scheduler.", {},
+           scheduler["wait_seconds"])
+    yield ("rag_llm_queued", "gauge", "Appels LLM en attente de budget.", {}, scheduler["queued"])
+    yield ("rag_llm_tokens_in_window", "gauge", "Tokens estimés dans la fenêtre glissante.", {},
+           scheduler["tokens_in_window"])
+    indexes = INDEXES.stats()
+    for corpus, entry in indexes["loaded"].items():
+        labels = {"corpus": corpus, "version": entry["version"]}
+        yield ("rag_index_in_flight", "gauge", "Tours en cours par index chargé.", labels, entry["in_flight"])
+        yield ("rag_index_size_bytes", "gauge", "Taille sur disque des index chargés.", labels,
+               int(entry["size_mb"] * 1e6))
+    yield ("rag_index_memory_bytes", "gauge", "Taille cumulée des index chargés.", {},
+           int(indexes["memory_mb"] * 1e6))
+    for event in ("loads", "swaps", "evictions"):
+        yield (f"rag_index_{event}_total", "counter", f"Événements du registre d'index ({event}).", {},
+               indexes[event])
+    traces = TRACES.stats()
+    yield ("rag_traces_written_total", "counter", "Traces JSON-lines écrites.", {}, traces["written"])
+    yield ("rag_traces_dropped_total", "counter", "Traces abandonnées (file pleine).", {}, traces["dropped"])
+
+METRICS.register_collector(_collect_metrics)
+
+def record_turn(done):
+    """
+    Histogrammes du tour (étapes, latence, tokens) et, pour une fraction RAG_TRACE_SAMPLE des tours,
+    une trace JSON-lines (écrite par un thread dédié).
+    """
+    corpus = done["corpus"]
+    for stage, seconds in done["timings"].items():
+        TURN_STAGE_SECONDS.observe(seconds, stage=stage, corpus=corpus)
+    TURN_SECONDS.observe(done["latency"], corpus=corpus, cached=done["cached"])
+    TURN_TTFT_SECONDS.observe(done["ttft"], corpus=corpus, cached=done["cached"])
+    if done["tokens"]["prompt"]:
+        PROMPT_TOKENS.observe(done["tokens"]["prompt"], corpus=corpus)
+        COMPLETION_TOKENS.observe(done["tokens"]["completion"], corpus=corpus)
+        CONTEXT_TOKENS.observe(done["tokens"]["context_before"], corpus=corpus, stage="before")
+        CONTEXT_TOKENS.observe(done["tokens"]["context_after"], corpus=corpus, stage="after")
+    if TRACES.sampled():
+        TRACES.write({
+            "kind": "chat",
+            "corpus": corpus,
+            "index_version": done["index_version"],
+            "cached": done["cached"],
+            "ttft": done["ttft"],
+            "latency": done["latency"],
+            "timings": done["timings"],
+            "tokens": done["tokens"] if done["tokens"]["prompt"] else {},
+            "llm": LLM_BACKEND,
+        })
+
+def _begin_turn(history, memory):
+    """
+    (historique, historique LangChain borné par la mémoire de session) au début d'un tour.
+    """
+    history = history or []
+    return history, (memory or ConversationMemory()).lc_history(history)
+
+def _shortcut_answer(cached, docs):
+    """
+    Réponse servie sans appel au LLM (cache sémantique, aucun document) : (réponse, sources) ou None.
+    """
+    if cached:
+        return cached["answer"], cached["sources"]
+    if not docs:
+        return NO_DOCS_ANSWER, "None"
+    return None
+
+def _qa_input(context, lc_history, standalone):
+    return {"context": context, "chat_history": lc_history, "question": standalone}
+
+def update_memory_in_background(memory, turn):
+    """
+    Met à jour le résumé de la session dans un thread, hors du temps de réponse (mêmes garanties en
+    synchrone et en asynchrone : une erreur est journalisée, jamais perdue silencieusement).
+    """
+    def run():
+        try:
+            memory.update(turn)
+        except Exception as e:
+            print(f"⚠️  Mise à jour de la mémoire de session échouée : {e}")
+    threading.Thread(target=run, name="rag-summary", daemon=True).start()
+
+def _finish_turn(index, question, history, memory, standalone, answer, sources, cached, start, ttft, timings,
+                 tokens):
+    """
+    Fin d'un tour : mise à jour de la mémoire, événement "done" et métriques.
+    `tokens` : retour de assemble_context, vide si la réponse n'a pas été générée.
+    """
+    latency = time.perf_counter() - start
+    tokens = dict(tokens, completion=count_tokens(answer)) if tokens else {"prompt": 0, "completion": 0}
+    if memory is not None:
+        turn = history + [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        update_memory_in_background(memory, turn)
+    done = {
+        "type": "done",
+        "answer": answer,
+        "sources": sources,
+        "standalone_question": standalone,
+        "cached": bool(cached),
+        "ttft": ttft if ttft is not None else latency,
+        "latency": latency,
+        "timings": timings,
+        "tokens": tokens,
+        "corpus": index.corpus,
+        "index_version": index.version,
+    }
+    record_turn(done)
+    return done
+
+def stream_answer(question, history=None, memory=None, corpus=None):
+    """
+    Tour de conversation complet (reformulation, cache, recherche, compression, génération).
+    Émet des événements {"type": "token", "content"} puis un {"type": "done", ...} final
+    (mêmes événements que astream_answer). `history` : [{"role", "content"}, ...] sans la question.
+    `corpus` : index interrogé (DEFAULT_CORPUS par défaut) ; le tour entier utilise la même version.
+    """
+    components = get_components()
+    history, lc_history = _begin_turn(history, memory)
+    with INDEXES.acquire(corpus) as index:
+        retriever = index.retriever
+        start = time.perf_counter()
+        timings = {}
+
+        # Reformulation contextuelle (évitée si inutile, recherche spéculative sinon)
+        with timed_stage(timings, "contextualize"):
+            standalone, docs = prepare_question(question, lc_history, components["context_chain"], retriever,
+                                                timings)
+        # Cache sémantique : question équivalente déjà traitée ?
+        with timed_stage(timings, "cache_lookup"):
+            cached = lookup_cached_answer(index, standalone)
+        if not cached and docs is None:
+            with timed_stage(timings, "retrieval"):
+                docs = retriever.retrieve(standalone, timings)
+
+        ttft = None
+        tokens = {}
+        shortcut = _shortcut_answer(cached, docs)
+        if shortcut:
+            answer, sources = shortcut
+            yield {"type": "token", "content": answer}
+        else:
+            with timed_stage(timings, "context"):
+                context, used_docs, tokens = assemble_context(standalone, docs, lc_history)
+            sources = format_sources(used_docs)
+            answer = ""
+            with timed_stage(timings, "generation"):
+                for token in components["qa_chain"].stream(_qa_input(context, lc_history, standalone)):
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    answer += token
+                    yield {"type": "token", "content": token}
+            store_cached_answer(index, standalone, answer, sources)
+
+        yield _finish_turn(index, question, history, memory, standalone, answer, sources, cached, start, ttft,
+                           timings, tokens)
+
+def _semaphore():
+    # Un sémaphore par boucle asyncio (uvicorn : une boucle par worker)
+    loop = asyncio.get_running_loop()
+    if loop not in _SEMAPHORES:
+        _SEMAPHORES[loop] = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return _SEMAPHORES[loop]
+
+async def _run_cpu(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_EXECUTOR, func, *args)
+
+async def aprepare_question(question, lc_history, context_chain, retriever, timings=None):
+    """
+    Version asynchrone de prepare_question : la reformulation (I/O Groq) et la recherche
+    spéculative (CPU, dans le pool borné) se chevauchent sans bloquer la boucle.
+    """
+    embeddings = retriever.vectorstore.embeddings
+    rewrite, reason = await _run_cpu(contextualize_decision, question, lc_history, embeddings)
+    if not rewrite:
+        _record_contextualize(True, reason)
+        return question, None
+
+    speculative_timings = {}
+    speculative = asyncio.ensure_future(_run_cpu(retriever.retrieve, question, speculative_timings))
+    reformulated = await context_chain.ainvoke({"chat_history": lc_history, "question": question})
+    if _keep_speculative(question, reformulated, reason):
+        docs = await speculative
+        if timings is not None:
+            timings.update(speculative_timings)
+        return reformulated, docs
+    speculative.cancel()
+    return reformulated, None
+
+async def astream_answer(question, history=None, memory=None, corpus=None):
+    """
+    Tour de conversation complet en asynchrone (reformulation, cache, recherche, génération).
+    Émet des événements {"type": "token", "content"} puis un {"type": "done", ...} final
+    avec la réponse complète, les sources et les temps.
+    `memory` (ConversationMemory de la session) borne l'historique envoyé et résume les anciens
+    tours ; sans elle, seule la fenêtre récente est envoyée.
+    `corpus` : index interrogé ; une nouvelle version activée en cours de route ne concerne que les tours suivants.
+    """
+    components = get_components()
+    history, lc_history = _begin_turn(history, memory)
+    async with _semaphore():
+        # Premier chargement d'un corpus (ou rechargement après éviction) hors de la boucle
+        await _run_cpu(INDEXES.get, corpus)
+        with INDEXES.acquire(corpus) as index:
+            retriever = index.retriever
+            start = time.perf_counter()
+            timings = {}
+            with timed_stage(timings, "contextualize"):
+                standalone, docs = await aprepare_question(question, lc_history, components["context_chain"],
+                                                           retriever, timings)
+            with timed_stage(timings, "cache_lookup"):
+                cached = await _run_cpu(lookup_cached_answer, index, standalone)
+            if not cached and docs is None:
+                with timed_stage(timings, "retrieval"):
+                    docs = await _run_cpu(retriever.retrieve, standalone, timings)
+
+            ttft = None
+            tokens = {}
+            shortcut = _shortcut_answer(cached, docs)
+            if shortcut:
+                answer, sources = shortcut
+                yield {"type": "token", "content": answer}
+            else:
+                with timed_stage(timings, "context"):
+                    context, used_docs, tokens = await _run_cpu(assemble_context, standalone, docs, lc_history)
+                sources = format_sources(used_docs)
+                answer = ""
+                with timed_stage(timings, "generation"):
+                    async for token in components["qa_chain"].astream(_qa_input(context, lc_history, standalone)):
+                        if ttft is None:
+                            ttft = time.perf_counter() - start
+                        answer += token
+                        yield {"type": "token", "content": token}
+                await _run_cpu(store_cached_answer, index, standalone, answer, sources)
+
+            yield _finish_turn(index, question, history, memory, standalone, answer, sources, cached, start, ttft,
+                               timings, tokens)
+
+async def answer_async(question, history=None, memory=None, corpus=None):
+    """
+    Point d'entrée asynchrone : retourne {"answer", "sources", "standalone_question",
+    "cached", "ttft", "latency", "timings", "tokens", "corpus", "index_version"} sans bloquer la boucle d'événements.
+    """
+    async for event in astream_answer(question, history, memory, corpus):
+        if event["type"] == "done":
+            return {key: value for key, value in event.items() if key != "type"}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Moteur RAG : chargement et chauffe.")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="Charge le moteur, exécute la requête de chauffe et affiche le temps par étape.")
+    args = parser.parse_args()
+
+    if args.startup_report:
+        startup()
+        print(json.dumps(readiness(), indent=2))
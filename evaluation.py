@@ -0,0 +1,363 @@
+import os
+import sys
+import json
+import time
+import argparse
+import unicodedata
+
+import faiss
+
+import engine
+from benchmark import percentile_summary, git_revision
+from retrieval import HybridRetriever, FETCH_K
+from reranker import RERANK_CANDIDATES
+from sparse_index import BM25Index
+from partitions import UniversityPartitions
+from vector_index import (INDEX_TYPES, DEFAULT_SEARCH_PARAMS, read_index_config, load_vectorstore, build_index,
+                          apply_search_params)
+from index_registry import DEFAULT_CORPUS, current_version
+from ingest_advanced import load_manifest
+
+# --- CONFIGURATION ---
+EVAL_OUTPUT = "eval_results.json"
+EVAL_K = (1, 3, 5, 10)
+# Baisse absolue tolérée sur un rappel@k ou le MRR avant de signaler une régression
+REGRESSION_TOLERANCE = float(os.getenv("RAG_EVAL_TOLERANCE", "0.02"))
+
+# Jeu d'évaluation figé sur les PDF du corpus par défaut (data/raw). Chaque question donne ses documents
+# attendus et ses pages pertinentes : soit "pages" ({fichier: [page_label]}, libellés de page du PDF),
+# soit "evidence" (termes qui doivent tous figurer dans le chunk), résolue en pages sur l'index évalué
+# (`--write-labels` fige le résultat dans un JSON relisible).
+EVAL_SET = [
+    {"question": "What are the tuition fees per credit hour at Qatar University?",
+     "sources": ["Qatar_univercity.pdf"], "evidence": ["tuition", "credit hour", "QR"]},
+    {"question": "How much does the College of Medicine at Qatar University charge per year?",
+     "sources": ["Qatar_univercity.pdf"], "evidence": ["Medicine", "tuition", "QR"]},
+    {"question": "What is the Foundation Program at Qatar University?",
+     "sources": ["Qatar_univercity.pdf"], "evidence": ["Foundation Program"]},
+    {"question": "Which TOEFL or IELTS scores does Qatar University accept for English proficiency?",
+     "sources": ["Qatar_univercity.pdf"], "evidence": ["TOEFL", "IELTS"]},
+    {"question": "When is a Qatar University student placed on academic probation?",
+     "sources": ["Qatar_univercity.pdf"], "evidence": ["probation", "GPA"]},
+    {"question": "Which programs does the College of Engineering at Qatar University offer?",
+     "sources": ["Qatar_univercity.pdf"], "evidence": ["College of Engineering"]},
+    {"question": "Quels établissements composent l'université Hassan II de Casablanca ?",
+     "sources": ["HASSAN2_UNIVERCITY.pdf"], "evidence": ["Faculté", "Casablanca"]},
+    {"question": "Comment l'université Hassan II de Casablanca organise-t-elle l'assurance qualité ?",
+     "sources": ["HASSAN2_UNIVERCITY.pdf"], "evidence": ["assurance qualité"]},
+    {"question": "Quelles actions l'université Hassan II mène-t-elle pour l'hygiène et l'environnement ?",
+     "sources": ["HASSAN2_UNIVERCITY.pdf"], "evidence": ["hygiène", "environnement"]},
+    {"question": "Quelles formations de master propose l'université Hassan II de Casablanca ?",
+     "sources": ["HASSAN2_UNIVERCITY.pdf"], "evidence": ["master", "Casablanca"]},
+    {"question": "What does Erasmus+ Key Action 1 fund?",
+     "sources": ["Erasmus_Programme-Guide_EN.pdf"], "evidence": ["Key Action 1", "mobility"]},
+    {"question": "What extra support does Erasmus+ give to participants with fewer opportunities?",
+     "sources": ["Erasmus_Programme-Guide_EN.pdf"], "evidence": ["fewer opportunities", "support"]},
+    {"question": "Can Erasmus+ grants cover traineeships abroad?",
+     "sources": ["Erasmus_Programme-Guide_EN.pdf"], "evidence": ["traineeship", "higher education"]},
+    {"question": "How long can an Erasmus+ student mobility period last?",
+     "sources": ["Erasmus_Programme-Guide_EN.pdf"], "evidence": ["duration", "mobility", "months"]},
+    {"question": "Who are eligible participants in an Erasmus+ higher education mobility project?",
+     "sources": ["Erasmus_Programme-Guide_EN.pdf"], "evidence": ["eligible participants", "higher education"]},
+    {"question": "What is an Erasmus Mundus Joint Master?",
+     "sources": ["Erasmus_Programme-Guide_EN.pdf"], "evidence": ["Erasmus Mundus", "Joint Master"]},
+]
+
+def load_eval_set(path):
+    """
+    Jeu d'évaluation : JSON (liste de {"question", "sources", "pages" ou "evidence"}) ou le jeu intégré.
+    """
+    if path is None:
+        return [dict(item) for item in EVAL_SET]
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _fold(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    return " ".join("".join(c for c in text if not unicodedata.combining(c)).split())
+
+def _locations(doc):
+    """
+    (fichier, libellé de page) couverts par un chunk, doublons fusionnés à l'ingestion compris.
+    Sans libellé (doublons fusionnés), le numéro de page 1-based en tient lieu.
+    """
+    metadata = doc.metadata
+    for owner in [metadata] + metadata.get("duplicate_sources", []):
+        page = owner.get("page")
+        label = owner.get("page_label") or (str(page + 1) if page is not None else None)
+        yield os.path.basename(owner.get("source") or ""), label
+
+def resolve_pages(folder_path, eval_set):
+    """
+    Pages pertinentes des questions à "evidence" : chunks des documents attendus contenant tous
+    les termes (casse et accents ignorés). Une seule lecture du magasin de chunks.
+    """
+    from chunk_store import ChunkStore
+
+    pending = [(item, [_fold(term) for term in item["evidence"]]) for item in eval_set
+               if "pages" not in item and item.get("evidence")]
+    if not pending:
+        return
+    for item, _ in pending:
+        item["pages"] = {}
+    store = ChunkStore(folder_path)
+    for position in range(len(store)):
+        doc = store.document(position)
+        text = _fold(doc.page_content)
+        for item, terms in pending:
+            if all(term in text for term in terms):
+                for source, label in _locations(doc):
+                    if source in item["sources"]:
+                        pages = item["pages"].setdefault(source, [])
+                        if label not in pages:
+                            pages.append(label)
+
+def check_labels(eval_set, indexed):
+    """
+    Questions inutilisables sur cet index : document attendu absent du manifeste,
+    ou aucune page ne contient les termes "evidence". Retourne [(question, raison)].
+    """
+    problems = []
+    for item in eval_set:
+        missing = [source for source in item["sources"] if indexed is not None and source not in indexed]
+        if missing:
+            problems.append((item["question"], f"absent de l'index : {', '.join(missing)}"))
+        elif "pages" in item and not any(item["pages"].get(source) for source in item["sources"]):
+            problems.append((item["question"], f"aucune page ne contient {item.get('evidence')}"))
+    return problems
+
+def matches(doc, item):
+    """
+    Documents attendus (parmi item["sources"]) que ce chunk couvre, sur une page pertinente.
+    """
+    pages = item.get("pages", {})
+    found = set()
+    for source, label in _locations(doc):
+        if source in item["sources"] and (source not in pages or label in map(str, pages[source])):
+            found.add(source)
+    return found
+
+def score_query(docs, item, ks):
+    """
+    Rappel@k (part des documents attendus présents dans les k premiers chunks) et rang réciproque.
+    """
+    first_rank, seen, recall = None, set(), {}
+    for rank, doc in enumerate(docs, start=1):
+        found = matches(doc, item)
+        if found and first_rank is None:
+            first_rank = rank
+        seen |= found
+        for k in ks:
+            if rank == k:
+                recall[k] = len(seen) / len(item["sources"])
+    for k in ks:
+        recall.setdefault(k, len(seen) / len(item["sources"]))
+    return recall, (1.0 / first_rank if first_rank else 0.0), first_rank
+
+# --- CONFIGURATION ÉVALUÉE ---
+
+def build_retriever(folder_path, max_k, mode="hybrid", index_type=None, search_params=None,
+                    rerank=True, partitions=True):
+    """
+    Retriever du moteur sur une version d'index, avec ses variantes : index compressé construit
+    à la volée, recherche dense seule, sans reranker ou sans partitions.
+    Les vecteurs de questions ne passent pas par le cache : chaque latence inclut l'embedding.
+    """
+    embeddings = engine.load_models()
+    if embeddings is None:
+        raise RuntimeError("Modèle d'embedding indisponible.")
+    vectorstore = load_vectorstore(folder_path, getattr(embeddings, "inner", embeddings))
+    config = read_index_config(folder_path)
+    if index_type is not None and index_type != config["type"]:
+        flat = faiss.read_index(os.path.join(folder_path, "index.faiss"))
+        vectorstore.index = build_index(flat, index_type)
+        config = {"type": index_type, "search_params": DEFAULT_SEARCH_PARAMS[index_type]}
+    if search_params is not None:
+        config["search_params"] = search_params
+    apply_search_params(vectorstore.index, config.get("search_params", ""))
+
+    bm25 = BM25Index.load(folder_path) if mode == "hybrid" and BM25Index.exists(folder_path) else None
+    loaded_partitions = UniversityPartitions.load(folder_path, vectorstore.index.ntotal) if partitions else None
+    reranker = engine.RERANKER if rerank else None
+    retriever = HybridRetriever(
+        vectorstore=vectorstore, bm25=bm25, partitions=loaded_partitions, k=max_k,
+        fetch_k=max(RERANK_CANDIDATES if reranker else FETCH_K, max_k),
+        reranker=reranker, candidates=max(RERANK_CANDIDATES, max_k),
+    )
+    description = {
+        "index_type": config["type"],
+        "search_params": config.get("search_params", ""),
+        "mode": "hybrid" if bm25 is not None else "dense",
+        "reranker": reranker is not None,
+        "partitions": loaded_partitions is not None,
+        "vectors": vectorstore.index.ntotal,
+    }
+    return retriever, description
+
+def evaluate(retriever, eval_set, ks):
+    """
+    Rejoue chaque question une fois (après une recherche de chauffe) : rappel@k, MRR,
+    latence par requête et par étape de la recherche.
+    """
+    retriever.retrieve(eval_set[0]["question"])
+    queries, stages = [], {}
+    for item in eval_set:
+        timings = {}
+        start = time.perf_counter()
+        docs = retriever.retrieve(item["question"], timings)
+        latency = time.perf_counter() - start
+        recall, reciprocal_rank, first_rank = score_query(docs, item, ks)
+        for name, seconds in timings.items():
+            stages.setdefault(name.replace("retrieval_", ""), []).append(seconds)
+        stages.setdefault("total", []).append(latency)
+        queries.append({
+            "question": item["question"],
+            "expected": item["sources"],
+            "first_relevant_rank": first_rank,
+            "reciprocal_rank": reciprocal_rank,
+            "recall": {str(k): value for k, value in recall.items()},
+            "latency_ms": latency * 1000,
+            "retrieved": ["{} p.{}".format(*next(_locations(doc))) for doc in docs],
+        })
+    n = len(queries)
+    summary = {f"recall@{k}": sum(q["recall"][str(k)] for q in queries) / n for k in ks}
+    summary["mrr"] = sum(q["reciprocal_rank"] for q in queries) / n
+    summary["misses"] = sum(q["first_relevant_rank"] is None for q in queries)
+    return {
+        "summary": summary,
+        "latency": {name: percentile_summary(values) for name, values in stages.items()},
+        "queries": queries,
+    }
+
+# --- RAPPORT ET RÉGRESSIONS ---
+
+def print_report(results, show_queries=False):
+    summary = results["summary"]
+    scores = ", ".join(f"{name} {value:.3f}" for name, value in summary.items() if name != "misses")
+    skipped = len(results["meta"]["skipped"])
+    print(f"🎯 {scores} sur {len(results['queries'])} question(s)"
+          + (f", {skipped} ignorée(s)" if skipped else "")
+          + f" ({summary['misses']} sans document attendu dans les résultats)")
+    print(f"   {'étape':<14} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, stage in results["latency"].items():
+        print(f"   {name:<14} {stage['n']:>5} {stage['p50_ms']:9.1f} {stage['p95_ms']:9.1f} {stage['p99_ms']:9.1f}")
+    for query in results["queries"]:
+        if show_queries or query["first_relevant_rank"] is None:
+            rank = query["first_relevant_rank"] or "-"
+            print(f"   {'❌' if rank == '-' else '✅'} rang {rank} ({query['latency_ms']:.0f} ms) {query['question']}")
+            if rank == "-":
+                print(f"      attendu {', '.join(query['expected'])} ; obtenu {', '.join(query['retrieved'][:3])}")
+
+def find_regressions(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Scores en baisse de plus de `tolerance` (absolue) par rapport à la référence.
+    La latence est suivie par benchmark.py (mêmes seuils p95).
+    """
+    regressions = []
+    # Moins de questions évaluées (document absent, --allow-missing) : scores non comparables
+    old_questions = baseline.get("meta", {}).get("questions")
+    if old_questions and results["meta"]["questions"] < old_questions:
+        regressions.append(f"questions évaluées : {old_questions} -> {results['meta']['questions']}")
+    for name, value in results["summary"].items():
+        old = baseline.get("summary", {}).get(name)
+        if name == "misses" or old is None:
+            continue
+        if value < old - tolerance:
+            regressions.append(f"{name} : {old:.3f} -> {value:.3f}")
+    return regressions
+
+def run_evaluation(args):
+    eval_set = load_eval_set(args.eval_set)
+    ks = sorted(set(args.k))
+    if args.folder:
+        version, folder = "-", args.folder
+    else:
+        current = current_version(args.corpus)
+        if current is None:
+            raise SystemExit(f"❌ Aucun index publié pour le corpus '{args.corpus}'.")
+        version, folder = current
+    retriever, description = build_retriever(folder, max(ks), args.mode, args.index_type, args.search_params,
+                                             rerank=not args.no_rerank, partitions=not args.no_partitions)
+    manifest = load_manifest(folder)
+    indexed = {os.path.basename(rel) for rel in manifest["files"]} if manifest else None
+    resolve_pages(folder, eval_set)
+    if args.write_labels:
+        with open(args.write_labels, "w", encoding="utf-8") as f:
+            json.dump(eval_set, f, ensure_ascii=False, indent=2)
+        print(f"🏷️  Pages pertinentes écrites dans {args.write_labels}")
+
+    # Un document attendu absent ou un libellé sans page fausse les scores : échec, sauf --allow-missing
+    problems = check_labels(eval_set, indexed)
+    for question, reason in problems:
+        print(f"⚠️  {question} ({reason})")
+    if problems and not args.allow_missing:
+        raise SystemExit(f"❌ {len(problems)}/{len(eval_set)} question(s) inutilisable(s) sur cet index "
+                         f"(corriger le jeu, ou --allow-missing pour les ignorer).")
+    skipped = {question for question, _ in problems}
+    total = len(eval_set)
+    eval_set = [item for item in eval_set if item["question"] not in skipped]
+    if not eval_set:
+        raise SystemExit("❌ Aucune question évaluable sur cet index.")
+    print(f"🧪 Évaluation de '{folder}' : {len(eval_set)}/{total} question(s)"
+          + (f" ({len(skipped)} ignorée(s))" if skipped else "") + ", "
+          + ", ".join(f"{key}={value}" for key, value in description.items()))
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git": git_revision(),
+            "corpus": args.corpus if not args.folder else None,
+            "index_version": version,
+            "folder": folder,
+            # Paramètres d'ingestion de l'index (modèle, chunk_size, chunk_overlap...)
+            "pipeline": manifest.get("pipeline") if manifest else None,
+            "retrieval": description,
+            "eval_set": args.eval_set or "intégré",
+            "questions": len(eval_set),
+            "skipped": sorted(skipped),
+            "k": ks,
+        },
+    }
+    results.update(evaluate(retriever, eval_set, ks))
+    print_report(results, args.show_queries)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Évaluation hors ligne de la recherche (rappel@k, MRR, latence) sur l'index FAISS local.")
+    parser.add_argument("--eval-set", default=None,
+                        help="Jeu d'évaluation JSON ([{\"question\", \"sources\", \"pages\" ou \"evidence\"}]) ; "
+                             "défaut : jeu intégré.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="Corpus dont la version active est évaluée.")
+    parser.add_argument("--folder", default=None, help="Dossier d'une version d'index précise (remplace --corpus).")
+    parser.add_argument("--k", type=int, nargs="+", default=list(EVAL_K))
+    parser.add_argument("--mode", choices=["hybrid", "dense"], default="hybrid",
+                        help="Recherche hybride FAISS + BM25, ou FAISS seul.")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=None,
+                        help="Variante d'index construite à la volée depuis l'index exact (défaut : index actif).")
+    parser.add_argument("--search-params", default=None, help="Paramètres FAISS (ex: 'nprobe=4', 'efSearch=32').")
+    parser.add_argument("--no-rerank", action="store_true", help="Sans reranker cross-encoder.")
+    parser.add_argument("--no-partitions", action="store_true", help="Sans restriction à l'université citée.")
+    parser.add_argument("--allow-missing", action="store_true",
+                        help="Ignore (en les comptant) les questions dont un document attendu est absent de l'index.")
+    parser.add_argument("--write-labels", default=None,
+                        help="Écrit le jeu avec les pages pertinentes résolues (JSON, réutilisable via --eval-set).")
+    parser.add_argument("--show-queries", action="store_true", help="Détail de chaque question.")
+    parser.add_argument("--output", default=EVAL_OUTPUT, help="Résultats JSON.")
+    parser.add_argument("--baseline", default=None, help="Résultats de référence : échec en cas de régression.")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args()
+
+    results = run_evaluation(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"💾 Résultats écrits dans {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"❌ Régression {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"✅ Aucune régression par rapport à {args.baseline} (tolérance {args.tolerance:.2f})")
@@ -0,0 +1,129 @@
+import os
+import threading
+
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
+from tokens import count_tokens
+from rate_limiter import RateLimitedChatModel, PRIORITY_LOW
+
+# --- CONFIGURATION ---
+HISTORY_TURNS = int(os.getenv("HISTORY_TURNS", "3"))                  # Tours (question + réponse) gardés tels quels
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "800"))  # Plafond résumé + tours récents
+SUMMARY_MAX_TOKENS = 250
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+SUMMARY_PROMPT = """
+    You maintain a running summary of a conversation between a student and an academic advisor.
+    Update the existing summary with the new messages below. Keep the universities, programs,
+    figures and preferences the student mentioned. Answer with the updated summary only,
+    in at most {max_words} words.
+
+    EXISTING SUMMARY:
+    {summary}
+
+    NEW MESSAGES:
+    {messages}
+    """
+
+def get_summary_chain(llm):
+    # Tâche de fond : passe après les reformulations et les réponses dans la file Groq
+    if isinstance(llm, RateLimitedChatModel):
+        llm = llm.with_priority(PRIORITY_LOW)
+    prompt = ChatPromptTemplate.from_messages([("human", SUMMARY_PROMPT)])
+    return prompt | llm | StrOutputParser()
+
+def _truncate(text, max_tokens):
+    # Coupe à ~4 caractères par token, à la limite de mot
+    if count_tokens(text) <= max_tokens:
+        return text
+    return text[:max_tokens * 4].rsplit(" ", 1)[0] + " …"
+
+def _to_message(m):
+    return HumanMessage(content=m["content"]) if m["role"] == "user" else AIMessage(content=m["content"])
+
+class ConversationMemory:
+    """
+    Historique borné d'une session : les derniers tours sont envoyés tels quels, les plus
+    anciens sont repliés dans un résumé mis à jour incrémentalement (seuls les nouveaux
+    messages sortis de la fenêtre sont résumés). La taille envoyée aux chaînes reste plafonnée.
+    """
+    def __init__(self, summary_chain=None, turns=HISTORY_TURNS, token_budget=HISTORY_TOKEN_BUDGET):
+        self.summary_chain = summary_chain
+        self.turns = turns
+        self.token_budget = token_budget
+        self.summary = ""
+        self.summarized = 0         # Nombre de messages déjà repliés dans le résumé
+        self.summary_failed = False # Dernier résumé en échec : les messages non repliés restent envoyés
+        self._lock = threading.Lock()
+
+    def window_start(self, messages):
+        """
+        Indice du premier message gardé tel quel : au plus `turns` tours, dans le budget
+        restant une fois le résumé compté.
+        """
+        start = max(0, len(messages) - 2 * self.turns)
+        budget = self.token_budget - (count_tokens(SUMMARY_PREFIX + self.summary) if self.summary else 0)
+        used = 0
+        for i in range(len(messages) - 1, start - 1, -1):
+            used += count_tokens(messages[i]["content"])
+            if used > budget:
+                return i + 1
+        return start
+
+    def lc_history(self, messages):
+        """
+        Messages LangChain à envoyer : résumé (message système) + fenêtre récente.
+        """
+        with self._lock:
+            start = max(self.window_start(messages), min(self.summarized, len(messages)))
+            if self.summary_failed:
+                # Messages sortis de la fenêtre mais pas encore résumés : gardés (au plus `turns` tours
+                # de plus) jusqu'à ce que le prochain update() réussisse à les replier
+                start = max(min(start, self.summarized), start - 2 * self.turns)
+            history = [SystemMessage(content=SUMMARY_PREFIX + self.summary)] if self.summary else []
+            recent = messages[start:]
+            if not recent and messages:
+                # Dernier message trop long pour le budget : on en garde le début
+                last = dict(messages[-1], content=_truncate(messages[-1]["content"], self.token_budget))
+                recent = [last]
+        return history + [_to_message(m) for m in recent]
+
+    def update(self, messages):
+        """
+        Replie dans le résumé les messages sortis de la fenêtre depuis le dernier appel.
+        À appeler après la réponse (hors du chemin critique). Sans chaîne de résumé,
+        les anciens messages sont simplement oubliés.
+        """
+        with self._lock:
+            end = self.window_start(messages)
+            if end <= self.summarized:
+                return
+            new_messages = messages[self.summarized:end]
+            previous = self.summary
+        if self.summary_chain is not None:
+            transcript = "\n".join(f"{m['role']}: {m['content']}" for m in new_messages)
+            try:
+                summary = self.summary_chain.invoke({
+                    "summary": previous or "(empty)",
+                    "messages": _truncate(transcript, self.token_budget * 2),
+                    "max_words": SUMMARY_MAX_TOKENS * 3 // 4,
+                })
+            except Exception as e:
+                # 429, réseau... : rien n'est perdu, le prochain update() reprend les mêmes messages
+                print(f"⚠️  Résumé de l'historique échoué ({e}), nouvel essai au prochain tour.")
+                with self._lock:
+                    self.summary_failed = True
+                return
+            previous = _truncate(summary.strip(), SUMMARY_MAX_TOKENS)
+        with self._lock:
+            self.summary = previous
+            self.summarized = end
+            self.summary_failed = False
+
+    def reset(self):
+        with self._lock:
+            self.summary = ""
+            self.summarized = 0
+            self.summary_failed = False
@@ -0,0 +1,380 @@
+import os
+import re
+import time
+import json
+import shutil
+import argparse
+import threading
+from contextlib import contextmanager
+
+from cache import index_fingerprint
+
+# --- CONFIGURATION ---
+VECTORSTORE_ROOT = "vectorstore"
+# Ancien emplacement unique de l'index : servi comme corpus par défaut tant qu'aucune version n'est publiée
+LEGACY_INDEX_PATH = os.path.join(VECTORSTORE_ROOT, "db_faiss")
+CORPORA_ROOT = os.path.join(VECTORSTORE_ROOT, "corpora")
+CURRENT_FILE = "CURRENT"
+# Marque d'une version en cours d'écriture par une ingestion (retirée à la publication)
+WRITING_FILE = "WRITING"
+DEFAULT_CORPUS = os.getenv("RAG_DEFAULT_CORPUS", "default")
+# Versions publiées gardées sur disque (l'active + la précédente, encore lue par les requêtes en cours)
+KEEP_VERSIONS = int(os.getenv("RAG_KEEP_VERSIONS", "2"))
+# Âge (heures) au-delà duquel une version jamais publiée est considérée abandonnée (ingestion interrompue)
+ABANDONED_VERSION_HOURS = float(os.getenv("RAG_ABANDONED_VERSION_HOURS", "24"))
+# Plafond mémoire (taille sur disque des index chargés) au-delà duquel les index inactifs sont évincés (LRU)
+INDEX_MEMORY_MB = float(os.getenv("RAG_INDEX_MEMORY_MB", "4096"))
+# Intervalle de vérification du pointeur CURRENT (nouvelle version publiée par l'ingestion)
+INDEX_POLL_SECONDS = float(os.getenv("RAG_INDEX_POLL_SECONDS", "10"))
+
+CORPUS_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+# --- DISPOSITION SUR DISQUE ---
+# vectorstore/corpora/<corpus>/versions/<version>/   index, chunks, BM25, partitions, manifeste
+# vectorstore/corpora/<corpus>/versions/<version>/WRITING   présent tant que l'ingestion écrit la version
+# vectorstore/corpora/<corpus>/published.json         versions publiées encore conservées
+# vectorstore/corpora/<corpus>/CURRENT                nom de la version active (remplacé atomiquement)
+# vectorstore/corpora/<corpus>/checkpoint/            points de reprise de l'ingestion en cours
+
+def check_corpus_name(corpus):
+    if not CORPUS_NAME_PATTERN.match(corpus or ""):
+        raise ValueError(f"Nom de corpus invalide : {corpus!r}")
+    return corpus
+
+def corpus_root(corpus):
+    return os.path.join(CORPORA_ROOT, check_corpus_name(corpus))
+
+def corpus_data_path(corpus, default_path="data/raw"):
+    """
+    Dossier des PDF d'un corpus : data/raw pour le corpus par défaut, data/corpora/<corpus> sinon.
+    """
+    return default_path if corpus == DEFAULT_CORPUS else os.path.join("data", "corpora", check_corpus_name(corpus))
+
+def checkpoint_path(corpus):
+    return os.path.join(corpus_root(corpus), "checkpoint")
+
+def current_version(corpus):
+    """
+    (version, dossier) actifs du corpus, ou None s'il n'a jamais été ingéré.
+    """
+    root = corpus_root(corpus)
+    pointer = os.path.join(root, CURRENT_FILE)
+    if os.path.exists(pointer):
+        with open(pointer, "r", encoding="utf-8") as f:
+            version = f.read().strip()
+        return version, os.path.join(root, "versions", version)
+    if corpus == DEFAULT_CORPUS and os.path.exists(os.path.join(LEGACY_INDEX_PATH, "index.faiss")):
+        return "legacy", LEGACY_INDEX_PATH
+    return None
+
+def current_index_path(corpus=DEFAULT_CORPUS):
+    """
+    Dossier de l'index actif (outils en ligne de commande) ; l'ancien emplacement par défaut.
+    """
+    current = current_version(corpus)
+    return current[1] if current else LEGACY_INDEX_PATH
+
+def list_corpora():
+    corpora = []
+    if os.path.isdir(CORPORA_ROOT):
+        corpora = sorted(name for name in os.listdir(CORPORA_ROOT)
+                         if CORPUS_NAME_PATTERN.match(name) and os.path.exists(os.path.join(CORPORA_ROOT, name, CURRENT_FILE)))
+    if DEFAULT_CORPUS not in corpora and current_version(DEFAULT_CORPUS):
+        corpora.insert(0, DEFAULT_CORPUS)
+    return corpora
+
+def new_version(corpus):
+    """
+    Crée le dossier d'une nouvelle version (non publiée) et retourne (version, dossier).
+    """
+    versions_dir = os.path.join(corpus_root(corpus), "versions")
+    os.makedirs(versions_dir, exist_ok=True)
+    base = time.strftime("%Y%m%d-%H%M%S")
+    version, n = base, 1
+    while os.path.exists(os.path.join(versions_dir, version)):
+        n += 1
+        version = f"{base}-{n}"
+    folder = os.path.join(versions_dir, version)
+    os.makedirs(folder)
+    with open(os.path.join(folder, WRITING_FILE), "w", encoding="utf-8") as f:
+        f.write(str(os.getpid()))
+    return version, folder
+
+def published_versions(corpus):
+    path = os.path.join(corpus_root(corpus), "published.json")
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def publish_version(corpus, version):
+    """
+    Désigne `version` comme active (remplacement atomique de CURRENT), puis supprime les versions
+    publiées au-delà de KEEP_VERSIONS. Les dossiers jamais publiés (dont ceux qu'une autre ingestion
+    est en train d'écrire) ne sont pas touchés : voir clean_abandoned_versions.
+    """
+    root = corpus_root(corpus)
+    pointer = os.path.join(root, CURRENT_FILE)
+    history_path = os.path.join(root, "published.json")
+    history = [v for v in published_versions(corpus) if v != version] + [version]
+    writing = os.path.join(root, "versions", version, WRITING_FILE)
+    if os.path.exists(writing):
+        os.remove(writing)
+    with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer + ".tmp", pointer)
+
+    keep = history[-max(KEEP_VERSIONS, 1):]
+    with open(history_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(keep, f)
+    os.replace(history_path + ".tmp", history_path)
+    # Les processus qui ont mappé une version supprimée continuent de la lire (Linux)
+    for name in history:
+        if name not in keep:
+            shutil.rmtree(os.path.join(root, "versions", name), ignore_errors=True)
+
+def clean_abandoned_versions(corpus, max_age_hours=ABANDONED_VERSION_HOURS):
+    """
+    Supprime les dossiers de version jamais publiés dont l'écriture a commencé il y a plus de
+    `max_age_hours` (ingestion interrompue). Retourne les versions supprimées.
+    """
+    versions_dir = os.path.join(corpus_root(corpus), "versions")
+    if not os.path.isdir(versions_dir):
+        return []
+    published = set(published_versions(corpus))
+    current = current_version(corpus)
+    if current:
+        published.add(current[0])
+    removed = []
+    for name in sorted(os.listdir(versions_dir)):
+        folder = os.path.join(versions_dir, name)
+        if name in published or not os.path.isdir(folder):
+            continue
+        writing = os.path.join(folder, WRITING_FILE)
+        started = os.path.getmtime(writing if os.path.exists(writing) else folder)
+        if time.time() - started > max_age_hours * 3600:
+            shutil.rmtree(folder, ignore_errors=True)
+            removed.append(name)
+    if removed:
+        print(f"🧹 {len(removed)} version(s) abandonnée(s) supprimée(s) du corpus '{corpus}' : {', '.join(removed)}")
+    return removed
+
+def folder_size_bytes(folder):
+    return sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
+
+# --- INDEX CHARGÉS CÔTÉ MOTEUR ---
+
+class LoadedIndex:
+    """
+    Une version d'un corpus chargée en mémoire, avec son compteur de requêtes en cours.
+    `fingerprint` (version + fichiers sur disque) est calculée une fois au chargement.
+    """
+    def __init__(self, corpus, version, folder, retriever, size_bytes, load_seconds):
+        self.corpus = corpus
+        self.version = version
+        self.folder = folder
+        self.fingerprint = f"{version}|{index_fingerprint(folder)}"
+        self.retriever = retriever
+        self.size_bytes = size_bytes
+        self.load_seconds = load_seconds
+        self.refs = 0
+        self.retired = False
+        self.last_used = time.monotonic()
+
+class IndexRegistry:
+    """
+    Index nommés et versionnés, chargés à la demande :
+    - une nouvelle version publiée est chargée (et chauffée) en arrière-plan puis activée
+      atomiquement ; les requêtes en cours terminent sur l'ancienne, libérée à la dernière ;
+    - les index inactifs (aucune requête en cours) les moins récemment utilisés sont évincés
+      quand la taille totale dépasse `memory_cap_mb`.
+    `loader(folder)` construit le retriever, `warmer(retriever)` le chauffe avant activation.
+    """
+    def __init__(self, loader, warmer=None, memory_cap_mb=INDEX_MEMORY_MB, poll_seconds=INDEX_POLL_SECONDS):
+        self.loader = loader
+        self.warmer = warmer
+        self.memory_cap_bytes = memory_cap_mb * 1e6
+        self.poll_seconds = poll_seconds
+        self._active = {}           # corpus -> LoadedIndex
+        self._retired = []          # anciennes versions encore utilisées par des requêtes
+        self._last_poll = {}
+        self._swapping = set()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.swaps = 0
+        self.evictions = 0
+        self.loads = 0
+
+    def _load(self, corpus, version, folder):
+        start = time.perf_counter()
+        retriever = self.loader(folder)
+        if retriever is None:
+            raise RuntimeError(f"Index '{corpus}' ({version}) illisible dans '{folder}'.")
+        entry = LoadedIndex(corpus, version, folder, retriever, folder_size_bytes(folder),
+                            time.perf_counter() - start)
+        with self._lock:
+            self.loads += 1
+        print(f"📚 Index '{corpus}' version {version} chargé en {entry.load_seconds:.2f} s "
+              f"({entry.size_bytes / 1e6:.0f} Mo).")
+        return entry
+
+    def _load_lock(self, corpus):
+        with self._lock:
+            return self._load_locks.setdefault(corpus, threading.Lock())
+
+    def get(self, corpus=None):
+        """
+        Version active du corpus (chargée si besoin, en bloquant). Lève KeyError si le corpus n'existe pas.
+        """
+        corpus = check_corpus_name(corpus or DEFAULT_CORPUS)
+        with self._lock:
+            entry = self._active.get(corpus)
+        if entry is None:
+            with self._load_lock(corpus):
+                with self._lock:
+                    entry = self._active.get(corpus)
+                if entry is None:
+                    current = current_version(corpus)
+                    if current is None:
+                        raise KeyError(corpus)
+                    entry = self._load(corpus, *current)
+                    with self._lock:
+                        self._active[corpus] = entry
+                        self._last_poll[corpus] = time.monotonic()
+                    self._evict(keep=entry)
+        else:
+            self._maybe_refresh(corpus)
+        return entry
+
+    @contextmanager
+    def acquire(self, corpus=None):
+        """
+        Réserve la version active pendant une requête : elle ne peut être ni évincée
+        ni libérée par un swap avant la fin du bloc.
+        """
+        while True:
+            entry = self.get(corpus)
+            with self._lock:
+                # Remplacée ou évincée entre get() et la réservation : on reprend la version active
+                if self._active.get(entry.corpus) is entry:
+                    entry.refs += 1
+                    entry.last_used = time.monotonic()
+                    break
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                entry.refs -= 1
+                if entry.retired and entry.refs == 0 and entry in self._retired:
+                    self._retired.remove(entry)
+                    print(f"♻️  Index '{entry.corpus}' version {entry.version} libéré.")
+
+    def _maybe_refresh(self, corpus):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_poll.get(corpus, 0.0) < self.poll_seconds or corpus in self._swapping:
+                return
+            self._last_poll[corpus] = now
+        self.refresh(corpus, wait=False)
+
+    def refresh(self, corpus=None, wait=True):
+        """
+        Active la version publiée du corpus si elle a changé. Retourne True si un swap a été lancé.
+        """
+        corpus = check_corpus_name(corpus or DEFAULT_CORPUS)
+        current = current_version(corpus)
+        with self._lock:
+            entry = self._active.get(corpus)
+            if current is None or entry is None or current[0] == entry.version or corpus in self._swapping:
+                return False
+            self._swapping.add(corpus)
+        worker = threading.Thread(target=self._swap, args=(corpus, *current), name="rag-index-swap", daemon=True)
+        worker.start()
+        if wait:
+            worker.join()
+        return True
+
+    def _swap(self, corpus, version, folder):
+        try:
+            entry = self._load(corpus, version, folder)
+            if self.warmer is not None:
+                self.warmer(entry.retriever)
+            with self._lock:
+                old = self._active.get(corpus)
+                self._active[corpus] = entry
+                self.swaps += 1
+                if old is not None:
+                    old.retired = True
+                    if old.refs:
+                        self._retired.append(old)
+            print(f"🔁 Index '{corpus}' : version {version} active"
+                  + (f" ({old.refs} requête(s) terminent sur {old.version})." if old is not None and old.refs else "."))
+            self._evict(keep=entry)
+        except Exception as e:
+            print(f"❌ Swap de l'index '{corpus}' vers {version} échoué : {e}")
+        finally:
+            with self._lock:
+                self._swapping.discard(corpus)
+
+    def _evict(self, keep=None):
+        """
+        Éviction LRU des index inactifs tant que la taille totale dépasse le plafond.
+        """
+        with self._lock:
+            total = sum(e.size_bytes for e in self._active.values()) + sum(e.size_bytes for e in self._retired)
+            idle = sorted((e for e in self._active.values() if e.refs == 0 and e is not keep),
+                          key=lambda e: e.last_used)
+            evicted = []
+            for entry in idle:
+                if total <= self.memory_cap_bytes:
+                    break
+                del self._active[entry.corpus]
+                entry.retired = True
+                total -= entry.size_bytes
+                evicted.append(entry)
+            self.evictions += len(evicted)
+        for entry in evicted:
+            print(f"🧹 Index '{entry.corpus}' ({entry.version}) évincé (plafond {self.memory_cap_bytes / 1e6:.0f} Mo).")
+
+    def loaded(self):
+        with self._lock:
+            return list(self._active.values())
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._active.values())
+            retired = list(self._retired)
+            return {
+                "loaded": {
+                    e.corpus: {"version": e.version, "in_flight": e.refs, "size_mb": e.size_bytes / 1e6,
+                               "load_seconds": e.load_seconds, "idle_seconds": time.monotonic() - e.last_used}
+                    for e in entries
+                },
+                "draining": [{"corpus": e.corpus, "version": e.version, "in_flight": e.refs} for e in retired],
+                "memory_mb": sum(e.size_bytes for e in entries + retired) / 1e6,
+                "memory_cap_mb": self.memory_cap_bytes / 1e6,
+                "loads": self.loads,
+                "swaps": self.swaps,
+                "evictions": self.evictions,
+            }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Corpus et versions d'index publiés.")
+    parser.add_argument("--publish", nargs=2, metavar=("CORPUS", "VERSION"),
+                        help="Réactive une version encore sur disque (retour arrière).")
+    parser.add_argument("--clean", action="store_true",
+                        help="Supprime les versions jamais publiées plus anciennes que --max-age-hours.")
+    parser.add_argument("--max-age-hours", type=float, default=ABANDONED_VERSION_HOURS)
+    args = parser.parse_args()
+
+    if args.publish:
+        corpus, version = args.publish
+        if not os.path.isdir(os.path.join(corpus_root(corpus), "versions", version)):
+            raise SystemExit(f"❌ Version introuvable : {corpus}/{version}")
+        publish_version(corpus, version)
+    if args.clean:
+        for corpus in list_corpora():
+            clean_abandoned_versions(corpus, args.max_age_hours)
+    for corpus in list_corpora():
+        version, folder = current_version(corpus)
+        print(f"📚 {corpus} : version {version} ({folder}, {folder_size_bytes(folder) / 1e6:.0f} Mo)")
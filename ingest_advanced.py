@@ -1,108 +1,678 @@
 import os
-import re
-import torch
+import json
+import time
+import hashlib
+import argparse
+import shutil
+import queue
+import threading
 import sys
+from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
 
 # --- CORRECTION DES IMPORTS ---
-from langchain_community.document_loaders import PyPDFDirectoryLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from pypdf import PdfReader
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+import numpy as np
+import faiss
+
+from vector_index import INDEX_TYPES, read_index_config, save_compressed_index, write_index_atomic
+from chunk_store import ChunkStore, save_chunk_store, load_writable_docstore
+from sparse_index import build_from_vectorstore
+from partitions import build_partitions, university_name
+from embedding_backend import load_embeddings, EMBEDDING_BACKEND, ONNX_QUANTIZED
+from chunking import (clean_text, SentenceChunker, CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_OVERLAP_POLICY,
+                      CHUNKER_VERSION)
+from dedup import (NearDuplicateIndex, minhash_signature, numbers_key, merge_duplicate_metadata,
+                   promote_duplicate_source, index_documents,
+                   DEDUP_ENABLED, DEDUP_THRESHOLD, DEDUP_VERSION)
+from index_registry import (DEFAULT_CORPUS, check_corpus_name, corpus_data_path, checkpoint_path, current_version,
+                            new_version, publish_version, clean_abandoned_versions)
+from metrics import METRICS, TRACES
 
 # C'est ici que ça changeait : on utilise langchain_core maintenant
 from langchain_core.documents import Document 
 
 # --- 1. CONFIGURATION ---
-DATA_PATH = "data/raw"            # Assurez-vous que vos 5 PDFs sont dans ce dossier
-DB_FAISS_PATH = "vectorstore/db_faiss"
+DATA_PATH = "data/raw"            # Assurez-vous que vos 5 PDFs sont dans ce dossier (corpus par défaut)
+# Index versionnés par corpus : voir index_registry.py (vectorstore/corpora/<corpus>/versions/<version>)
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
 
 # Modèle Multilingue (Arabe + Français + Anglais)
 MODEL_EMBEDDING = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
-def clean_text(text):
+# Parallélisme : une tâche = une plage de pages d'un PDF
+PAGES_PER_TASK = 32
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Embedding par lots : la file bornée limite la mémoire à QUEUE_BATCHES lots en attente
+DEFAULT_BATCH_SIZE = 256
+QUEUE_BATCHES = 4
+
+# Métriques d'ingestion : fichier texte Prometheus (collecteur "textfile" de node_exporter),
+# trace JSON-lines ajoutée à RAG_TRACE_PATH à chaque run
+INGEST_METRICS_FILE = os.getenv("RAG_INGEST_METRICS_FILE", "vectorstore/ingest_metrics.prom")
+INGEST_STAGE_SECONDS = METRICS.histogram("rag_ingest_stage_seconds", "Durée des étapes d'ingestion, par appel.")
+INGEST_CHUNKS = METRICS.counter("rag_ingest_chunks_total", "Chunks traités par l'ingestion, par issue.")
+
+def detect_device():
+    # Import tardif : les workers de parsing (spawn) n'ont pas besoin de torch
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+# Nettoyage et découpage : voir chunking.py (CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_OVERLAP_POLICY).
+# Ces paramètres sont enregistrés dans le manifeste : les changer force une reconstruction.
+
+# --- 2. MANIFESTE (HASHS FICHIERS & CHUNKS) ---
+
+def file_sha256(path):
     """
-    Fonction de nettoyage avancé pour retirer le bruit des PDF.
+    Hash SHA-256 du contenu d'un PDF (lecture par blocs pour les gros catalogues).
     """
-    if not text: return ""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
 
-    # 1. Retirer les numéros de pages isolés
-    text = re.sub(r'Page\s+\d+|^\d+\s*$', '', text, flags=re.MULTILINE)
-    text = re.sub(r'\d+\s+\|\s+P\s+a\s+g\s+e', '', text) # Cas spécifique Wheeling
-    
-    # 2. Retirer les en-têtes répétitifs
-    text = re.sub(r'Undergraduate\s+Catalog\s+2024-2025', '', text, flags=re.IGNORECASE)
-    
-    # 3. Réparer les césures de mots (hyphenation)
-    text = re.sub(r'(\w+)-\s+(\w+)', r'\1\2', text)
+def chunk_id(content):
+    """
+    Identifiant stable d'un chunk = hash de son contenu enrichi.
+    Deux chunks identiques partagent donc le même vecteur.
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+def pipeline_signature():
+    """
+    Paramètres qui invalident tous les vecteurs existants s'ils changent.
+    """
+    return {
+        "version": MANIFEST_VERSION,
+        "model": MODEL_EMBEDDING,
+        # Vecteurs fp32 (torch) et int8 (ONNX quantifié) proches mais pas identiques : pas de mélange dans un index
+        "embedding_backend": EMBEDDING_BACKEND,
+        "quantized": ONNX_QUANTIZED if EMBEDDING_BACKEND == "onnx" else None,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "overlap_policy": CHUNK_OVERLAP_POLICY,
+        "chunker": CHUNKER_VERSION,
+        "dedup": [DEDUP_VERSION, DEDUP_THRESHOLD] if DEDUP_ENABLED else None,
+    }
+
+def load_manifest(folder):
+    manifest_path = os.path.join(folder, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Manifeste illisible ({e}), reconstruction complète.")
+        return None
+
+def save_manifest(manifest, folder):
+    # Écriture atomique : un crash ne laisse jamais un manifeste à moitié écrit
+    manifest_path = os.path.join(folder, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def list_pdf_files(data_path=DATA_PATH):
+    """
+    Retourne {chemin relatif: chemin complet} pour tous les PDF de `data_path`.
+    """
+    root = Path(data_path)
+    return {
+        p.relative_to(root).as_posix(): str(p)
+        for p in sorted(root.glob("**/[!.]*.pdf"))
+        if p.is_file()
+    }
+
+def diff_files(pdf_files, old_files):
+    """
+    Compare les PDF présents au manifeste. La taille et la date de modification
+    servent de filtre rapide ; le hash SHA-256 tranche en cas de doute.
+    Retourne (fichiers à traiter {rel: sha256}, fichiers supprimés).
+    """
+    to_process = {}
+    for rel, path in pdf_files.items():
+        stat = os.stat(path)
+        entry = old_files.get(rel)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            continue
+        digest = file_sha256(path)
+        if entry and entry["sha256"] == digest:
+            # Simple "touch" : contenu identique, on met juste à jour les stats
+            entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime
+            continue
+        to_process[rel] = digest
+    removed = [rel for rel in old_files if rel not in pdf_files]
+    return to_process, removed
+
+# --- 3. TRAITEMENT D'UN PDF ---
+
+def enrich_page(doc):
+    """
+    Nettoie une page et injecte le nom de l'université. Retourne None si la page est vide.
+    """
+    # Identification de la source
+    uni_name = university_name(doc.metadata.get('source', ''))
     
-    # 4. Supprimer les sauts de ligne multiples
-    text = re.sub(r'\n{3,}', '\n\n', text)
+    # Nettoyage
+    cleaned_content = clean_text(doc.page_content)
     
-    return text.strip()
+    # S'il reste du contenu utile
+    if len(cleaned_content) > 50:
+        # INJECTION DE CONTEXTE : On ajoute le nom de l'université au début du chunk
+        doc.page_content = f"Document Source: {uni_name}\n\n{cleaned_content}"
+        # Métadonnées structurées : filtrage par université et citation de la page
+        doc.metadata["university"] = uni_name
+        return doc
+    return None
+
+def parse_page_range(rel, path, start, end):
+    """
+    Tâche exécutée dans un worker : extrait, nettoie et enrichit les pages [start, end) d'un PDF.
+    Retourne (rel, pages enrichies, temps passés par étape).
+    """
+    t0 = time.perf_counter()
+    reader = PdfReader(path)
+    total_pages = len(reader.pages)
+    raw_docs = [
+        Document(
+            page_content=reader.pages[i].extract_text().strip(),
+            metadata={
+                "source": path,
+                "total_pages": total_pages,
+                "page": i,
+                "page_label": reader.page_labels[i],
+            },
+        )
+        for i in range(start, end)
+    ]
+    t1 = time.perf_counter()
+    processed_docs = [d for d in (enrich_page(doc) for doc in raw_docs) if d is not None]
+    t2 = time.perf_counter()
+    return rel, processed_docs, {"parse": t1 - t0, "clean": t2 - t1, "pages": end - start}
+
+def plan_page_ranges(pdf_files, rels):
+    """
+    Découpe chaque PDF à traiter en plages de PAGES_PER_TASK pages.
+    """
+    tasks = []
+    for rel in rels:
+        path = pdf_files[rel]
+        n_pages = len(PdfReader(path).pages)
+        for start in range(0, n_pages, PAGES_PER_TASK):
+            tasks.append((rel, path, start, min(start + PAGES_PER_TASK, n_pages)))
+    return tasks
+
+def iter_processed_pages(tasks, workers):
+    """
+    Exécute les tâches de parsing et renvoie les pages enrichies au fil de l'eau,
+    dans l'ordre où elles se terminent (pas de liste complète en mémoire).
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield parse_page_range(*task)
+        return
+
+    # "spawn" : pas de fork d'un processus qui aurait déjà chargé torch
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        futures = [pool.submit(parse_page_range, *task) for task in tasks]
+        for future in as_completed(futures):
+            yield future.result()
+
+class StageTimer:
+    """
+    Chronométrage cumulé par étape (temps mur côté orchestrateur, temps CPU côté workers).
+    """
+    def __init__(self):
+        self.wall = {}
+        self.worker = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.wall[name] = self.wall.get(name, 0.0) + seconds
+            INGEST_STAGE_SECONDS.observe(seconds, stage=name, side="orchestrateur")
+
+    def add_worker_time(self, name, seconds):
+        self.worker[name] = self.worker.get(name, 0.0) + seconds
+        INGEST_STAGE_SECONDS.observe(seconds, stage=name, side="worker")
+
+    def report(self, workers):
+        print(f"⏱️  Résumé des temps ({workers} worker(s)) :")
+        for name, seconds in self.wall.items():
+            print(f"   - {name:<12} {seconds:8.2f} s")
+        for name, seconds in self.worker.items():
+            print(f"   - {name:<12} {seconds:8.2f} s cumulés dans les workers")
+
+# --- 4. EMBEDDING PAR LOTS & POINTS DE REPRISE ---
+
+def checkpoint_state(manifest, to_process):
+    """
+    Empreinte du travail en cours : un checkpoint n'est réutilisable que pour
+    le même index de départ et les mêmes fichiers à traiter.
+    """
+    base = json.dumps(manifest["files"] if manifest else {}, sort_keys=True)
+    return {
+        "pipeline": pipeline_signature(),
+        "base": hashlib.sha256(base.encode("utf-8")).hexdigest(),
+        "inputs": to_process,
+    }
 
-def load_and_process_documents():
-    print(f"--- 🚀 Démarrage du Traitement Avancé (Sur {DEVICE.upper()}) ---")
+def open_checkpoint(state, folder):
+    """
+    Prépare le dossier de reprise. Retourne les numéros des lots déjà terminés
+    (un lot est terminé quand son fichier .jsonl existe, il est écrit en dernier).
+    """
+    state_path = os.path.join(folder, "state.json")
+    if os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as f:
+            if json.load(f) == state:
+                return sorted(
+                    int(name[len("batch_"):-len(".jsonl")])
+                    for name in os.listdir(folder)
+                    if name.startswith("batch_") and name.endswith(".jsonl")
+                )
+        print("⚠️  Checkpoint obsolète ignoré.")
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    return []
+
+def write_checkpoint_batch(folder, number, ids, texts, metadatas, vectors):
+    base = os.path.join(folder, f"batch_{number:06d}")
+    np.save(base + ".npy", vectors)
+    with open(base + ".jsonl.tmp", "w", encoding="utf-8") as f:
+        for cid, text, metadata in zip(ids, texts, metadatas):
+            f.write(json.dumps({"id": cid, "text": text, "metadata": metadata}, ensure_ascii=False) + "\n")
+    os.replace(base + ".jsonl.tmp", base + ".jsonl")
+
+def read_checkpoint_batch(folder, number):
+    base = os.path.join(folder, f"batch_{number:06d}")
+    with open(base + ".jsonl", "r", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f]
+    vectors = np.load(base + ".npy")
+    return [r["id"] for r in rows], [r["text"] for r in rows], [r["metadata"] for r in rows], vectors
+
+def add_batch(vectorstore, embeddings, ids, texts, metadatas, vectors):
+    """
+    Ajoute un lot de vecteurs au store (créé au premier lot si besoin).
+    """
+    if vectorstore is None:
+        vectorstore = FAISS(embeddings, faiss.IndexFlatL2(vectors.shape[1]), InMemoryDocstore(), {})
+    vectorstore.add_embeddings(list(zip(texts, vectors.tolist())), metadatas=metadatas, ids=ids)
+    return vectorstore
+
+def deduplicate(dedup_index, cid, chunk, stats):
+    """
+    Retourne l'id sous lequel le chunk est indexé : le sien, ou celui du quasi-doublon déjà
+    retenu (qui recevra la source du chunk écarté dans ses métadonnées).
+    """
+    if cid in dedup_index.signatures:
+        # Doublon exact d'un chunk retenu : même vecteur, seule la source est fusionnée
+        stats["merged"].append((cid, chunk.metadata))
+        return cid
+    signature, numbers = minhash_signature(chunk.page_content), numbers_key(chunk.page_content)
+    canonical = dedup_index.find(signature, numbers)
+    if canonical is None:
+        dedup_index.add(cid, signature, numbers)
+        return cid
+    stats["near_duplicates"] += 1
+    stats["merged"].append((canonical, chunk.metadata))
+    return canonical
+
+def apply_duplicate_merges(vectorstore, merged, reprocessed_paths, file_chunks):
+    """
+    Reporte les sources des doublons écartés sur les chunks retenus. Les sources venant des
+    fichiers retraités ou supprimés sont d'abord retirées (elles sont ré-ajoutées si toujours valides).
+    Un chunk dont la source principale a disparu (fichier supprimé, ou retraité sans ce chunk,
+    `file_chunks` : chemin -> ids des fichiers retraités) prend pour source principale un doublon restant :
+    les citations ne pointent jamais vers un PDF absent du corpus.
+    Retourne (sources ajoutées, sources principales remplacées).
+    """
+    docs = vectorstore.docstore._dict
+    for doc in docs.values():
+        sources = doc.metadata.get("duplicate_sources")
+        if sources:
+            doc.metadata["duplicate_sources"] = [s for s in sources if s["source"] not in reprocessed_paths]
+    added = 0
+    for cid, metadata in merged:
+        doc = docs.get(cid)
+        if doc is not None and merge_duplicate_metadata(doc.metadata, metadata):
+            added += 1
+    promoted = 0
+    for cid, doc in docs.items():
+        source = doc.metadata.get("source")
+        if source in reprocessed_paths and cid not in file_chunks.get(source, ()):
+            promoted += promote_duplicate_source(doc.metadata)
+    for doc in docs.values():
+        if doc.metadata.get("duplicate_sources") == []:
+            del doc.metadata["duplicate_sources"]
+    return added, promoted
+
+def produce_chunks(tasks, workers, text_splitter, skip_ids, out_queue, stats, timer, dedup_index=None):
+    """
+    Producteur (thread) : parse les PDF en parallèle, découpe au fil de l'eau et
+    pousse dans la file les chunks qui n'ont pas encore de vecteur (quasi-doublons écartés).
+    """
+    try:
+        queued = set()
+        for rel, docs, timings in iter_processed_pages(tasks, workers):
+            timer.add_worker_time("parse", timings["parse"])
+            timer.add_worker_time("clean", timings["clean"])
+            stats["raw_pages"] += timings["pages"]
+            stats["pages"] += len(docs)
+            # Découpage au fil de l'eau, dès qu'une plage de pages est prête
+            with timer.stage("split"):
+                chunks = text_splitter.split_documents(docs)
+            for chunk in chunks:
+                cid = chunk_id(chunk.page_content)
+                if dedup_index is not None:
+                    # Avant l'embedding : un quasi-doublon est rattaché au chunk retenu, sans vecteur
+                    with timer.stage("dédup"):
+                        cid = deduplicate(dedup_index, cid, chunk, stats)
+                stats["file_chunk_ids"][rel].append(cid)
+                if cid in skip_ids or cid in queued:
+                    continue
+                queued.add(cid)
+                out_queue.put((cid, chunk))
+    except BaseException as e:
+        stats["error"] = e
+    finally:
+        out_queue.put(None)
+
+def iter_batches(in_queue, batch_size):
+    batch = []
+    while True:
+        item = in_queue.get()
+        if item is None:
+            break
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# --- 5. INDEXATION INCRÉMENTALE ---
+
+def record_ingest(corpus, version, timer, counts):
+    """
+    Trace JSON-lines du run (toujours écrite : un run d'ingestion est rare) et export texte des métriques.
+    """
+    for outcome in ("embedded", "resumed", "stale", "near_duplicates"):
+        INGEST_CHUNKS.inc(counts[outcome], corpus=corpus, outcome=outcome)
+    TRACES.write({"kind": "ingest", "corpus": corpus, "version": version, "timings": timer.wall,
+                  "worker_timings": timer.worker, "counts": counts})
+    TRACES.flush()
+    if INGEST_METRICS_FILE:
+        METRICS.write_textfile(INGEST_METRICS_FILE)
+        print(f"📈 Métriques d'ingestion écrites dans '{INGEST_METRICS_FILE}', trace dans '{TRACES.path}'.")
+
+def load_and_process_documents(full_rebuild=False, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE,
+                                index_type=None, corpus=DEFAULT_CORPUS):
+    """
+    Ingestion d'un corpus : lit sa version active, écrit une nouvelle version complète
+    puis la publie (les moteurs en cours d'exécution la chargent sans redémarrer).
+    """
+    data_path = corpus_data_path(check_corpus_name(corpus), DATA_PATH)
+    checkpoint_dir = checkpoint_path(corpus)
+    # Le backend ONNX (EMBEDDING_BACKEND=onnx) tourne sur CPU sans torch
+    device = detect_device() if EMBEDDING_BACKEND == "torch" else "cpu"
+    timer = StageTimer()
+    print(f"--- 🚀 Démarrage du Traitement Avancé (Sur {device.upper()}, backend {EMBEDDING_BACKEND}, "
+          f"{workers} worker(s), corpus '{corpus}') ---")
     
     # Vérification du dossier
-    if not os.path.exists(DATA_PATH):
-        os.makedirs(DATA_PATH)
-        print(f"⚠️  Le dossier '{DATA_PATH}' a été créé. Veuillez y déposer vos PDF et relancer.")
+    if not os.path.exists(data_path):
+        os.makedirs(data_path)
+        print(f"⚠️  Le dossier '{data_path}' a été créé. Veuillez y déposer vos PDF et relancer.")
+        return
+
+    pdf_files = list_pdf_files(data_path)
+    if not pdf_files:
+        print(f"❌ Erreur : Le dossier '{data_path}' est vide. Ajoutez vos PDF.")
         return
 
-    # 1. Chargement Brut
-    loader = PyPDFDirectoryLoader(DATA_PATH)
-    raw_docs = loader.load()
-    print(f"📄 {len(raw_docs)} pages brutes chargées.")
+    # Versions jamais publiées laissées par une ingestion interrompue (celles en cours d'écriture sont récentes)
+    clean_abandoned_versions(corpus)
+
+    # 1. Comparaison avec le manifeste de la version active (jamais modifiée, sauf ses stats de fichiers)
+    current = current_version(corpus)
+    source = current[1] if current else None
+    manifest = None if full_rebuild or source is None else load_manifest(source)
+    index_exists = source is not None and os.path.exists(os.path.join(source, "index.faiss"))
+    if manifest and (manifest.get("pipeline") != pipeline_signature() or not index_exists):
+        print("⚠️  Paramètres d'ingestion modifiés ou index absent : reconstruction complète.")
+        manifest = None
+    old_files = manifest["files"] if manifest else {}
+
+    with timer.stage("manifeste"):
+        to_process, removed = diff_files(pdf_files, old_files)
+    print(f"📂 {len(pdf_files)} PDF : {len(to_process)} nouveau(x)/modifié(s), "
+          f"{len(removed)} supprimé(s), {len(pdf_files) - len(to_process)} inchangé(s).")
+
+    # Type d'index actif : celui demandé, sinon celui déjà en place
+    current_type = read_index_config(source)["type"] if manifest else "flat"
+    index_type = index_type or current_type
 
-    if not raw_docs:
-        print(f"❌ Erreur : Le dossier '{DATA_PATH}' est vide. Ajoutez vos PDF.")
+    if not to_process and not removed:
+        if manifest:
+            save_manifest(manifest, source)
+            if index_type != current_type:
+                # Nouvelle version = copie de l'active avec une autre variante compressée
+                version, target = new_version(corpus)
+                shutil.copytree(source, target, dirs_exist_ok=True)
+                flat = faiss.read_index(os.path.join(target, "index.faiss"))
+                save_compressed_index(target, flat, index_type)
+                publish_version(corpus, version)
+                source = target
+        print(f"✅ Index déjà à jour dans '{source}'")
         return
 
-    processed_docs = []
-    
-    # 2. Nettoyage et Injection de Contexte
-    print("🧹 Nettoyage et Enrichissement des données...")
-    for doc in raw_docs:
-        # Identification de la source
-        full_source = doc.metadata.get('source', '')
-        filename = os.path.basename(full_source) # Extrait juste le nom du fichier
-        uni_name = filename.replace('.pdf', '').replace('_', ' ')
-        
-        # Nettoyage
-        cleaned_content = clean_text(doc.page_content)
-        
-        # S'il reste du contenu utile
-        if len(cleaned_content) > 50:
-            # INJECTION DE CONTEXTE : On ajoute le nom de l'université au début du chunk
-            enriched_content = f"Document Source: {uni_name}\n\n{cleaned_content}"
-            
-            # On met à jour le contenu
-            doc.page_content = enriched_content
-            processed_docs.append(doc)
-
-    print(f"✅ {len(processed_docs)} pages traitées et enrichies.")
-
-    # 3. Chunking Optimisé
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1200,
-        chunk_overlap=300,
-        separators=["\n\n", "(?<=\. )", "\n", " ", ""]
-    )
-    
-    chunks = text_splitter.split_documents(processed_docs)
-    print(f"✂️  Génération de {len(chunks)} fragments (chunks) optimisés.")
-
-    # 4. Embeddings & Indexation
-    print(f"🧠 Calcul des vecteurs avec {MODEL_EMBEDDING}...")
-    embeddings = HuggingFaceEmbeddings(
-        model_name=MODEL_EMBEDDING,
-        model_kwargs={'device': DEVICE}
+    # Les fichiers de la nouvelle version sont écrits à part : la version active reste servie
+    version, target = new_version(corpus)
+    print(f"📦 Nouvelle version '{version}' du corpus '{corpus}' dans '{target}'.")
+
+    # 2. Chargement du modèle et de l'index existant (pendant que les workers démarrent)
+    text_splitter = SentenceChunker(CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_OVERLAP_POLICY)
+
+    print(f"🧠 Chargement de {MODEL_EMBEDDING}...")
+    with timer.stage("modèle"):
+        embeddings = load_embeddings(MODEL_EMBEDDING, device)
+
+    vectorstore = None
+    if manifest:
+        with timer.stage("chargement"):
+            # Ancien format pickle : refusé, à convertir hors ligne
+            if not ChunkStore.exists(source):
+                raise RuntimeError(f"Index au format pickle dans '{source}' : "
+                                   f"lancez `python chunk_store.py --convert --folder {source}`.")
+            index = faiss.read_index(os.path.join(source, "index.faiss"))
+            docstore, index_to_docstore_id = load_writable_docstore(source)
+            vectorstore = FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+    # Signatures MinHash des chunks retenus (recalculées pour un index antérieur à la déduplication)
+    dedup_index = None
+    if DEDUP_ENABLED:
+        with timer.stage("dédup"):
+            if manifest and NearDuplicateIndex.exists(source):
+                dedup_index = NearDuplicateIndex.load(source)
+            else:
+                dedup_index = NearDuplicateIndex()
+                if vectorstore is not None:
+                    index_documents(dedup_index, vectorstore.docstore._dict)
+
+    # 3. Reprise : les lots déjà vectorisés lors d'un run interrompu sont réinjectés tels quels
+    indexed = {cid for entry in old_files.values() for cid in entry["chunks"]}
+    done_batches = open_checkpoint(checkpoint_state(manifest, to_process), checkpoint_dir)
+    resumed_ids = set()
+    with timer.stage("reprise"):
+        for number in done_batches:
+            ids, texts, metadatas, vectors = read_checkpoint_batch(checkpoint_dir, number)
+            vectorstore = add_batch(vectorstore, embeddings, ids, texts, metadatas, vectors)
+            resumed_ids.update(ids)
+            if dedup_index is not None:
+                index_documents(dedup_index, {cid: vectorstore.docstore.search(cid) for cid in ids})
+    if done_batches:
+        print(f"♻️  Reprise : {len(resumed_ids)} chunk(s) déjà vectorisés dans {len(done_batches)} lot(s).")
+
+    # Les chunks propres aux fichiers retraités ne servent plus de référence : la nouvelle version
+    # d'une page ne doit pas être écartée comme doublon de l'ancienne
+    reprocessed = set(to_process) | set(removed)
+    reprocessed_paths = {str(Path(data_path) / rel) for rel in reprocessed}
+    if dedup_index is not None:
+        kept = {cid for rel, entry in old_files.items() if rel not in reprocessed for cid in entry["chunks"]}
+        dedup_index.remove(indexed - kept - resumed_ids)
+
+    # 4. Pipeline producteur/consommateur : parsing + découpage || embedding par lots
+    with timer.stage("plan"):
+        tasks = plan_page_ranges(pdf_files, to_process)
+    print(f"🧹 Nettoyage et Enrichissement de {len(to_process)} PDF en {len(tasks)} tâche(s)...")
+
+    stats = {
+        "raw_pages": 0,
+        "pages": 0,
+        "file_chunk_ids": {rel: [] for rel in to_process},
+        "near_duplicates": 0,
+        "merged": [],
+        "error": None,
+    }
+    chunk_queue = queue.Queue(maxsize=QUEUE_BATCHES * batch_size)
+    producer = threading.Thread(
+        target=produce_chunks,
+        args=(tasks, workers, text_splitter, indexed | resumed_ids, chunk_queue, stats, timer,
+              dedup_index),
+        daemon=True,
     )
 
-    vectorstore = FAISS.from_documents(chunks, embeddings)
-    vectorstore.save_local(DB_FAISS_PATH)
-    print(f"✅ Base de données sauvegardée avec succès dans '{DB_FAISS_PATH}'")
+    pipeline_start = time.perf_counter()
+    producer.start()
+    embedded = 0
+    batch_number = done_batches[-1] if done_batches else 0
+    for batch in iter_batches(chunk_queue, batch_size):
+        ids = [cid for cid, _ in batch]
+        texts = [chunk.page_content for _, chunk in batch]
+        metadatas = [chunk.metadata for _, chunk in batch]
+        with timer.stage("embedding"):
+            vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        batch_number += 1
+        with timer.stage("checkpoint"):
+            write_checkpoint_batch(checkpoint_dir, batch_number, ids, texts, metadatas, vectors)
+        vectorstore = add_batch(vectorstore, embeddings, ids, texts, metadatas, vectors)
+        embedded += len(batch)
+        elapsed = time.perf_counter() - pipeline_start
+        print(f"   🧠 lot {batch_number} : {embedded} chunk(s) vectorisés ({embedded / elapsed:.1f} chunks/s)")
+    producer.join()
+    pipeline_seconds = time.perf_counter() - pipeline_start
+    timer.wall["pipeline"] = pipeline_seconds
+    if stats["error"] is not None:
+        print("❌ Erreur pendant le parsing : le checkpoint est conservé pour la reprise.")
+        raise stats["error"]
+
+    new_files = {rel: entry for rel, entry in old_files.items() if rel not in removed}
+    for rel, digest in to_process.items():
+        stat = os.stat(pdf_files[rel])
+        new_files[rel] = {
+            "sha256": digest,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "chunks": list(dict.fromkeys(stats["file_chunk_ids"][rel])),
+        }
+    print(f"📄 {stats['raw_pages']} pages brutes chargées, {stats['pages']} pages traitées et enrichies.")
+
+    # 5. Retrait des chunks obsolètes (un chunk reste tant qu'un fichier le référence)
+    referenced = {cid for entry in new_files.values() for cid in entry["chunks"]}
+    stale_ids = sorted(indexed - referenced)
+    if stale_ids:
+        vectorstore.delete(stale_ids)
+    if dedup_index is not None:
+        dedup_index.remove(stale_ids)
+        if vectorstore is not None:
+            with timer.stage("dédup"):
+                file_chunks = {str(Path(data_path) / rel): set(new_files[rel]["chunks"]) for rel in to_process}
+                merged_sources, promoted_sources = apply_duplicate_merges(vectorstore, stats["merged"],
+                                                                          reprocessed_paths, file_chunks)
+    new_total = embedded + len(resumed_ids)
+    print(f"✂️  {new_total} chunk(s) vectorisés, {len(stale_ids)} obsolète(s), "
+          f"{len(referenced) - new_total} réutilisé(s).")
+    if embedded:
+        embed_seconds = timer.wall.get("embedding", 0.0)
+        print(f"🚀 Débit : {embedded / pipeline_seconds:.1f} chunks/s de bout en bout, "
+              f"{embedded / max(embed_seconds, 1e-9):.1f} chunks/s en embedding pur.")
+    if dedup_index is not None and vectorstore is not None:
+        # Temps économisé estimé au coût moyen d'embedding d'un chunk mesuré sur ce run
+        saved = ""
+        if embedded:
+            saved_seconds = stats["near_duplicates"] * timer.wall.get("embedding", 0.0) / embedded
+            saved = f", ~{saved_seconds:.1f} s d'embedding économisées"
+        print(f"🧬 Déduplication : {stats['near_duplicates']} quasi-doublon(s) écarté(s) avant embedding "
+              f"(Jaccard >= {DEDUP_THRESHOLD}){saved}, {merged_sources} source(s) fusionnée(s) dans les métadonnées, "
+              f"{promoted_sources} source(s) principale(s) remplacée(s) (fichier supprimé ou modifié).")
+
+    if vectorstore is None:
+        print("❌ Erreur : Aucun contenu exploitable dans les PDF.")
+        shutil.rmtree(target, ignore_errors=True)
+        return
+
+    with timer.stage("sauvegarde"):
+        # Index + chunks sans pickle (lus par mmap côté moteur)
+        write_index_atomic(vectorstore.index, os.path.join(target, "index.faiss"))
+        save_chunk_store(vectorstore, target)
+        if dedup_index is not None:
+            dedup_index.save(target)
+        save_manifest({"pipeline": pipeline_signature(), "files": new_files}, target)
+    # L'index exact reste la référence ; la variante compressée est reconstruite à partir de lui
+    with timer.stage("index"):
+        save_compressed_index(target, vectorstore.index, index_type)
+    # Index lexical BM25 sur les mêmes chunks (recherche hybride)
+    with timer.stage("bm25"):
+        build_from_vectorstore(vectorstore, target)
+    with timer.stage("partitions"):
+        build_partitions(vectorstore, target)
+    # Bascule atomique : les moteurs chargent cette version au prochain contrôle de CURRENT
+    publish_version(corpus, version)
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    timer.report(workers)
+    record_ingest(corpus, version, timer, {
+        "pdf": len(pdf_files), "processed": len(to_process), "removed": len(removed),
+        "pages": stats["pages"], "embedded": embedded, "resumed": len(resumed_ids), "stale": len(stale_ids),
+        "near_duplicates": stats["near_duplicates"], "vectors": int(vectorstore.index.ntotal),
+    })
+    print(f"✅ Base de données sauvegardée avec succès dans '{target}' "
+          f"({vectorstore.index.ntotal} vecteurs), version '{version}' publiée pour le corpus '{corpus}'")
 
 if __name__ == "__main__":
-    load_and_process_documents()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Ingestion incrémentale des PDF dans FAISS.")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignore le manifeste et reconstruit l'index complet.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Nombre de processus de parsing (1 = séquentiel).")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Nombre de chunks vectorisés (et sauvegardés) par lot.")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=None,
+                        help="Index servi par le moteur (défaut : conserve le type actuel, sinon flat).")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS,
+                        help="Corpus à ingérer (PDF de data/corpora/<corpus>, data/raw pour le corpus par défaut).")
+    args = parser.parse_args()
+    load_and_process_documents(
+        full_rebuild=args.full,
+        workers=max(1, args.workers),
+        batch_size=max(1, args.batch_size),
+        index_type=args.index_type,
+        corpus=args.corpus,
+    )
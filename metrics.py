@@ -0,0 +1,307 @@
+import os
+import json
+import time
+import queue
+import random
+import bisect
+import argparse
+import threading
+from contextlib import contextmanager
+
+# --- CONFIGURATION ---
+METRICS_ENABLED = os.getenv("RAG_METRICS", "1") == "1"
+# Traces JSON-lines (une ligne par tour échantillonné, une par ingestion) pour l'analyse hors ligne
+TRACE_PATH = os.getenv("RAG_TRACE_PATH", "logs/traces.jsonl")
+TRACE_SAMPLE_RATE = float(os.getenv("RAG_TRACE_SAMPLE", "0.1"))
+TRACE_QUEUE_MAX = 10000     # Au-delà, les traces sont abandonnées (jamais de blocage du chemin critique)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+# Distances L2 (FAISS), scores BM25 et logits du cross-encoder partagent ces bornes
+SCORE_BUCKETS = (-10.0, -5.0, -2.0, -1.0, 0.0, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0, 10.0, 20.0, 50.0)
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """
+    Compteur cumulatif par combinaison de labels.
+    """
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def render(self):
+        with self._lock:
+            values = dict(self.values)
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(values.items())]
+
+    def snapshot(self):
+        with self._lock:
+            return {_format_labels(key) or "total": value for key, value in self.values.items()}
+
+class Histogram:
+    """
+    Histogramme à bornes fixes (format Prometheus : compteurs cumulés par borne `le`, somme, nombre).
+    Une observation = une recherche dichotomique et un incrément sous verrou.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.series = {}            # labels -> [compteurs par borne (+Inf en dernier), somme, nombre]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED or value is None:
+            return
+        key = _label_key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, timings=None, timing_key=None, **labels):
+        """
+        Chronomètre le bloc ; reporte aussi la durée dans `timings[timing_key]` (temps par tour).
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(seconds, **labels)
+            if timings is not None:
+                timings[timing_key] = timings.get(timing_key, 0.0) + seconds
+
+    def quantile(self, q, **labels):
+        """
+        Quantile estimé par interpolation linéaire dans la borne qui le contient.
+        """
+        with self._lock:
+            series = self.series.get(_label_key(labels))
+            if series is None or series[2] == 0:
+                return None
+            counts, total = list(series[0]), series[2]
+        rank, seen = q * total, 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def render(self):
+        with self._lock:
+            series = {key: (list(s[0]), s[1], s[2]) for key, s in self.series.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = bound if bound == "+Inf" else _format_value(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(float(total))}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            keys = {key: (s[1], s[2]) for key, s in self.series.items()}
+        return {
+            _format_labels(key) or "total": {
+                "count": count, "mean": total / count if count else 0.0,
+                "p50": self.quantile(0.5, **dict(key)), "p95": self.quantile(0.95, **dict(key)),
+            }
+            for key, (total, count) in keys.items()
+        }
+
+class MetricsRegistry:
+    """
+    Métriques du processus. Les collecteurs (fonctions) exposent en plus, au moment de l'export,
+    des valeurs déjà tenues ailleurs (stats des caches, du scheduler, des index chargés).
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, *args):
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, *args)
+            return self.metrics[name]
+
+    def counter(self, name, help_text):
+        return self._get(Counter, name, help_text)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets)
+
+    def register_collector(self, collector):
+        """
+        `collector()` retourne des tuples (nom, type "gauge"/"counter", aide, labels, valeur).
+        """
+        self.collectors.append(collector)
+
+    def render_prometheus(self):
+        """
+        Export texte au format d'exposition Prometheus (version 0.0.4).
+        """
+        lines = []
+        with self._lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        collected = {}
+        for collector in self.collectors:
+            try:
+                for name, kind, help_text, labels, value in collector():
+                    collected.setdefault(name, (kind, help_text, []))[2].append((labels, value))
+            except Exception as e:
+                print(f"⚠️  Collecteur de métriques en erreur : {e}")
+        for name, (kind, help_text, samples) in collected.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(_label_key(labels))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def write_textfile(self, path):
+        """
+        Écrit l'export dans un fichier (collecteur "textfile" de node_exporter), remplacé atomiquement.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(path + ".tmp", path)
+
+METRICS = MetricsRegistry()
+
+class TraceWriter:
+    """
+    Traces JSON-lines écrites par un thread dédié : le chemin critique ne fait qu'un tirage
+    aléatoire et, pour les tours échantillonnés, un ajout dans une file bornée.
+    """
+    def __init__(self, path=TRACE_PATH, sample_rate=TRACE_SAMPLE_RATE):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=TRACE_QUEUE_MAX)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def sampled(self):
+        return bool(self.path) and self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def write(self, record):
+        if not self.path:
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(dict(record, ts=round(time.time(), 3), pid=os.getpid()))
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="rag-traces", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                record = self._queue.get()
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self.written += 1
+                if self._queue.empty():
+                    f.flush()
+                self._queue.task_done()
+
+    def flush(self):
+        # Attend l'écriture des traces en file (fin d'ingestion, fin de benchmark)
+        if self._thread is not None:
+            self._queue.join()
+
+    def stats(self):
+        return {"path": self.path, "sample_rate": self.sample_rate, "written": self.written,
+                "dropped": self.dropped, "pending": self._queue.qsize()}
+
+TRACES = TraceWriter()
+
+# --- ANALYSE HORS LIGNE ---
+
+def summarize_traces(path=TRACE_PATH, kind="chat"):
+    """
+    Percentiles par étape (ms) et tokens moyens sur les traces d'un fichier JSON-lines.
+    """
+    import numpy as np
+
+    stages, tokens, count = {}, {}, 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("kind") != kind:
+                continue
+            count += 1
+            for name, seconds in record.get("timings", {}).items():
+                stages.setdefault(name, []).append(seconds * 1000)
+            for name, value in record.get("tokens", {}).items():
+                tokens.setdefault(name, []).append(value)
+    print(f"📈 {count} trace(s) '{kind}' dans {path}")
+    print(f"   {'étape':<22}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, values in sorted(stages.items(), key=lambda item: -np.percentile(item[1], 95)):
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        print(f"   {name:<22}{len(values):>6}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+    for name, values in tokens.items():
+        print(f"   tokens {name:<15} moyenne {np.mean(values):.0f}, max {max(values)}")
+    return {"count": count, "stages": stages, "tokens": tokens}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyse des traces JSON-lines du moteur et de l'ingestion.")
+    parser.add_argument("--traces", default=TRACE_PATH)
+    parser.add_argument("--kind", default="chat", choices=["chat", "ingest"])
+    args = parser.parse_args()
+    summarize_traces(args.traces, args.kind)
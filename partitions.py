@@ -0,0 +1,121 @@
+import os
+import re
+import json
+import difflib
+import unicodedata
+
+import numpy as np
+import faiss
+
+# --- CONFIGURATION ---
+PARTITIONS_FILE = "partitions.json"
+# Similarité minimale (difflib) entre un mot de la question et un mot-clé d'université ("univercity")
+FUZZY_MATCH_RATIO = 0.85
+# Mots trop génériques pour identifier une université
+GENERIC_WORDS = {
+    "university", "univercity", "universite", "universidad", "universita", "college", "institute",
+    "school", "ecole", "catalog", "catalogue", "guide", "programme", "program", "undergraduate",
+    "graduate", "handbook", "the", "of", "de", "du", "la", "le", "des", "and", "et", "en", "pdf",
+}
+
+def university_name(source):
+    """
+    Nom d'université dérivé du nom de fichier (même règle que l'injection "Document Source").
+    """
+    filename = os.path.basename(source or "")
+    return filename.replace('.pdf', '').replace('_', ' ')
+
+def _fold(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+def _keywords(name):
+    """
+    Mots distinctifs d'un nom ("HASSAN2 UNIVERCITY" -> {"hassan2", "hassan"}).
+    """
+    keywords = set()
+    for word in re.findall(r"\w+", _fold(name)):
+        for variant in (word, re.sub(r"\d+", "", word)):
+            if len(variant) >= 3 and variant not in GENERIC_WORDS and not variant.isdigit():
+                keywords.add(variant)
+    return keywords
+
+def build_partitions(vectorstore, folder_path):
+    """
+    Index université -> positions FAISS (précalculé à l'ingestion).
+    Les positions sont communes à l'index exact, aux index compressés et au BM25.
+    Un chunk dédupliqué à l'ingestion appartient aussi aux universités de ses doublons écartés.
+    """
+    partitions = {}
+    for position, doc_id in vectorstore.index_to_docstore_id.items():
+        metadata = vectorstore.docstore.search(doc_id).metadata
+        owners = [metadata] + metadata.get("duplicate_sources", [])
+        for owner in owners:
+            name = owner.get("university") or university_name(owner.get("source"))
+            entry = partitions.setdefault(name, {"source": os.path.basename(owner.get("source", "")), "ids": []})
+            if not entry["ids"] or entry["ids"][-1] != position:
+                entry["ids"].append(int(position))
+    tmp_path = os.path.join(folder_path, PARTITIONS_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"universities": partitions}, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(folder_path, PARTITIONS_FILE))
+    print(f"🏛️  {len(partitions)} partition(s) par université : "
+          + ", ".join(f"{name} ({len(entry['ids'])})" for name, entry in partitions.items()))
+    return partitions
+
+class UniversityPartitions:
+    """
+    Partitions chargées côté moteur : détection de l'université visée par une question
+    et sélecteurs FAISS / masques BM25 limitant la recherche à ses chunks.
+    """
+    def __init__(self, partitions, n_vectors):
+        self.n_vectors = n_vectors
+        self.ids = {name: np.asarray(entry["ids"], dtype=np.int64) for name, entry in partitions.items()}
+        self.keywords = {name: _keywords(name) for name in partitions}
+        self._selectors = {}
+        self._masks = {}
+
+    @classmethod
+    def load(cls, folder_path, n_vectors):
+        path = os.path.join(folder_path, PARTITIONS_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f)["universities"], n_vectors)
+
+    def detect(self, question):
+        """
+        Retourne l'université citée dans la question, ou None (aucune ou plusieurs).
+        """
+        words = {w for w in re.findall(r"\w+", _fold(question)) if len(w) >= 3}
+        matches = set()
+        for name, keywords in self.keywords.items():
+            for keyword in keywords:
+                if keyword in words or any(
+                    len(w) >= 4 and difflib.SequenceMatcher(None, w, keyword).ratio() >= FUZZY_MATCH_RATIO
+                    for w in words
+                ):
+                    matches.add(name)
+                    break
+        return matches.pop() if len(matches) == 1 else None
+
+    def search_params(self, index, name):
+        """
+        Paramètres de recherche FAISS restreints à la partition (le type dépend de l'index).
+        """
+        if name not in self._selectors:
+            self._selectors[name] = faiss.IDSelectorBatch(self.ids[name])
+        selector = self._selectors[name]
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+        if hasattr(index, "hnsw"):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+        return faiss.SearchParameters(sel=selector)
+
+    def mask(self, name):
+        if name not in self._masks:
+            mask = np.zeros(self.n_vectors, dtype=bool)
+            mask[self.ids[name]] = True
+            self._masks[name] = mask
+        return self._masks[name]
@@ -0,0 +1,325 @@
+import time
+import heapq
+import random
+import asyncio
+import argparse
+import itertools
+import threading
+from collections import deque
+
+from langchain_core.runnables import Runnable
+
+from tokens import count_tokens
+
+# --- PRIORITÉS ---
+PRIORITY_HIGH = 0      # Reformulation : courte et sur le chemin critique
+PRIORITY_NORMAL = 1    # Réponse finale
+PRIORITY_LOW = 2       # Tâches de fond (résumés, évaluations)
+
+# --- BACKOFF ---
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+MAX_RETRIES = 5
+# Tokens de complétion réservés a priori (ajustés avec l'usage réel après l'appel)
+EXPECTED_COMPLETION_TOKENS = 400
+
+def is_rate_limit_error(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+def retry_after_seconds(error):
+    """
+    Délai imposé par l'en-tête `retry-after` de la réponse 429 (en secondes), sinon None.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, error=None):
+    """
+    Backoff exponentiel avec jitter ("full jitter" borné) ; retry-after prime s'il est plus long.
+    """
+    delay = random.uniform(0.5, 1.0) * min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    server_delay = retry_after_seconds(error) if error is not None else None
+    if server_delay is not None:
+        delay = max(delay, server_delay + random.uniform(0, 0.1 * server_delay + 0.05))
+    return delay
+
+class RateLimitScheduler:
+    """
+    Ordonnanceur côté client : fenêtre glissante de requêtes/minute et tokens/minute,
+    file d'attente par priorité (FIFO à priorité égale) et pause globale après un 429.
+    Utilisable depuis des threads (acquire) comme depuis asyncio (aacquire).
+    """
+    def __init__(self, rpm, tpm, window=60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self._events = deque()          # [instant, tokens] des requêtes dans la fenêtre
+        self._tokens_in_window = 0
+        self._waiting = []              # tas de tickets (priorité, numéro d'arrivée)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._blocked_until = 0.0
+        self.stats_data = {"granted": 0, "rate_limited": 0, "retries": 0, "wait_seconds": 0.0}
+
+    def _prune(self, now):
+        while self._events and now - self._events[0][0] >= self.window:
+            self._tokens_in_window -= self._events.popleft()[1]
+
+    def _delay(self, tokens, now):
+        """
+        Temps d'attente avant de pouvoir émettre `tokens` (0 si possible immédiatement).
+        """
+        delay = max(0.0, self._blocked_until - now)
+        if len(self._events) >= self.rpm:
+            delay = max(delay, self._events[len(self._events) - self.rpm][0] + self.window - now)
+        if self._tokens_in_window + tokens > self.tpm and self._events:
+            # Attendre que suffisamment de tokens sortent de la fenêtre
+            freed = self.tpm - tokens
+            running = self._tokens_in_window
+            for instant, used in self._events:
+                running -= used
+                if running <= freed:
+                    delay = max(delay, instant + self.window - now)
+                    break
+        return delay
+
+    def _poll(self, ticket, tokens):
+        """
+        Tente d'attribuer le créneau au ticket. Retourne 0 (accordé), un délai d'attente,
+        ou None si un ticket plus prioritaire est devant.
+        """
+        with self._cond:
+            if self._waiting[0] != ticket:
+                return None
+            now = time.monotonic()
+            self._prune(now)
+            delay = self._delay(tokens, now)
+            if delay > 0:
+                return delay
+            heapq.heappop(self._waiting)
+            grant = [now, tokens]
+            self._events.append(grant)
+            self._tokens_in_window += tokens
+            self.stats_data["granted"] += 1
+            self._cond.notify_all()
+            return 0, grant
+
+    def _enqueue(self, priority):
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            return ticket
+
+    def _cancel(self, ticket):
+        with self._cond:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def acquire(self, tokens, priority=PRIORITY_NORMAL):
+        """
+        Bloque jusqu'à ce que la requête puisse partir. Retourne un jeton à passer à adjust().
+        """
+        start = time.monotonic()
+        ticket = self._enqueue(priority)
+        try:
+            while True:
+                result = self._poll(ticket, tokens)
+                if isinstance(result, tuple):
+                    break
+                with self._cond:
+                    self._cond.wait(timeout=result if result is not None else 0.05)
+        except BaseException:
+            self._cancel(ticket)
+            raise
+        self._record_wait(time.monotonic() - start)
+        return result[1]
+
+    async def aacquire(self, tokens, priority=PRIORITY_NORMAL):
+        start = time.monotonic()
+        ticket = self._enqueue(priority)
+        try:
+            while True:
+                result = self._poll(ticket, tokens)
+                if isinstance(result, tuple):
+                    break
+                await asyncio.sleep(min(result, 0.5) if result is not None else 0.01)
+        except BaseException:
+            self._cancel(ticket)
+            raise
+        self._record_wait(time.monotonic() - start)
+        return result[1]
+
+    def _record_wait(self, seconds):
+        # Compteurs partagés par les threads et la boucle asyncio : modifiés sous le verrou
+        with self._cond:
+            self.stats_data["wait_seconds"] += seconds
+
+    def adjust(self, grant, actual_tokens):
+        """
+        Remplace l'estimation réservée par la consommation réelle.
+        """
+        with self._cond:
+            if grant in self._events:
+                self._tokens_in_window += actual_tokens - grant[1]
+            grant[1] = actual_tokens
+            self._cond.notify_all()
+
+    def penalize(self, seconds, retry=False):
+        """
+        Suspend toutes les requêtes après un 429 (le quota serveur est partagé) ;
+        `retry` : la requête refusée sera rejouée.
+        """
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self.stats_data["rate_limited"] += 1
+            self.stats_data["retries"] += int(retry)
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self._prune(now)
+            return dict(
+                self.stats_data,
+                queued=len(self._waiting),
+                requests_in_window=len(self._events),
+                tokens_in_window=self._tokens_in_window,
+            )
+
+class RateLimitedChatModel(Runnable):
+    """
+    Enveloppe d'un modèle de chat LangChain : chaque appel passe par le scheduler
+    (budget RPM/TPM estimé avec tiktoken sur le prompt rendu) et les 429 sont rejoués
+    avec backoff. Se compose dans les chaînes comme le modèle d'origine.
+    """
+    def __init__(self, llm, scheduler, priority=PRIORITY_NORMAL, max_retries=MAX_RETRIES,
+                 expected_completion_tokens=EXPECTED_COMPLETION_TOKENS):
+        self.llm = llm
+        self.scheduler = scheduler
+        self.priority = priority
+        self.max_retries = max_retries
+        self.expected_completion_tokens = expected_completion_tokens
+
+    def with_priority(self, priority):
+        return RateLimitedChatModel(self.llm, self.scheduler, priority, self.max_retries,
+                                    self.expected_completion_tokens)
+
+    def _prompt_tokens(self, input):
+        text = input.to_string() if hasattr(input, "to_string") else str(input)
+        return count_tokens(text)
+
+    @staticmethod
+    def _used_tokens(message, prompt_tokens, text):
+        usage = getattr(message, "usage_metadata", None)
+        if usage and usage.get("total_tokens"):
+            return usage["total_tokens"]
+        return prompt_tokens + count_tokens(text)
+
+    def _on_rate_limit(self, attempt, error):
+        if not is_rate_limit_error(error) or attempt >= self.max_retries:
+            return False
+        self.scheduler.penalize(backoff_delay(attempt, error), retry=True)
+        return True
+
+    def invoke(self, input, config=None, **kwargs):
+        prompt_tokens = self._prompt_tokens(input)
+        for attempt in itertools.count():
+            grant = self.scheduler.acquire(prompt_tokens + self.expected_completion_tokens, self.priority)
+            try:
+                result = self.llm.invoke(input, config, **kwargs)
+            except Exception as e:
+                self.scheduler.adjust(grant, prompt_tokens)
+                if self._on_rate_limit(attempt, e):
+                    continue
+                raise
+            self.scheduler.adjust(grant, self._used_tokens(result, prompt_tokens, result.content))
+            return result
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        prompt_tokens = self._prompt_tokens(input)
+        for attempt in itertools.count():
+            grant = await self.scheduler.aacquire(prompt_tokens + self.expected_completion_tokens, self.priority)
+            try:
+                result = await self.llm.ainvoke(input, config, **kwargs)
+            except Exception as e:
+                self.scheduler.adjust(grant, prompt_tokens)
+                if self._on_rate_limit(attempt, e):
+                    continue
+                raise
+            self.scheduler.adjust(grant, self._used_tokens(result, prompt_tokens, result.content))
+            return result
+
+    def stream(self, input, config=None, **kwargs):
+        prompt_tokens = self._prompt_tokens(input)
+        for attempt in itertools.count():
+            grant = self.scheduler.acquire(prompt_tokens + self.expected_completion_tokens, self.priority)
+            text = ""
+            started = False
+            try:
+                for chunk in self.llm.stream(input, config, **kwargs):
+                    started = True
+                    text += chunk.content
+                    yield chunk
+            except Exception as e:
+                self.scheduler.adjust(grant, prompt_tokens + count_tokens(text))
+                # Un flux déjà entamé ne peut pas être rejoué sans dupliquer les tokens
+                if not started and self._on_rate_limit(attempt, e):
+                    continue
+                raise
+            self.scheduler.adjust(grant, prompt_tokens + count_tokens(text))
+            return
+
+    async def astream(self, input, config=None, **kwargs):
+        prompt_tokens = self._prompt_tokens(input)
+        for attempt in itertools.count():
+            grant = await self.scheduler.aacquire(prompt_tokens + self.expected_completion_tokens, self.priority)
+            text = ""
+            started = False
+            try:
+                async for chunk in self.llm.astream(input, config, **kwargs):
+                    started = True
+                    text += chunk.content
+                    yield chunk
+            except Exception as e:
+                self.scheduler.adjust(grant, prompt_tokens + count_tokens(text))
+                if not started and self._on_rate_limit(attempt, e):
+                    continue
+                raise
+            self.scheduler.adjust(grant, prompt_tokens + count_tokens(text))
+            return
+
+if __name__ == "__main__":
+    # Banc d'essai local : LLM stub qui renvoie des 429, aucun appel réseau
+    from concurrent.futures import ThreadPoolExecutor
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.output_parsers import StrOutputParser
+    from stub_llm import StubChatModel
+
+    parser = argparse.ArgumentParser(description="Test du scheduler contre un LLM stub émettant des 429.")
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=int, default=120)
+    parser.add_argument("--tpm", type=int, default=20000)
+    parser.add_argument("--rate-limit-probability", type=float, default=0.2)
+    args = parser.parse_args()
+
+    stub = StubChatModel(rate_limit_probability=args.rate_limit_probability, retry_after=0.2,
+                         first_token_latency=0.02, token_latency=0.0)
+    scheduler = RateLimitScheduler(args.rpm, args.tpm)
+    chain = (ChatPromptTemplate.from_messages([("human", "{question}")])
+             | RateLimitedChatModel(stub, scheduler, expected_completion_tokens=50)
+             | StrOutputParser())
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        answers = list(pool.map(lambda i: chain.invoke({"question": f"question {i}"}), range(args.requests)))
+    elapsed = time.monotonic() - start
+    print(f"✅ {len(answers)}/{args.requests} réponses en {elapsed:.1f} s ({len(answers) / elapsed * 60:.0f} req/min)")
+    print(f"📊 {scheduler.stats()}")
@@ -0,0 +1,157 @@
+import os
+import time
+import argparse
+import threading
+from collections import deque
+
+import numpy as np
+
+from cache import TTLCache, normalize_query
+from metrics import METRICS, SCORE_BUCKETS
+
+# --- CONFIGURATION ---
+# Cross-encoder multilingue léger (MiniLM 12 couches, 384 dims), exécuté sur CPU
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))   # Candidats issus de la fusion
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "3"))              # Chunks envoyés au LLM
+# Au-delà : les candidats non scorés gardent l'ordre de la recherche hybride. À ajuster sur la
+# latence mesurée par `python reranker.py --benchmark` (le modèle 12 couches dépasse souvent 250 ms sur CPU)
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "250"))
+# Désactivé par défaut tant que le budget n'est pas calibré sur le CPU de déploiement
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"
+RERANK_BATCH_SIZE = 8
+RERANK_MAX_LENGTH = 256
+
+# Même histogramme que retrieval.py (label kind="rerank")
+RETRIEVAL_TOP_SCORE = METRICS.histogram(
+    "rag_retrieval_top_score", "Score du meilleur résultat (distance L2 FAISS, score BM25, logit du reranker).",
+    SCORE_BUCKETS)
+RERANK_FALLBACKS = METRICS.counter("rag_rerank_fallbacks_total", "Reranking abandonné (budget de latence dépassé).")
+
+class CrossEncoderReranker:
+    """
+    Second passage de scoring (question, chunk) par un cross-encoder, sous budget de latence.
+    Les paires sont évaluées par lots dans l'ordre de la recherche vectorielle et mises en cache ;
+    si le lot suivant (durée estimée sur le dernier lot mesuré) dépasserait le budget, on s'arrête
+    sans le lancer : les candidats déjà scorés sont classés en tête, les autres suivent dans l'ordre
+    de la recherche.
+    """
+    def __init__(self, model_name=RERANK_MODEL, budget_ms=RERANK_BUDGET_MS,
+                 batch_size=RERANK_BATCH_SIZE, cache_size=20000):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu", max_length=RERANK_MAX_LENGTH)
+        self.budget_ms = budget_ms
+        self.batch_size = batch_size
+        self.cache = TTLCache(max_entries=cache_size, ttl_seconds=24 * 3600)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.calls = 0
+        self.fallbacks = 0
+        # Durée d'un lot mesurée aux appels précédents : le premier lot est lui aussi soumis au budget
+        self.batch_ms_estimate = 0.0
+
+    def rerank(self, query, docs, top_n=RERANK_TOP_N):
+        start = time.perf_counter()
+        key = normalize_query(query)
+        scores = [self.cache.get((key, doc.id or doc.page_content)) for doc in docs]
+        pending = [i for i, score in enumerate(scores) if score is None]
+
+        fallback = False
+        last_batch_ms = self.batch_ms_estimate
+        for b in range(0, len(pending), self.batch_size):
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            # Lot suivant prévu hors budget : on s'arrête avant de le lancer
+            if elapsed_ms + last_batch_ms > self.budget_ms:
+                fallback = True
+                if b == 0:
+                    # Rien mesuré sur cet appel : l'estimation décroît pour retenter le modèle plus tard
+                    # (sinon une seule mesure à froid imposerait le repli à tous les appels suivants)
+                    self.batch_ms_estimate /= 2
+                break
+            batch = pending[b:b + self.batch_size]
+            batch_start = time.perf_counter()
+            predicted = self.model.predict([(query, docs[i].page_content) for i in batch],
+                                           batch_size=self.batch_size, show_progress_bar=False)
+            last_batch_ms = (time.perf_counter() - batch_start) * 1000
+            self.batch_ms_estimate = last_batch_ms
+            for i, score in zip(batch, predicted):
+                scores[i] = float(score)
+                self.cache.put((key, docs[i].id or docs[i].page_content), scores[i])
+
+        # Scores partiels conservés : non scoré = -inf, donc après les scorés, dans l'ordre d'origine (tri stable)
+        order = np.argsort(-np.asarray([-np.inf if score is None else score for score in scores], dtype=np.float32),
+                           kind="stable")
+        ranked = [docs[i] for i in order[:top_n]]
+        if ranked and scores[order[0]] is not None:
+            RETRIEVAL_TOP_SCORE.observe(scores[order[0]], kind="rerank")
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.calls += 1
+            self.fallbacks += int(fallback)
+            self._latencies.append(latency_ms)
+        if fallback:
+            RERANK_FALLBACKS.inc()
+        return ranked
+
+    def stats(self):
+        with self._lock:
+            latencies = np.asarray(self._latencies) if self._latencies else np.zeros(1)
+            return {
+                "calls": self.calls,
+                "fallbacks": self.fallbacks,
+                "mean_ms": float(latencies.mean()),
+                "p95_ms": float(np.percentile(latencies, 95)),
+                "pair_cache": self.cache.stats(),
+            }
+
+def load_reranker():
+    """
+    Charge le reranker si activé (RERANK_ENABLED=1). Retourne None en cas d'échec :
+    le moteur continue alors avec l'ordre de la recherche hybride.
+    """
+    if not RERANK_ENABLED:
+        return None
+    try:
+        return CrossEncoderReranker()
+    except Exception as e:
+        print(f"⚠️  Reranker indisponible ({e}), ordre vectoriel conservé.")
+        return None
+
+# --- CALIBRAGE DU BUDGET ---
+
+BENCHMARK_PASSAGE = (
+    "International students must submit official transcripts, a copy of their passport and proof of English "
+    "proficiency (TOEFL iBT 80 or IELTS 6.5). Tuition for undergraduate programs is charged per credit hour and "
+    "payable before the start of each semester. Scholarships covering up to 50% of tuition are awarded on merit. "
+)
+
+def benchmark(n_queries=20, candidates=RERANK_CANDIDATES, batch_size=RERANK_BATCH_SIZE):
+    """
+    Latence CPU du reranking complet de `candidates` chunks (sans budget ni cache), pour choisir RERANK_BUDGET_MS.
+    """
+    from langchain_core.documents import Document
+    reranker = CrossEncoderReranker(budget_ms=float("inf"), batch_size=batch_size)
+    docs = [Document(id=str(i), page_content=f"{BENCHMARK_PASSAGE * 3}({i})") for i in range(candidates)]
+    reranker.rerank("warmup", docs)
+    latencies = []
+    for q in range(n_queries):
+        start = time.perf_counter()
+        reranker.rerank(f"What are the tuition fees for program {q}?", docs)
+        latencies.append((time.perf_counter() - start) * 1000)
+    p50, p95 = np.percentile(latencies, 50), np.percentile(latencies, 95)
+    print(f"⏱️  Reranking de {candidates} candidats ({RERANK_MODEL}, lots de {batch_size}) : "
+          f"p50 {p50:.0f} ms, p95 {p95:.0f} ms, ~{reranker.batch_ms_estimate:.0f} ms par lot")
+    print(f"💡 Budget couvrant tous les candidats au p95 : RERANK_BUDGET_MS={int(np.ceil(p95))} "
+          f"(actuel : {RERANK_BUDGET_MS:.0f} ms)")
+    return latencies
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reranker cross-encoder : calibrage du budget de latence.")
+    parser.add_argument("--benchmark", action="store_true", help="Mesure la latence CPU d'un reranking complet.")
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--candidates", type=int, default=RERANK_CANDIDATES)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.queries, args.candidates)
@@ -0,0 +1,123 @@
+import threading
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict, PrivateAttr
+
+from sparse_index import reciprocal_rank_fusion
+from metrics import METRICS, SCORE_BUCKETS
+
+# --- CONFIGURATION ---
+FETCH_K = 20     # Candidats demandés à chaque recherche (dense et BM25) avant fusion
+RRF_K = 60       # Constante de lissage de la fusion RRF (valeur usuelle)
+
+RETRIEVAL_STAGE_SECONDS = METRICS.histogram(
+    "rag_retrieval_stage_seconds", "Durée des étapes de la recherche (embedding, faiss, bm25, fusion, rerank).")
+RETRIEVAL_TOP_SCORE = METRICS.histogram(
+    "rag_retrieval_top_score", "Score du meilleur résultat (distance L2 FAISS, score BM25, logit du reranker).",
+    SCORE_BUCKETS)
+RETRIEVAL_QUERIES = METRICS.counter("rag_retrieval_queries_total", "Recherches, limitées ou non à une partition.")
+
+class HybridRetriever(BaseRetriever):
+    """
+    Recherche hybride : FAISS (sémantique) + BM25 (correspondance exacte : codes de cours,
+    montants, noms d'universités), fusionnées par Reciprocal Rank Fusion.
+    Si la question cite une seule université, les deux recherches sont limitées à sa partition.
+    Avec un reranker, les `candidates` premiers résultats fusionnés sont réordonnés par
+    cross-encoder et seuls les `k` meilleurs sont conservés.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vectorstore: Any
+    bm25: Optional[Any] = None
+    partitions: Optional[Any] = None
+    k: int = 5
+    fetch_k: int = FETCH_K
+    rrf_k: int = RRF_K
+    reranker: Optional[Any] = None
+    candidates: int = FETCH_K
+    # Compteurs partagés par les threads du moteur (pool CPU, requêtes concurrentes) : lus et écrits sous verrou
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _stats: dict = PrivateAttr(default_factory=lambda: {"queries": 0, "partitioned": 0})
+
+    def dense_search(self, query, partition=None, timings=None):
+        with RETRIEVAL_STAGE_SECONDS.time(timings, "retrieval_embedding", stage="embedding"):
+            embedding = self.vectorstore.embeddings.embed_query(query)
+        with RETRIEVAL_STAGE_SECONDS.time(timings, "retrieval_faiss", stage="faiss"):
+            return self._faiss_search(embedding, partition)
+
+    def _faiss_search(self, embedding, partition):
+        if partition is None:
+            results = self.vectorstore.similarity_search_with_score_by_vector(embedding, k=self.fetch_k)
+            if results:
+                RETRIEVAL_TOP_SCORE.observe(float(results[0][1]), kind="dense")
+            return [doc for doc, _ in results]
+
+        # Recherche FAISS restreinte aux vecteurs de l'université (sélecteur d'ids)
+        index = self.vectorstore.index
+        vector = np.asarray([embedding], dtype=np.float32)
+        params = self.partitions.search_params(index, partition)
+        distances, positions = index.search(vector, self.fetch_k, params=params)
+        if len(positions[0]) and positions[0][0] != -1:
+            RETRIEVAL_TOP_SCORE.observe(float(distances[0][0]), kind="dense")
+        docs = []
+        for position in positions[0]:
+            if position == -1:
+                continue
+            doc = self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[int(position)])
+            if isinstance(doc, Document):
+                docs.append(doc)
+        return docs
+
+    def sparse_search(self, query, partition=None):
+        if self.bm25 is None:
+            return []
+        allowed = self.partitions.mask(partition) if partition is not None else None
+        results = self.bm25.search(query, k=self.fetch_k, allowed=allowed)
+        if results:
+            RETRIEVAL_TOP_SCORE.observe(results[0][1], kind="bm25")
+        return [doc_id for doc_id, _ in results]
+
+    def detect_partition(self, query):
+        if self.partitions is None:
+            return None
+        return self.partitions.detect(query)
+
+    def retrieve(self, query, timings=None):
+        """
+        Recherche complète ; le temps de chaque étape est ajouté à `timings` ("retrieval_<étape>")
+        en plus des histogrammes.
+        """
+        partition = self.detect_partition(query)
+        with self._lock:
+            self._stats["queries"] += 1
+            self._stats["partitioned"] += int(partition is not None)
+        RETRIEVAL_QUERIES.inc(partitioned=partition is not None)
+        dense_docs = self.dense_search(query, partition, timings)
+        with RETRIEVAL_STAGE_SECONDS.time(timings, "retrieval_bm25", stage="bm25"):
+            sparse_ids = self.sparse_search(query, partition)
+        limit = self.candidates if self.reranker is not None else self.k
+        with RETRIEVAL_STAGE_SECONDS.time(timings, "retrieval_fusion", stage="fusion"):
+            if not sparse_ids:
+                docs = dense_docs[:limit]
+            else:
+                by_id = {doc.id: doc for doc in dense_docs}
+                fused = reciprocal_rank_fusion([[doc.id for doc in dense_docs], sparse_ids], k=self.rrf_k)
+                docs = []
+                for doc_id in fused[:limit]:
+                    doc = by_id.get(doc_id) or self.vectorstore.docstore.search(doc_id)
+                    if isinstance(doc, Document):
+                        docs.append(doc)
+        if self.reranker is None:
+            return docs
+        with RETRIEVAL_STAGE_SECONDS.time(timings, "retrieval_rerank", stage="rerank"):
+            return self.reranker.rerank(query, docs, top_n=self.k)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return self.retrieve(query)
@@ -0,0 +1,219 @@
+import os
+import re
+import json
+import time
+import argparse
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+from index_registry import DEFAULT_CORPUS, current_index_path
+
+# --- CONFIGURATION ---
+BM25_FILE = "bm25.npz"
+BM25_VOCAB_FILE = "bm25_vocab.json"
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text):
+    """
+    Minuscules, accents retirés (université == universite), mots alphanumériques.
+    Les codes de cours et montants ("CS101", "800") restent des tokens entiers.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return TOKEN_PATTERN.findall(text)
+
+class BM25Index:
+    """
+    Index inversé BM25 compact (format CSR numpy, sans pickle).
+    Le poids BM25 de chaque posting est précalculé : une requête = une somme de poids.
+    """
+    def __init__(self, vocab, doc_ids, indptr, postings, weights):
+        self.vocab = vocab                  # terme -> numéro de ligne
+        self.doc_ids = doc_ids              # position -> id docstore
+        self.indptr = indptr                # bornes des postings par terme
+        self.postings = postings            # positions des documents
+        self.weights = weights              # idf * tf saturé, par posting
+        self.position = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+
+    @classmethod
+    def build(cls, items, k1=BM25_K1, b=BM25_B):
+        """
+        items : itérable de (doc_id, texte).
+        """
+        doc_ids, doc_terms, doc_len = [], [], []
+        vocab = {}
+        for doc_id, text in items:
+            counts = Counter(tokenize(text))
+            doc_ids.append(doc_id)
+            doc_len.append(sum(counts.values()))
+            doc_terms.append({vocab.setdefault(t, len(vocab)): c for t, c in counts.items()})
+
+        n_docs = len(doc_ids)
+        doc_len = np.asarray(doc_len, dtype=np.float32)
+        avgdl = float(doc_len.mean()) if n_docs else 0.0
+
+        # Triplets (terme, doc, tf) puis tri par terme -> CSR
+        nnz = sum(len(t) for t in doc_terms)
+        rows = np.empty(nnz, dtype=np.int32)
+        cols = np.empty(nnz, dtype=np.int32)
+        tfs = np.empty(nnz, dtype=np.float32)
+        pos = 0
+        for doc, terms in enumerate(doc_terms):
+            n = len(terms)
+            rows[pos:pos + n] = list(terms.keys())
+            cols[pos:pos + n] = doc
+            tfs[pos:pos + n] = list(terms.values())
+            pos += n
+        order = np.argsort(rows, kind="stable")
+        rows, cols, tfs = rows[order], cols[order], tfs[order]
+        df = np.bincount(rows, minlength=len(vocab)).astype(np.float32)
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+        norm = k1 * (1.0 - b + b * doc_len[cols] / max(avgdl, 1e-9))
+        weights = (idf[rows] * tfs * (k1 + 1.0) / (tfs + norm)).astype(np.float32)
+        return cls(vocab, doc_ids, indptr, cols, weights)
+
+    def save(self, folder_path):
+        terms = [None] * len(self.vocab)
+        for term, row in self.vocab.items():
+            terms[row] = term
+        # Fichiers temporaires + remplacement atomique : une sauvegarde interrompue laisse l'ancien index
+        vocab_path = os.path.join(folder_path, BM25_VOCAB_FILE)
+        with open(vocab_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"terms": terms, "doc_ids": self.doc_ids}, f, ensure_ascii=False)
+        arrays_path = os.path.join(folder_path, BM25_FILE)
+        with open(arrays_path + ".tmp", "wb") as f:
+            np.savez(f, indptr=self.indptr, postings=self.postings, weights=self.weights)
+        os.replace(vocab_path + ".tmp", vocab_path)
+        os.replace(arrays_path + ".tmp", arrays_path)
+
+    @classmethod
+    def load(cls, folder_path):
+        arrays = np.load(os.path.join(folder_path, BM25_FILE))
+        with open(os.path.join(folder_path, BM25_VOCAB_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        indptr, postings = arrays["indptr"], arrays["postings"]
+        # Vocabulaire et matrice issus de deux sauvegardes différentes (arrêt entre les deux remplacements)
+        if (len(indptr) != len(meta["terms"]) + 1 or indptr[-1] != len(postings)
+                or (len(postings) and postings.max() >= len(meta["doc_ids"]))):
+            raise ValueError(f"Index BM25 incohérent dans '{folder_path}' : relancer `python ingest_advanced.py`.")
+        vocab = {term: row for row, term in enumerate(meta["terms"])}
+        return cls(vocab, meta["doc_ids"], indptr, postings, arrays["weights"])
+
+    @staticmethod
+    def exists(folder_path):
+        return os.path.exists(os.path.join(folder_path, BM25_FILE))
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def search(self, query, k=20, allowed=None):
+        """
+        Retourne [(doc_id, score)] des k meilleurs documents.
+        `allowed` : tableau booléen optionnel (par position) restreignant la recherche.
+        """
+        rows = [self.vocab[t] for t in set(tokenize(query)) if t in self.vocab]
+        if not rows:
+            return []
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for row in rows:
+            start, end = self.indptr[row], self.indptr[row + 1]
+            scores[self.postings[start:end]] += self.weights[start:end]
+        if allowed is not None:
+            scores[~allowed] = 0.0
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.doc_ids[i], float(scores[i])) for i in top]
+
+def build_from_vectorstore(vectorstore, folder_path):
+    """
+    Construit l'index BM25 sur exactement les mêmes chunks que l'index FAISS.
+    """
+    start = time.perf_counter()
+    items = (
+        (doc_id, vectorstore.docstore.search(doc_id).page_content)
+        for doc_id in vectorstore.index_to_docstore_id.values()
+    )
+    index = BM25Index.build(items)
+    index.save(folder_path)
+    print(f"🔤 Index BM25 construit : {len(index)} chunks, {len(index.vocab)} termes "
+          f"({time.perf_counter() - start:.1f} s).")
+    return index
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fusion RRF : score(d) = somme des 1 / (k + rang) sur les listes où d apparaît.
+    rankings : listes d'ids ordonnées. Retourne les ids triés par score décroissant.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+# --- BENCHMARK ---
+
+def synthetic_corpus(n_chunks, seed=0):
+    """
+    Corpus synthétique de la taille du nôtre (~34k chunks de ~1200 caractères).
+    """
+    rng = np.random.default_rng(seed)
+    vocab = [f"w{i}" for i in range(30000)]
+    zipf = rng.zipf(1.3, size=n_chunks * 180) % len(vocab)
+    words = np.array(vocab)[zipf].reshape(n_chunks, 180)
+    for i in range(n_chunks):
+        yield f"chunk-{i}", f"Document Source: Uni {i % 5} CS{100 + i % 900} " + " ".join(words[i])
+
+def benchmark(index, n_queries=500, k=20, seed=0):
+    # Termes tirés selon leur fréquence documentaire : les mots courants (longues listes) pèsent
+    rng = np.random.default_rng(seed)
+    terms = np.array(sorted(index.vocab, key=index.vocab.get))
+    df = np.diff(index.indptr).astype(np.float64)
+    queries = [" ".join(rng.choice(terms, size=rng.integers(2, 8), p=df / df.sum())) for _ in range(n_queries)]
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        index.search(q, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies = np.asarray(latencies)
+    print(f"⏱️  BM25 sur {len(index)} chunks, {n_queries} requêtes (top-{k}) : "
+          f"moyenne {latencies.mean():.2f} ms, p50 {np.percentile(latencies, 50):.2f} ms, "
+          f"p95 {np.percentile(latencies, 95):.2f} ms, p99 {np.percentile(latencies, 99):.2f} ms")
+
+    fusion = []
+    ranking = [f"d{i}" for i in range(k)]
+    for _ in range(n_queries):
+        start = time.perf_counter()
+        reciprocal_rank_fusion([ranking, ranking[::-1]])
+        fusion.append((time.perf_counter() - start) * 1000)
+    print(f"⏱️  Fusion RRF (2 x {k} résultats) : moyenne {np.mean(fusion):.3f} ms")
+    return latencies
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index BM25 (recherche lexicale) et benchmark de latence.")
+    parser.add_argument("--benchmark", action="store_true", help="Mesure la latence par requête.")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Utilise un corpus synthétique de N chunks au lieu de l'index sur disque.")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--folder", default=None, help="Dossier de l'index (défaut : version active du corpus).")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        start = time.perf_counter()
+        bm25 = BM25Index.build(synthetic_corpus(args.synthetic))
+        print(f"🔤 Corpus synthétique : {args.synthetic} chunks indexés en {time.perf_counter() - start:.1f} s.")
+    else:
+        bm25 = BM25Index.load(args.folder or current_index_path(args.corpus))
+    if args.benchmark:
+        benchmark(bm25, n_queries=args.queries)
@@ -0,0 +1,11 @@
+import sys
+
+from engine import start_background_load
+
+# Point d'entrée du conteneur : le moteur (modèle, index, chauffe) se charge en arrière-plan
+# dans le même processus que Streamlit, avant même la première session.
+if __name__ == "__main__":
+    start_background_load()
+    from streamlit.web import cli
+    sys.argv = ["streamlit", "run", "app.py", *sys.argv[1:]]
+    sys.exit(cli.main())
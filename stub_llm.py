@@ -0,0 +1,86 @@
+import time
+import random
+import asyncio
+from typing import Any, List, Optional
+
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+class StubRateLimitError(Exception):
+    """
+    Erreur 429 simulée, avec la même forme que celle du SDK Groq (status_code + response).
+    """
+    def __init__(self, retry_after):
+        self.status_code = 429
+        self.response = httpx.Response(429, headers={"retry-after": f"{retry_after:g}"})
+        super().__init__(f"Error code: 429 - rate limit reached, retry after {retry_after:g}s")
+
+class StubChatModel(BaseChatModel):
+    """
+    LLM local déterministe remplaçant ChatGroq (tests, benchmarks, scheduler).
+    La réponse dépend uniquement de la dernière question ; la latence et les erreurs 429
+    sont paramétrables pour reproduire le comportement de l'API.
+    """
+    answer_tokens: int = 60
+    first_token_latency: float = 0.05
+    token_latency: float = 0.002
+    rate_limit_probability: float = 0.0
+    fail_first_n: int = 0
+    retry_after: float = 0.1
+    seed: int = 0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-chat"
+
+    def _maybe_fail(self):
+        self.calls += 1
+        rng = random.Random(self.seed * 1_000_003 + self.calls)
+        if self.calls <= self.fail_first_n or rng.random() < self.rate_limit_probability:
+            raise StubRateLimitError(self.retry_after)
+
+    def _tokens(self, messages):
+        question = messages[-1].content if messages else ""
+        words = f"Stub answer to: {question}".split()
+        filler = ["lorem", "ipsum", "dolor", "sit", "amet"]
+        while len(words) < self.answer_tokens:
+            words.append(filler[len(words) % len(filler)])
+        return [w + " " for w in words[: self.answer_tokens]]
+
+    def _usage(self, messages, tokens):
+        prompt_tokens = sum(len(str(m.content).split()) for m in messages)
+        return {"input_tokens": prompt_tokens, "output_tokens": len(tokens),
+                "total_tokens": prompt_tokens + len(tokens)}
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        self._maybe_fail()
+        tokens = self._tokens(messages)
+        time.sleep(self.first_token_latency + self.token_latency * len(tokens))
+        message = AIMessage(content="".join(tokens), usage_metadata=self._usage(messages, tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        self._maybe_fail()
+        tokens = self._tokens(messages)
+        time.sleep(self.first_token_latency)
+        for token in tokens:
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _agenerate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        self._maybe_fail()
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self.first_token_latency + self.token_latency * len(tokens))
+        message = AIMessage(content="".join(tokens), usage_metadata=self._usage(messages, tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        self._maybe_fail()
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self.first_token_latency)
+        for token in tokens:
+            await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
@@ -0,0 +1,60 @@
+import threading
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from cache import TTLCache, SemanticAnswerCache, normalize_query
+from retrieval import HybridRetriever
+
+def run_threads(target, n=8):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+def test_normalize_query():
+    assert normalize_query("  Tuition   FEES ?") == "tuition fees"
+
+def test_ttl_cache_counters_are_exact_under_concurrency():
+    cache = TTLCache(max_entries=100)
+
+    def worker(i):
+        for j in range(500):
+            if cache.get(j % 50) is None:
+                cache.put(j % 50, j)
+
+    run_threads(worker)
+    stats = cache.stats()
+    assert stats["hits"] + stats["misses"] == 8 * 500
+    assert stats["entries"] == 50
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1
+
+def test_semantic_cache_is_scoped_by_university():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store([1.0, 0.0], "tuition at Wheeling?", "450 USD", "Wheeling.pdf", scope="Wheeling")
+    assert cache.lookup([1.0, 0.01], scope="Wheeling")[0]["answer"] == "450 USD"
+    assert cache.lookup([1.0, 0.01], scope="Qatar") is None
+    cache.ensure_fingerprint("v2")
+    assert cache.lookup([1.0, 0.01], scope="Wheeling") is None
+    assert cache.stats() == {"entries": 0, "hits": 1, "misses": 2, "hit_rate": 1 / 3, "invalidations": 1}
+
+def test_retriever_counters_are_exact_under_concurrency():
+    docs = [Document(page_content=f"chunk {i} about tuition and housing", id=str(i)) for i in range(20)]
+    vectorstore = FAISS.from_documents(docs, DeterministicFakeEmbedding(size=16))
+    retriever = HybridRetriever(vectorstore=vectorstore, k=3)
+
+    def worker(i):
+        for _ in range(50):
+            assert len(retriever.retrieve(f"question {i}")) == 3
+
+    run_threads(worker)
+    assert retriever.stats() == {"queries": 400, "partitioned": 0}
@@ -0,0 +1,75 @@
+import os
+import json
+import threading
+
+from chat_store import ChatStore, migrate_json_sessions, DEFAULT_TITLE
+
+def write_session(folder, session_id, messages, mtime):
+    path = folder / f"{session_id}.json"
+    path.write_text(json.dumps(messages), encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+    return path
+
+def test_messages_are_appended_with_their_metadata(tmp_path):
+    store = ChatStore(str(tmp_path / "chat.db"))
+    store.append_messages("s1", [{"role": "user", "content": "What are the tuition fees at Qatar University?"}])
+    store.append_messages("s1", [{"role": "assistant", "content": "450 USD", "sources": "Qatar.pdf", "ttft": 0.4}])
+    assert store.load_session("s1") == [
+        {"role": "user", "content": "What are the tuition fees at Qatar University?"},
+        {"role": "assistant", "content": "450 USD", "sources": "Qatar.pdf", "ttft": 0.4},
+    ]
+    assert store.list_sessions()[0]["title"] == "What are the tuition fees at Qatar ..."
+
+def test_sessions_are_paginated_by_last_activity(tmp_path):
+    store = ChatStore(str(tmp_path / "chat.db"))
+    for i in range(5):
+        store.append_messages(f"s{i}", [{"role": "user", "content": f"question {i}"}])
+    store.append_messages("s0", [{"role": "assistant", "content": "answer"}])
+    assert [s["id"] for s in store.list_sessions(limit=2)] == ["s0", "s4"]
+    assert [s["id"] for s in store.list_sessions(limit=2, offset=4)] == ["s1"]
+    store.delete_session("s0")
+    assert store.count_sessions() == 4 and store.load_session("s0") == []
+
+def test_concurrent_appends_from_several_threads(tmp_path):
+    store = ChatStore(str(tmp_path / "chat.db"))
+
+    def worker(i):
+        for j in range(20):
+            store.append_messages(f"s{i}", [{"role": "user", "content": f"{i}-{j}"}])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert store.count_sessions() == 4
+    assert [m["content"] for m in store.load_session("s2")] == [f"2-{j}" for j in range(20)]
+
+def test_json_sessions_are_migrated_once(tmp_path):
+    history = tmp_path / "history"
+    history.mkdir()
+    write_session(history, "old", [{"role": "user", "content": "housing?"},
+                                   {"role": "assistant", "content": "on campus", "sources": "Wheeling.pdf"}], 1000)
+    write_session(history, "empty", [], 2000)
+    (history / "broken.json").write_text("{", encoding="utf-8")
+    store = ChatStore(str(tmp_path / "chat.db"))
+
+    assert migrate_json_sessions(store, str(history)) == 2
+    assert store.load_session("old")[1] == {"role": "assistant", "content": "on campus", "sources": "Wheeling.pdf"}
+    sessions = {s["id"]: s for s in store.list_sessions()}
+    assert sessions["old"]["time"] == 1000 and sessions["empty"]["title"] == DEFAULT_TITLE
+    assert [s["id"] for s in store.list_sessions()] == ["empty", "old"]
+
+    # Relance : rien n'est importé deux fois
+    assert migrate_json_sessions(store, str(history), remove=True) == 0
+    assert len(store.load_session("old")) == 2
+    assert (history / "old.json").exists()
+
+def test_migration_can_remove_imported_files(tmp_path):
+    history = tmp_path / "history"
+    history.mkdir()
+    write_session(history, "old", [{"role": "user", "content": "housing?"}], 1000)
+    store = ChatStore(str(tmp_path / "chat.db"))
+    assert migrate_json_sessions(store, str(history), remove=True) == 1
+    assert not (history / "old.json").exists()
+    assert migrate_json_sessions(store, str(tmp_path / "missing")) == 0
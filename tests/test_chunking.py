@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+from chunking import SentenceChunker, clean_text, clean_text_multipass, synthetic_corpus, synthetic_page
+
+PAGES = synthetic_corpus(200, seed=1)
+
+def test_clean_text_matches_multipass_up_to_whitespace():
+    for page in PAGES:
+        assert clean_text(page).split() == clean_text_multipass(page).split()
+
+def test_clean_text_removes_layout_noise():
+    page = "Undergraduate Catalog 2024-2025\n\nTuition is charged per cre-\ndit hour.\n\n\n\n12\n12 | P a g e\nPage 12"
+    assert clean_text(page) == "Tuition is charged per credit hour."
+
+@pytest.mark.parametrize("policy", ["none", "sentences", "chars"])
+def test_chunks_fit_and_cover_the_page(policy):
+    chunker = SentenceChunker(chunk_size=300, overlap=80, overlap_policy=policy)
+    for page in map(clean_text, PAGES[:50]):
+        chunks = chunker.split_text(page)
+        assert all(len(chunk) <= 300 for chunk in chunks)
+        # Sans chevauchement, les chunks mis bout à bout redonnent la page
+        if policy == "none":
+            assert " ".join(chunks).split() == page.split()
+        else:
+            assert set(page.split()) <= set(" ".join(chunks).split())
+
+def test_chunks_end_at_sentence_boundaries():
+    page = clean_text(synthetic_page(random.Random(3), 1))
+    chunks = SentenceChunker(chunk_size=400, overlap=0, overlap_policy="none").split_text(page)
+    assert len(chunks) > 1
+    assert sum(chunk.rstrip()[-1] in ".?!" for chunk in chunks[:-1]) >= len(chunks) // 2
+
+def test_sentence_overlap_repeats_whole_sentences():
+    text = " ".join(f"Sentence number {i} about tuition." for i in range(40))
+    chunks = SentenceChunker(chunk_size=200, overlap=60, overlap_policy="sentences").split_text(text)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk.startswith("Sentence number")
+        assert chunk.split(".")[0] + "." in previous
+
+def test_long_sentence_is_cut_at_a_space():
+    text = "word " * 200
+    chunks = SentenceChunker(chunk_size=100, overlap=0, overlap_policy="none").split_text(text)
+    assert all(len(chunk) <= 100 and not chunk.endswith("wor") for chunk in chunks)
+    assert " ".join(chunks).split() == text.split()
+
+def test_unknown_overlap_policy_is_rejected():
+    with pytest.raises(ValueError):
+        SentenceChunker(overlap_policy="tokens")
@@ -0,0 +1,30 @@
+from langchain_core.documents import Document
+
+from compression import build_context, collect_sentences
+
+def doc(university, text):
+    return Document(page_content=text, metadata={"source": f"data/raw/{university}.pdf", "university": university})
+
+DOCS = [
+    doc("Wheeling", "Tuition is charged per credit hour. Students pay 450 USD per credit hour.\n\n"
+                    "The library opens at eight."),
+    doc("Qatar", "Housing on campus is guaranteed for first-year students. Rooms are shared."),
+    doc("Wheeling", "Students pay 450 USD per credit hour. Payment plans are available for tuition."),
+]
+
+def test_overlap_between_chunks_is_removed():
+    sentences = [sentence for _, _, _, sentence in collect_sentences(DOCS)]
+    assert sentences.count("Students pay 450 USD per credit hour.") == 1
+
+def test_report_lists_only_chunks_that_contributed_text():
+    context, report = build_context("tuition per credit hour", DOCS, budget_tokens=40)
+    assert "Tuition is charged per credit hour." in context
+    assert "Housing" not in context
+    assert 1 not in report["docs"]
+    assert report["tokens_after"] <= 40 < report["tokens_before"]
+
+def test_everything_fits_in_a_large_budget():
+    context, report = build_context("tuition", DOCS, budget_tokens=10000)
+    assert report["docs"] == [0, 1, 2]
+    assert report["kept"] == report["sentences"]
+    assert context.startswith("Document Source: Wheeling\n")
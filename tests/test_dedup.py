@@ -0,0 +1,40 @@
+import numpy as np
+
+from dedup import (NearDuplicateIndex, minhash_signature, numbers_key, merge_duplicate_metadata,
+                   promote_duplicate_source)
+
+PAGE = ("Document Source: {name}\n\nInternational students must submit official transcripts and proof of English "
+        "proficiency. Tuition is charged per credit hour at {fee} USD and payable before each semester. "
+        "Scholarships are awarded on merit to admitted undergraduate students every academic year.")
+
+def add(index, chunk_id, text):
+    index.add(chunk_id, minhash_signature(text), numbers_key(text))
+
+def find(index, text):
+    return index.find(minhash_signature(text), numbers_key(text))
+
+def test_near_duplicate_across_files_is_found():
+    index = NearDuplicateIndex()
+    add(index, "a", PAGE.format(name="Wheeling guide", fee="450"))
+    assert find(index, PAGE.format(name="Wheeling handbook", fee="450")) == "a"
+
+def test_chunks_whose_numbers_differ_are_not_merged():
+    index = NearDuplicateIndex()
+    add(index, "a", PAGE.format(name="Wheeling", fee="450"))
+    assert find(index, PAGE.format(name="Wheeling", fee="475")) is None
+
+def test_signatures_round_trip(tmp_path):
+    index = NearDuplicateIndex()
+    add(index, "a", PAGE.format(name="Wheeling", fee="450"))
+    index.save(str(tmp_path))
+    loaded = NearDuplicateIndex.load(str(tmp_path))
+    assert np.array_equal(loaded.signatures["a"], index.signatures["a"])
+    assert find(loaded, PAGE.format(name="Wheeling", fee="475")) is None
+
+def test_deleted_primary_source_is_replaced_by_a_surviving_duplicate():
+    metadata = {"source": "data/raw/A.pdf", "page": 3, "page_label": "4", "total_pages": 10, "university": "A"}
+    merge_duplicate_metadata(metadata, {"source": "data/raw/B.pdf", "page": 0, "page_label": "1", "university": "B"})
+    assert promote_duplicate_source(metadata)
+    assert metadata == {"source": "data/raw/B.pdf", "page": 0, "page_label": "1", "university": "B",
+                        "duplicate_sources": []}
+    assert not promote_duplicate_source(metadata)
@@ -0,0 +1,65 @@
+import os
+import re
+import json
+
+import numpy as np
+import pytest
+
+import embedding_backend as eb
+
+def write_tiny_model(path):
+    """
+    Petit BERT aléatoire (vocabulaire des phrases d'exemple) : export et parité testables hors ligne.
+    """
+    torch = pytest.importorskip("torch")
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    os.makedirs(path, exist_ok=True)
+    words = sorted({w for s in eb.SAMPLE_SENTENCES for w in re.findall(r"\w+", s.lower())})
+    vocab_path = os.path.join(path, "vocab.txt")
+    with open(vocab_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words))
+    BertTokenizerFast(vocab_file=vocab_path, model_max_length=eb.MAX_SEQ_LENGTH).save_pretrained(path)
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=len(words) + 5, hidden_size=64, num_hidden_layers=2, num_attention_heads=4,
+                        intermediate_size=128, max_position_embeddings=eb.MAX_SEQ_LENGTH)
+    BertModel(config).eval().save_pretrained(path)
+
+@pytest.fixture(scope="module")
+def tiny_export(tmp_path_factory):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("onnx")
+    pytest.importorskip("sentence_transformers")
+    model_dir = str(tmp_path_factory.mktemp("tiny-model"))
+    onnx_dir = str(tmp_path_factory.mktemp("tiny-onnx"))
+    write_tiny_model(model_dir)
+    eb.export_onnx(model_dir, onnx_dir)
+    return model_dir, onnx_dir
+
+def test_onnx_parity_with_torch(tiny_export):
+    model_dir, onnx_dir = tiny_export
+    cosines = eb.parity_cosines(eb.benchmark_texts(48), model_dir, onnx_dir)
+    for name, values in cosines.items():
+        assert eb.parity_ok(values), f"{name} : cosinus moyen {values.mean():.4f}, min {values.min():.4f}"
+
+def test_onnx_dynamic_padding_matches_single_texts(tiny_export):
+    model_dir, onnx_dir = tiny_export
+    texts = eb.benchmark_texts(10)
+    embeddings = eb.OnnxEmbeddings(onnx_dir, quantized=False, batch_size=4)
+    batched = np.asarray(embeddings.embed_documents(texts))
+    single = np.asarray([embeddings.embed_query(text) for text in texts])
+    assert np.allclose(batched, single, atol=1e-4)
+
+@pytest.mark.skipif(not os.path.exists(os.path.join(eb.ONNX_MODEL_DIR, eb.ONNX_INT8_FILE)),
+                    reason="modèle non exporté (python embedding_backend.py --export)")
+def test_exported_model_parity():
+    pytest.importorskip("sentence_transformers")
+    cosines = eb.parity_cosines(eb.benchmark_texts(64))
+    for name, values in cosines.items():
+        assert eb.parity_ok(values), f"{name} : cosinus moyen {values.mean():.4f}, min {values.min():.4f}"
+
+def test_onnx_backend_rejects_other_model(tmp_path):
+    with open(tmp_path / eb.EXPORT_INFO_FILE, "w", encoding="utf-8") as f:
+        json.dump({"model": "sentence-transformers/all-MiniLM-L6-v2"}, f)
+    with pytest.raises(ValueError, match="all-MiniLM-L6-v2"):
+        eb.load_embeddings(eb.MODEL_EMBEDDING, backend="onnx", model_dir=str(tmp_path))
@@ -0,0 +1,110 @@
+import os
+import time
+
+import pytest
+
+import index_registry
+from index_registry import (IndexRegistry, new_version, publish_version, published_versions, current_version,
+                            clean_abandoned_versions, WRITING_FILE)
+
+@pytest.fixture(autouse=True)
+def vectorstore_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_registry, "CORPORA_ROOT", str(tmp_path / "corpora"))
+    monkeypatch.setattr(index_registry, "LEGACY_INDEX_PATH", str(tmp_path / "db_faiss"))
+    monkeypatch.setattr(index_registry, "KEEP_VERSIONS", 2)
+
+def ingest(corpus, size=1000):
+    version, folder = new_version(corpus)
+    with open(os.path.join(folder, "index.faiss"), "wb") as f:
+        f.write(b"\0" * size)
+    publish_version(corpus, version)
+    return version
+
+def registry(**kwargs):
+    # Le « retriever » est le dossier chargé : suffit à vérifier quelle version sert chaque requête
+    return IndexRegistry(loader=lambda folder: folder, poll_seconds=3600, **kwargs)
+
+# --- VERSIONS SUR DISQUE ---
+
+def test_publish_prunes_only_old_published_versions():
+    v1 = ingest("uni")
+    in_flight, in_flight_folder = new_version("uni")
+    v2 = ingest("uni")
+    v3 = ingest("uni")
+    assert current_version("uni")[0] == v3
+    assert published_versions("uni") == [v2, v3]
+    versions = os.listdir(os.path.dirname(in_flight_folder))
+    assert v1 not in versions and v2 in versions
+    # Une ingestion concurrente en cours d'écriture n'est jamais supprimée par une publication
+    assert in_flight in versions and os.path.exists(os.path.join(in_flight_folder, WRITING_FILE))
+    assert not os.path.exists(os.path.join(os.path.dirname(in_flight_folder), v3, WRITING_FILE))
+
+def test_abandoned_versions_are_cleaned_by_age():
+    ingest("uni")
+    stale, stale_folder = new_version("uni")
+    fresh, _ = new_version("uni")
+    old = time.time() - 48 * 3600
+    os.utime(os.path.join(stale_folder, WRITING_FILE), (old, old))
+    assert clean_abandoned_versions("uni", max_age_hours=24) == [stale]
+    assert fresh in os.listdir(os.path.dirname(stale_folder))
+    assert current_version("uni") is not None
+
+# --- SWAP À CHAUD ---
+
+def test_swap_keeps_in_flight_requests_on_the_old_version():
+    v1 = ingest("uni")
+    indexes = registry()
+    with indexes.acquire("uni") as old:
+        assert old.version == v1
+        v2 = ingest("uni")
+        assert indexes.refresh("uni")
+        assert old.retriever.endswith(v1)
+        with indexes.acquire("uni") as new:
+            assert new.version == v2
+        stats = indexes.stats()
+        assert stats["draining"] == [{"corpus": "uni", "version": v1, "in_flight": 1}]
+    assert indexes.stats()["draining"] == []
+    assert indexes.stats()["swaps"] == 1
+    assert not indexes.refresh("uni")
+
+def test_failed_swap_keeps_the_active_version():
+    v1 = ingest("uni")
+    indexes = IndexRegistry(loader=lambda folder: folder if folder.endswith(v1) else None, poll_seconds=3600)
+    indexes.get("uni")
+    ingest("uni")
+    indexes.refresh("uni")
+    assert indexes.get("uni").version == v1
+
+def test_unknown_corpus():
+    with pytest.raises(KeyError):
+        registry().get("missing")
+    with pytest.raises(ValueError):
+        registry().get("../etc")
+
+# --- ÉVICTION ---
+
+def test_idle_indexes_are_evicted_least_recently_used_first():
+    for corpus in ("a", "b", "c"):
+        ingest(corpus, size=400_000)
+    indexes = registry(memory_cap_mb=1.0)
+    indexes.get("a")
+    indexes.get("b")
+    with indexes.acquire("a"):
+        pass
+    indexes.get("c")
+    assert sorted(e.corpus for e in indexes.loaded()) == ["a", "c"]
+    assert indexes.stats()["evictions"] == 1
+    # Rechargé à la demande après éviction
+    assert indexes.get("b").corpus == "b"
+    assert indexes.stats()["loads"] == 4
+
+def test_indexes_in_use_are_never_evicted():
+    for corpus in ("a", "b"):
+        ingest(corpus, size=800_000)
+    indexes = registry(memory_cap_mb=1.0)
+    with indexes.acquire("a"):
+        indexes.get("b")
+        assert sorted(e.corpus for e in indexes.loaded()) == ["a", "b"]
+    ingest("c")
+    indexes.get("c")
+    assert sorted(e.corpus for e in indexes.loaded()) == ["b", "c"]
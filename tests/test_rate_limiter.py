@@ -0,0 +1,136 @@
+import time
+import asyncio
+import threading
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+import rate_limiter
+from rate_limiter import (RateLimitScheduler, RateLimitedChatModel, backoff_delay, retry_after_seconds,
+                          PRIORITY_HIGH, PRIORITY_LOW)
+from stub_llm import StubChatModel, StubRateLimitError
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    # Backoff exponentiel réduit : seul le retry-after du stub fixe l'attente
+    monkeypatch.setattr(rate_limiter, "BACKOFF_BASE", 0.001)
+
+def stub(**kwargs):
+    return StubChatModel(answer_tokens=5, first_token_latency=0.0, token_latency=0.0, **kwargs)
+
+# --- BACKOFF ET RETRY-AFTER ---
+
+def test_backoff_honours_retry_after():
+    error = StubRateLimitError(2.0)
+    assert retry_after_seconds(error) == 2.0
+    for attempt in range(3):
+        assert 2.0 <= backoff_delay(attempt, error) <= 2.0 + 0.25
+
+def test_rate_limited_call_is_retried_after_retry_after():
+    llm = stub(fail_first_n=1, retry_after=0.3)
+    scheduler = RateLimitScheduler(rpm=100, tpm=100000)
+    model = RateLimitedChatModel(llm, scheduler, expected_completion_tokens=10)
+    start = time.monotonic()
+    result = model.invoke([HumanMessage(content="frais de scolarité ?")])
+    assert time.monotonic() - start >= 0.3
+    assert result.content.startswith("Stub answer")
+    assert llm.calls == 2
+    stats = scheduler.stats()
+    assert stats["rate_limited"] == 1 and stats["retries"] == 1 and stats["granted"] == 2
+
+def test_async_stream_is_retried_after_retry_after():
+    llm = stub(fail_first_n=1, retry_after=0.2)
+    scheduler = RateLimitScheduler(rpm=100, tpm=100000)
+    model = RateLimitedChatModel(llm, scheduler, expected_completion_tokens=10)
+
+    async def run():
+        return "".join([chunk.content async for chunk in model.astream([HumanMessage(content="logement ?")])])
+
+    start = time.monotonic()
+    assert asyncio.run(run()).startswith("Stub answer")
+    assert time.monotonic() - start >= 0.2
+    assert scheduler.stats()["retries"] == 1
+
+def test_gives_up_after_max_retries():
+    llm = stub(fail_first_n=10, retry_after=0.01)
+    scheduler = RateLimitScheduler(rpm=100, tpm=100000)
+    model = RateLimitedChatModel(llm, scheduler, max_retries=2, expected_completion_tokens=10)
+    with pytest.raises(StubRateLimitError):
+        model.invoke([HumanMessage(content="bourses ?")])
+    assert llm.calls == 3
+    assert scheduler.stats()["retries"] == 2
+
+def test_retry_counters_are_exact_under_concurrency():
+    scheduler = RateLimitScheduler(rpm=1000, tpm=10 ** 7)
+    models = [RateLimitedChatModel(stub(fail_first_n=1, retry_after=0.001), scheduler, expected_completion_tokens=1)
+              for _ in range(16)]
+    threads = [threading.Thread(target=m.invoke, args=([HumanMessage(content="q")],)) for m in models]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = scheduler.stats()
+    assert stats["retries"] == stats["rate_limited"] == 16
+    assert stats["granted"] == 32
+
+# --- FENÊTRE RPM / TPM ---
+
+def test_requests_per_minute_window():
+    scheduler = RateLimitScheduler(rpm=3, tpm=10 ** 6, window=0.5)
+    start = time.monotonic()
+    for _ in range(3):
+        scheduler.acquire(10)
+    assert time.monotonic() - start < 0.1
+    scheduler.acquire(10)
+    assert time.monotonic() - start >= 0.5
+
+def test_tokens_per_minute_window():
+    scheduler = RateLimitScheduler(rpm=100, tpm=100, window=0.5)
+    start = time.monotonic()
+    scheduler.acquire(60)
+    scheduler.acquire(60)
+    assert time.monotonic() - start >= 0.5
+    assert scheduler.stats()["tokens_in_window"] == 60
+
+def test_adjust_releases_reserved_tokens():
+    scheduler = RateLimitScheduler(rpm=100, tpm=100, window=5.0)
+    grant = scheduler.acquire(60)
+    scheduler.adjust(grant, 10)
+    start = time.monotonic()
+    scheduler.acquire(60)
+    assert time.monotonic() - start < 0.1
+    assert scheduler.stats()["tokens_in_window"] == 70
+
+# --- PRIORITÉS ---
+
+def test_higher_priority_is_served_first():
+    scheduler = RateLimitScheduler(rpm=1, tpm=10 ** 6, window=0.3)
+    scheduler.acquire(1)
+    order = []
+
+    def request(name, priority):
+        scheduler.acquire(1, priority)
+        order.append(name)
+
+    low = threading.Thread(target=request, args=("low", PRIORITY_LOW))
+    high = threading.Thread(target=request, args=("high", PRIORITY_HIGH))
+    low.start()
+    time.sleep(0.05)
+    high.start()
+    time.sleep(0.05)
+    assert scheduler.stats()["queued"] == 2
+    low.join()
+    high.join()
+    assert order == ["high", "low"]
+
+def test_equal_priority_is_fifo():
+    scheduler = RateLimitScheduler(rpm=1, tpm=10 ** 6, window=0.2)
+    scheduler.acquire(1)
+    order = []
+    threads = [threading.Thread(target=lambda i=i: (scheduler.acquire(1), order.append(i))) for i in range(3)]
+    for t in threads:
+        t.start()
+        time.sleep(0.03)
+    for t in threads:
+        t.join()
+    assert order == [0, 1, 2]
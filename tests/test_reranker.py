@@ -0,0 +1,51 @@
+import sys
+import time
+import types
+
+import pytest
+from langchain_core.documents import Document
+
+class SlowCrossEncoder:
+    """
+    Cross-encoder factice : score = numéro du chunk, `delay` secondes par lot.
+    """
+    delay = 0.03
+
+    def __init__(self, *args, **kwargs):
+        self.batches = 0
+
+    def predict(self, pairs, **kwargs):
+        self.batches += 1
+        time.sleep(self.delay)
+        return [float(text.split()[-1]) for _, text in pairs]
+
+@pytest.fixture
+def reranker_module(monkeypatch):
+    monkeypatch.setitem(sys.modules, "sentence_transformers", types.SimpleNamespace(CrossEncoder=SlowCrossEncoder))
+    import reranker
+    return reranker
+
+def docs(n):
+    return [Document(id=str(i), page_content=f"chunk {i}") for i in range(n)]
+
+def test_full_rerank_within_budget(reranker_module):
+    reranker = reranker_module.CrossEncoderReranker(budget_ms=10000, batch_size=4)
+    ranked = reranker.rerank("frais", docs(8), top_n=3)
+    assert [d.id for d in ranked] == ["7", "6", "5"]
+    assert reranker.stats()["fallbacks"] == 0
+
+def test_budget_keeps_partial_scores(reranker_module):
+    reranker = reranker_module.CrossEncoderReranker(budget_ms=50, batch_size=4)
+    ranked = reranker.rerank("frais", docs(12), top_n=6)
+    # Seul le premier lot tient dans le budget : ses chunks passent en tête, les autres gardent leur ordre
+    assert reranker.model.batches == 1
+    assert [d.id for d in ranked] == ["3", "2", "1", "0", "4", "5"]
+    assert reranker.stats()["fallbacks"] == 1
+
+def test_cached_scores_are_reused(reranker_module):
+    reranker = reranker_module.CrossEncoderReranker(budget_ms=10000, batch_size=4)
+    reranker.rerank("frais", docs(8), top_n=3)
+    reranker.budget_ms = 0
+    ranked = reranker.rerank("frais", docs(8), top_n=3)
+    assert reranker.model.batches == 2
+    assert [d.id for d in ranked] == ["7", "6", "5"]
@@ -0,0 +1,74 @@
+import math
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from sparse_index import BM25Index, BM25_K1, BM25_B, reciprocal_rank_fusion, synthetic_corpus, tokenize
+
+DOCS = [
+    ("a", "Tuition for CS101 is charged per credit hour."),
+    ("b", "Housing on campus: the université offers shared rooms."),
+    ("c", "Scholarships cover tuition for international students. Tuition is due before the semester."),
+    ("d", "The library opens at eight and closes at midnight."),
+]
+
+def reference_scores(items, query):
+    # BM25 calculé directement à partir de la formule
+    docs = {doc_id: Counter(tokenize(text)) for doc_id, text in items}
+    avgdl = sum(sum(c.values()) for c in docs.values()) / len(docs)
+    scores = {}
+    for doc_id, counts in docs.items():
+        dl, score = sum(counts.values()), 0.0
+        for term in set(tokenize(query)):
+            df = sum(term in c for c in docs.values())
+            if not counts[term]:
+                continue
+            idf = math.log(1.0 + (len(docs) - df + 0.5) / (df + 0.5))
+            tf = counts[term]
+            score += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * dl / avgdl))
+        if score:
+            scores[doc_id] = score
+    return scores
+
+def test_tokenize_strips_accents_and_keeps_codes():
+    assert tokenize("Université CS101 : 800 $") == ["universite", "cs101", "800"]
+
+@pytest.mark.parametrize("query", ["tuition", "tuition credit hour", "universite housing", "CS101", "w1 w2 w30"])
+def test_scores_match_the_bm25_formula(query):
+    items = DOCS + list(synthetic_corpus(50))
+    expected = reference_scores(items, query)
+    results = BM25Index.build(items).search(query, k=len(items))
+    assert {doc_id for doc_id, _ in results} == set(expected)
+    for doc_id, score in results:
+        assert score == pytest.approx(expected[doc_id], rel=1e-5)
+    assert [s for _, s in results] == sorted((s for _, s in results), reverse=True)
+
+def test_exact_course_code_ranks_first():
+    assert BM25Index.build(DOCS).search("fees for cs101")[0][0] == "a"
+
+def test_allowed_mask_restricts_results():
+    index = BM25Index.build(DOCS)
+    allowed = np.array([False, False, True, True])
+    assert [doc_id for doc_id, _ in index.search("tuition", allowed=allowed)] == ["c"]
+    assert index.search("unknown words") == []
+
+def test_save_and_load_round_trip(tmp_path):
+    index = BM25Index.build(DOCS)
+    index.save(str(tmp_path))
+    assert not list(tmp_path.glob("*.tmp"))
+    loaded = BM25Index.load(str(tmp_path))
+    assert loaded.search("tuition semester") == index.search("tuition semester")
+
+def test_files_from_different_saves_are_rejected(tmp_path):
+    BM25Index.build(DOCS).save(str(tmp_path))
+    vocab = (tmp_path / "bm25_vocab.json").read_text(encoding="utf-8")
+    BM25Index.build(DOCS[:2]).save(str(tmp_path))
+    (tmp_path / "bm25_vocab.json").write_text(vocab, encoding="utf-8")
+    with pytest.raises(ValueError):
+        BM25Index.load(str(tmp_path))
+
+def test_reciprocal_rank_fusion():
+    # "b" : 2e dans les deux listes, devant "a" et "c" présents une seule fois en tête
+    assert reciprocal_rank_fusion([["a", "b"], ["c", "b"]]) == ["b", "a", "c"]
+    assert reciprocal_rank_fusion([["a", "b", "c"], []]) == ["a", "b", "c"]
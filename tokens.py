@@ -0,0 +1,25 @@
+from functools import lru_cache
+
+# Encodage tiktoken utilisé comme approximation du tokenizer Llama de Groq
+TIKTOKEN_ENCODING = "cl100k_base"
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TIKTOKEN_ENCODING)
+    except Exception as e:
+        # Pas d'accès réseau au premier chargement : estimation ~4 caractères par token
+        print(f"⚠️  tiktoken indisponible ({e}), estimation approximative des tokens.")
+        return None
+
+def count_tokens(text):
+    """
+    Nombre de tokens d'un texte (tiktoken, sinon estimation par longueur).
+    """
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
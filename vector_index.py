@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import faiss
+
+from langchain_community.vectorstores import FAISS
+
+from chunk_store import ChunkStore, load_lazy_docstore
+
+from index_registry import DEFAULT_CORPUS, current_index_path
+
+# --- CONFIGURATION ---
+INDEX_CONFIG_FILE = "index_config.json"
+
+# Types d'index supportés. L'index "flat" (exact) reste toujours la référence sur disque :
+# les variantes compressées sont reconstruites à partir de lui.
+INDEX_TYPES = ["flat", "ivf", "hnsw", "ivfpq", "sq8"]
+
+TRAIN_SAMPLE = 20000     # Taille de l'échantillon d'entraînement (IVF / PQ / SQ)
+PQ_SUBQUANTIZERS = 48    # 384 dims / 48 = 8 dims par sous-vecteur
+HNSW_NEIGHBORS = 32
+ADD_BLOCK = 8192         # Vecteurs copiés par bloc (mémoire bornée pendant la conversion)
+# Lecture des index par mmap : les vecteurs (flat, SQ8, stockage HNSW) restent dans le cache de pages,
+# partagé entre workers. Les listes inversées IVF sont, elles, chargées en mémoire.
+MMAP_FLAGS = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+
+# Paramètres de recherche par défaut (compromis rappel / latence)
+DEFAULT_SEARCH_PARAMS = {
+    "flat": "",
+    "ivf": "nprobe=16",
+    "hnsw": "efSearch=64",
+    "ivfpq": "nprobe=16",
+    "sq8": "",
+}
+
+# Balayage utilisé par le rapport rappel/latence
+SWEEP_PARAMS = {
+    "flat": [""],
+    "ivf": ["nprobe=1", "nprobe=4", "nprobe=16", "nprobe=64"],
+    "hnsw": ["efSearch=16", "efSearch=32", "efSearch=64", "efSearch=128"],
+    "ivfpq": ["nprobe=4", "nprobe=16", "nprobe=64"],
+    "sq8": [""],
+}
+
+def choose_nlist(n_vectors):
+    """
+    Nombre de listes IVF : ~4*sqrt(N), borné pour garder >= 39 points d'entraînement par liste.
+    """
+    return max(1, min(int(4 * np.sqrt(n_vectors)), n_vectors // 39))
+
+def factory_string(index_type, n_vectors):
+    nlist = choose_nlist(n_vectors)
+    return {
+        "flat": "Flat",
+        "ivf": f"IVF{nlist},Flat",
+        "hnsw": f"HNSW{HNSW_NEIGHBORS},Flat",
+        "ivfpq": f"IVF{nlist},PQ{PQ_SUBQUANTIZERS}x8",
+        "sq8": "SQ8",
+    }[index_type]
+
+def iter_vectors(index, block=ADD_BLOCK):
+    """
+    Relit les vecteurs d'un index par blocs (sans tout matérialiser en mémoire).
+    """
+    for start in range(0, index.ntotal, block):
+        yield index.reconstruct_n(start, min(block, index.ntotal - start))
+
+def sample_vectors(index, size, seed=0):
+    rng = np.random.default_rng(seed)
+    size = min(size, index.ntotal)
+    ids = np.sort(rng.choice(index.ntotal, size=size, replace=False))
+    return np.vstack([index.reconstruct(int(i)) for i in ids]).astype(np.float32)
+
+def build_index(flat_index, index_type, train_sample=TRAIN_SAMPLE):
+    """
+    Construit un index compressé/approché à partir de l'index exact.
+    Les positions (ids 0..N-1) sont conservées, donc le mapping docstore reste valide.
+    """
+    if index_type == "flat":
+        return flat_index
+    n = flat_index.ntotal
+    index = faiss.index_factory(flat_index.d, factory_string(index_type, n), flat_index.metric_type)
+    if not index.is_trained:
+        sample = sample_vectors(flat_index, max(train_sample, 39 * choose_nlist(n)))
+        index.train(sample)
+    for block in iter_vectors(flat_index):
+        index.add(block)
+    return index
+
+def apply_search_params(index, params):
+    if params:
+        faiss.ParameterSpace().set_index_parameters(index, params)
+
+def index_file_name(index_type):
+    return "index.faiss" if index_type == "flat" else f"index_{index_type}.faiss"
+
+def read_index_config(folder_path):
+    path = os.path.join(folder_path, INDEX_CONFIG_FILE)
+    if not os.path.exists(path):
+        return {"type": "flat", "file": "index.faiss", "search_params": ""}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def write_index_atomic(index, path):
+    # Remplacement atomique : un processus qui a mappé l'ancien fichier continue de le lire
+    tmp_path = path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+def save_compressed_index(folder_path, flat_index, index_type, search_params=None):
+    """
+    Construit et écrit la variante `index_type` à côté de l'index exact,
+    puis la désigne comme index actif dans index_config.json.
+    """
+    start = time.perf_counter()
+    index = build_index(flat_index, index_type)
+    params = DEFAULT_SEARCH_PARAMS[index_type] if search_params is None else search_params
+    file_name = index_file_name(index_type)
+    if index_type != "flat":
+        write_index_atomic(index, os.path.join(folder_path, file_name))
+    config = {
+        "type": index_type,
+        "file": file_name,
+        "factory": factory_string(index_type, flat_index.ntotal),
+        "search_params": params,
+        "ntotal": index.ntotal,
+    }
+    tmp_path = os.path.join(folder_path, INDEX_CONFIG_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    os.replace(tmp_path, os.path.join(folder_path, INDEX_CONFIG_FILE))
+    print(f"🗜️  Index '{index_type}' ({config['factory']}) construit en {time.perf_counter() - start:.1f} s.")
+    return config
+
+def load_vectorstore(folder_path, embeddings):
+    """
+    Charge le vector store avec l'index actif déclaré dans index_config.json
+    (flat par défaut), quel que soit son type (IVF, HNSW, PQ, SQ8).
+    Index lu par mmap, chunks lus à la demande (format sans pickle de chunk_store.py) ;
+    un dossier encore au format index.pkl est refusé.
+    """
+    config = read_index_config(folder_path)
+    index = faiss.read_index(os.path.join(folder_path, config["file"]), MMAP_FLAGS)
+    apply_search_params(index, config.get("search_params", ""))
+    if not ChunkStore.exists(folder_path):
+        # Ancien index.pkl : jamais désérialisé à l'exécution
+        raise RuntimeError(f"Index au format pickle dans '{folder_path}' : "
+                           f"lancez `python chunk_store.py --convert --folder {folder_path}`.")
+    docstore, index_to_docstore_id = load_lazy_docstore(folder_path)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+# --- RAPPORT RAPPEL@K / LATENCE ---
+
+def index_size_mb(index):
+    return faiss.serialize_index(index).nbytes / 1e6
+
+def measure(index, queries, ground_truth, k):
+    """
+    Rappel@k (recouvrement avec les k voisins exacts) et latence par requête unitaire.
+    """
+    latencies = []
+    hits = 0
+    for q, truth in zip(queries, ground_truth):
+        start = time.perf_counter()
+        _, found = index.search(q[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(found[0]) & set(truth))
+    return hits / (len(queries) * k), float(np.median(latencies)), float(np.percentile(latencies, 95))
+
+def recall_latency_report(folder_path, index_types, k=3, n_queries=200, seed=1):
+    """
+    Compare chaque type d'index à l'index exact sur des requêtes tirées du corpus
+    (vecteurs légèrement bruités pour ne pas retrouver trivialement le point lui-même).
+    """
+    flat = faiss.read_index(os.path.join(folder_path, "index.faiss"))
+    rng = np.random.default_rng(seed)
+    queries = sample_vectors(flat, n_queries, seed=seed)
+    queries += rng.normal(0, queries.std() * 0.1, size=queries.shape).astype(np.float32)
+    _, ground_truth = flat.search(queries, k)
+
+    print(f"📊 Rapport rappel@{k} / latence ({flat.ntotal} vecteurs, {len(queries)} requêtes, 1 thread)")
+    print(f"{'index':<8} {'paramètres':<14} {'rappel':>7} {'p50 ms':>8} {'p95 ms':>8} {'taille Mo':>10} {'build s':>8}")
+    faiss.omp_set_num_threads(1)
+    rows = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = build_index(flat, index_type)
+        build_seconds = time.perf_counter() - start
+        size = index_size_mb(index)
+        for params in SWEEP_PARAMS[index_type]:
+            apply_search_params(index, params)
+            recall, p50, p95 = measure(index, queries, ground_truth, k)
+            rows.append({
+                "type": index_type, "params": params, "recall": recall,
+                "p50_ms": p50, "p95_ms": p95, "size_mb": size, "build_s": build_seconds,
+            })
+            print(f"{index_type:<8} {params or '-':<14} {recall:7.3f} {p50:8.3f} {p95:8.3f} {size:10.1f} {build_seconds:8.1f}")
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index FAISS compressés / approchés.")
+    parser.add_argument("--build", choices=INDEX_TYPES,
+                        help="Construit ce type d'index à partir de l'index exact et l'active.")
+    parser.add_argument("--search-params", default=None,
+                        help="Paramètres de recherche FAISS (ex: 'nprobe=32', 'efSearch=128').")
+    parser.add_argument("--report", action="store_true",
+                        help="Affiche le rapport rappel@k / latence de chaque type face à l'index exact.")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--folder", default=None, help="Dossier de l'index (défaut : version active du corpus).")
+    args = parser.parse_args()
+    folder = args.folder or current_index_path(args.corpus)
+
+    if args.build:
+        flat = faiss.read_index(os.path.join(folder, "index.faiss"))
+        save_compressed_index(folder, flat, args.build, args.search_params)
+    if args.report:
+        recall_latency_report(folder, INDEX_TYPES, k=args.k)